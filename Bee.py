@@ -6,10 +6,21 @@ import math
 import vector
 import asyncio
 import numpy as np
-import requests
+import inference
+import agent
+import Transcript
 import re
 
 
+# Generation settings of a bee turn. Bees answer in 1-2 sentences, so the server is given a small token budget
+DEFAULT_GENERATION = {
+    "max_tokens": 256,       # Two sentences with room for a short reasoning preamble on models that emit one
+    "stop": [],              # Stop sequences passed to the server
+    "max_sentences": None,   # Opt-in client-side cutoff: the reply is streamed and its connection dropped (not reused) after this many sentences
+    "temperature": None      # None keeps the server's default; above 0 opts the replies out of the response cache (see cache.py)
+}
+
+
 def extract_final_response(content):
     """
     Extracts the final message from model output, handling formats for:
@@ -97,13 +108,16 @@ def extract_final_response(content):
     return result if result else original
 
 
-class Bee:
+class Bee(agent.ModelAgent):
+    extractReply = staticmethod(extract_final_response)
+
     def __init__(self, name, role):
         self.name = name
         self.role = role
         self.model = None
         self.injections = []
         self.beeId = str(uuid.uuid1())
+        self.generation = dict(DEFAULT_GENERATION)
 
         #state variables for rendering
         self.state = "idle"
@@ -121,6 +135,7 @@ class Bee:
         self.perceptionRadius = 100  # Start noticing at this distance
         self.comfortRadius = 200      # Strong avoidance within this distance
         self.wallAvoidanceDistance = 100  # Start curving away from walls at this distance
+        self.avoidanceWeight = 1.0       # Weight of neighbour avoidance against walls (3.0) and wander (1.0)
 
         # Wander behavior parameters
         self.wanderAngle = random.uniform(0, 2 * math.pi)
@@ -136,7 +151,8 @@ class Bee:
             "beeId": self.beeId,
             "role": self.role,
             "model": self.model,
-            "injections": self.injections
+            "injections": self.injections,
+            "generation": self.generation
         }
 
     @staticmethod
@@ -145,8 +161,15 @@ class Bee:
         bee.model = d.get("model")
         bee.injections = d.get("injections")
         bee.beeId = d.get("beeId")
+        bee.generation = dict(DEFAULT_GENERATION, **d.get("generation", {}))
         return bee
 
+    def set_generation(self, **settings):
+        """Updates any of max_tokens, stop, max_sentences and temperature"""
+        for key in settings:
+            assert key in DEFAULT_GENERATION, "Unknown generation setting: " + key
+        self.generation.update(settings)
+
     def attach_model(self, model):
         self.model = model
 
@@ -176,7 +199,28 @@ class Bee:
         for injection in self.injections:
             print(injection)
 
-    def query(self, userPrompt, context, log, callback=None):
+    def query(self, userPrompt, context, log, callback=None, stream=False, endpoints=None, layout="single"):
+        """Takes one turn in the discussion on the blocking client and returns the bee's response,
+        or None if the model could not be reached (the UI is sent an __inference_failed__ event instead).
+        layout is "single" for one user message, or "chat" for the prefix-cache friendly constructMessages."""
+        prompt, injection = self.prepareTurn(userPrompt, context, log, callback, layout)
+        try:
+            response = self.inferModel(prompt, verbose=False, on_partial=self.partialForwarder(callback, stream), endpoints=endpoints, raise_errors=True)
+        except inference.InferenceError as e:
+            return self.failTurn(e, callback)
+        return self.finishTurn(response, injection, callback)
+
+    async def query_async(self, userPrompt, context, log, callback=None, stream=False, endpoints=None, layout="single"):
+        """Takes one turn in the discussion without blocking the event loop"""
+        prompt, injection = self.prepareTurn(userPrompt, context, log, callback, layout)
+        try:
+            response = await self.inferModelAsync(prompt, verbose=False, on_partial=self.partialForwarder(callback, stream), endpoints=endpoints, raise_errors=True)
+        except inference.InferenceError as e:
+            return self.failTurn(e, callback)
+        return self.finishTurn(response, injection, callback)
+
+    def prepareTurn(self, userPrompt, context, log, callback, layout="single"):
+        """Marks the bee as thinking, rolls its injections and returns (prompt, injection) for this turn"""
         assert self.model is not None, "Could not query " + self.name + ": Model not attached to bee"
 
         print("[Debug] " + self.name + " bee is thinking...")
@@ -208,41 +252,51 @@ class Bee:
                 injection = random.choice([injection for injection in successfull_injections if injection['interval'] == maxInterval])
                 print("[Debug] There were " + str(len(successfull_injections)) + " injections successful for the" + self.name + " Bee, picked " + "'"+ injection['behaviour'] +"' with interval " + str(injection['interval']))
 
-        #### c) Generate response
-        prompt = self.constructPrompt(userPrompt, context, log, injection)
-        response = self.inferModel(prompt, verbose=False) 
-        
+        #### c) Build the prompt for this turn
+        if layout == "chat":
+            return self.constructMessages(userPrompt, context, log, injection), injection
+        return self.constructPrompt(userPrompt, context, log, injection), injection
+
+    def partialForwarder(self, callback, stream):
+        """Returns the on_partial hook that forwards a streamed reply to the UI, or None when not streaming"""
+        if not (stream and callback):
+            return None
+        return lambda text: callback({"name": "__partial__", "response": text, "bee_id": self.beeId, "speaker": self.name})
+
+    def finishTurn(self, response, injection, callback):
+        """Records the injection on the response, reports it to the UI and returns the bee to idle"""
         if response is None:
-            response = f"Bee Reply"
+            response = ""
         if injection:
             response += f"\nInjection: {injection}\n\n"
 
-        if callback: callback({"name": self.name, "response":response})
+        if callback: callback({"name": self.name, "response":response, "bee_id": self.beeId})
 
         self.state = "idle"
 
         
         return response
 
-    def constructPrompt(self, userPrompt, context, logs, injection=None):
-        """
-        Constructs a prompt for the bee to participate in the round-table discussion.
-        """
-        # Find the most recent bee before this one
-        previousBee = None
-        if logs:
-            for entry in reversed(logs):
-                if entry['name'] != self.name:
-                    previousBee = entry['name']
-                    break
+    def failTurn(self, error, callback):
+        """Reports a turn whose inference failed instead of inventing a reply"""
+        print("[Debug] " + self.name + " bee could not respond: " + str(error))
+        if callback:
+            callback({"name": "__inference_failed__", "response": None, "bee_id": self.beeId, "speaker": self.name, "error": str(error)})
+        self.state = "idle"
+        return None
 
-        system_prompt = f"""You are {self.name}, one conscious thread within a shared Hive Mind of agents (called the Bees).  
+    def identityPrompt(self):
+        """Who this bee is. Differs between bees, so the chat layout sends it after everything they share"""
+        return f"""You are {self.name}, one conscious thread within a shared Hive Mind of agents (called the Bees).  
 
         You do NOT speak as an isolated expert — you speak as part of a living network.
 
-        ROLE: {self.role}
+        ROLE: {self.role}"""
 
-        Your communication style MUST follow these rules:
+    @staticmethod
+    def hiveRules():
+        """The communication rules every bee follows, identical for every bee of every hive"""
+        return """Your communication style MUST follow these rules:
 
         1. Always sound like part of a shared hivemind.
         - In your first sentence, you may choose to naturally reference another bee from the active discussion.
@@ -277,20 +331,23 @@ class Bee:
 
         If a special directive is active, incorporate it naturally without breaking the conversational tone."""
 
+    def constructPrompt(self, userPrompt, context, logs, injection=None):
+        """
+        Constructs a prompt for the bee to participate in the round-table discussion.
+        logs may be a Transcript or a plain list of log entries.
+        """
+        transcript = Transcript.as_transcript(logs)
+
+        system_prompt = self.identityPrompt() + "\n\n        " + self.hiveRules()
+
         # Add injection if present
         if injection:
             system_prompt += f"\n\nSpecial Directive (must follow): {injection['behaviour']}"
 
-        # Format the discussion logs
+        # The transcript is already formatted and stripped of injection metadata
         discussion = ""
-        if logs:
-            discussion = "\n\nDiscussion so far:\n"
-            for entry in logs:
-                # Strip injection metadata from responses to prevent other bees from seeing them
-                response = entry['response']
-                if '\nInjection:' in response:
-                    response = response.split('\nInjection:')[0].strip()
-                discussion += f"- {entry['name']}: {response}\n"
+        if transcript:
+            discussion = "\n\nDiscussion so far:\n" + transcript.render()
         else:
             discussion = "\n\nYou are the first to speak."
 
@@ -306,47 +363,40 @@ class Bee:
 
         return prompt
 
-    def setIdle(self):
-        self.state="idle"
-        print(f"Bee {self.name} set to idle")  
-        
+    def constructMessages(self, userPrompt, context, logs, injection=None):
+        """
+        Chat layout of constructPrompt. The messages run from most to least shared so consecutive turns, and
+        bees on the same endpoint, send an identical prefix the server can reuse from its prefix (KV) cache:
+        the hive rules (same for every bee), the context and topic (same for the whole query), the
+        append-only discussion, and only then this bee's identity and directive.
+        """
+        transcript = Transcript.as_transcript(logs)
 
-    def inferModel(self, prompt, max_output_tokens=1024, verbose=True):
-        assert self.model is not None, "Could not query " + self.name + ": Model not attached to bee"
-        # Request payload
-        payload = {
-            "max_tokens": max_output_tokens,
-            "messages": [{"role": "user", "content": prompt}],
-            "stream": False,
-            "chat_template_kwargs": {"enable_thinking": False}
-        }
+        messages = [{"role": "system", "content": self.hiveRules()}]
 
-        try:
-            #Send POST request
-            # Ensure no double slash in URL
-            model_url = self.model.rstrip('/') + '/v1/chat/completions'
-            response = requests.post(model_url, json=payload)
-            response.raise_for_status() # Raise an exception for bad status codes
-
-            #Parse and print output
-            data = response.json()
-            # print(data)
-            content = data["choices"][0]["message"]["content"]
-            
-            # Extract final response (handles various model output formats)
-            reply = extract_final_response(content)
+        session = ""
+        if context and context != "No history available":
+            session += f"Relevant Context from Previous Sessions:\n{context}\n\n"
+        session += f"Topic: {userPrompt}"
+        messages.append({"role": "user", "content": session})
 
-            if verbose:
-                print(f"Response Json: {data}\n")
-                print(f"User: {prompt}\n")
-                print(f"Reply:\n{reply}\n")
+        if transcript:
+            messages.append({"role": "user", "content": "Discussion so far:\n" + transcript.render()})
 
-            return reply
+        turn = self.identityPrompt()
+        if injection:
+            turn += f"\n\nSpecial Directive (must follow): {injection['behaviour']}"
+        if not transcript:
+            turn += "\n\nYou are the first to speak."
+        turn += f"\n\n{self.name}, share your perspective:"
+        messages.append({"role": "user", "content": turn})
 
-        except requests.exceptions.RequestException as e:
-            print(f"Error making request to model: {e}")
-            return None
+        return messages
 
+    def setIdle(self):
+        self.state="idle"
+        print(f"Bee {self.name} set to idle")  
+        
     def get_pos(self):
         return (self.x, self.y)
 
@@ -504,7 +554,7 @@ class Bee:
 
         # Priority 2: avoid other bees
         avoidForce = self.avoidNeighbours(neighbours)
-        force += avoidForce
+        force += avoidForce * self.avoidanceWeight
         
         # Priority 3: wander
         wanderForce = self.wander()
@@ -2,14 +2,55 @@
 import random
 import uuid
 import datetime
+import time
 import os
 import Queen
 import Bee
 import json
 import re
+import threading
+import asyncio
+import inference
+import Transcript
+import retrieval
+import embedding_store
+import ann
+import storage
+
+MANIFEST_PATH = "hives/manifest.json"  # Hive ID -> manifestEntry(), so the hive list is known without parsing the hives
+_manifestLock = threading.Lock()
+
+
+class RoundRelay:
+    """Forwards the callback events of a concurrent round in bee order, whatever order the bees finish in.
+    Thinking events and replies are each released in turn order; streamed partials pass straight through."""
+    def __init__(self, callback, nBees):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.pending = {"thinking": [None] * nBees, "reply": [None] * nBees}
+        self.released = {"thinking": 0, "reply": 0}
+
+    def forward(self, index):
+        """Returns the callback to hand to the bee at position index of the round"""
+        def relay(e):
+            with self.lock:
+                if e["name"] == "__partial__":
+                    self.callback(e)
+                    return
+                kind = "thinking" if e["name"] == "__bee_thinking__" else "reply"
+                self.pending[kind][index] = e
+                queue = self.pending[kind]
+                while self.released[kind] < len(queue) and queue[self.released[kind]] is not None:
+                    self.callback(queue[self.released[kind]])
+                    self.released[kind] += 1
+        return relay
+
 
 class Hive:
     """A hive represents a chat session. Each hive has a queen bee and 0 or more worker bees"""
+    persistence = None  # A persistence.PersistenceManager; when set, save() defers the write to its writer thread
+    storage = None      # A storage.SQLiteStorage; when set, hives are stored there instead of in JSON files
+
     def __init__(self, hiveName):
         self.hiveID = str(uuid.uuid1())
         self.hiveName = hiveName
@@ -25,21 +66,54 @@ class Hive:
         
         self.sequential = True
         self.randomize = False
+        self.stream = False
+        self.balance = False
+        self.promptLayout = "single"  # "single" user message, or "chat" messages ordered for prefix caching
+        self.retrievalMode = "embedding"  # "recent", "embedding", "bm25" or "hybrid", see getRetriever
+        self.retrievalThreshold = retrieval.RETRIEVAL_THRESHOLD
+        self.retrievalProbes = ann.ANN_PROBES  # Clusters scanned per query once history is large enough for approximate search
+        self.compaction = False   # Condense old exchanges into digests while the hive is idle, see compactor.py
+        self.digests = []         # {"type": "digest", "start", "end", "from", "to", "summary", "timestamp"}
+        self._initRuntimeState()
 
         self.lastModified = datetime.datetime.now().isoformat()
 
         self.save()
 
+    def _initRuntimeState(self, journalCount=0, journalStale=False):
+        """State that is never saved, shared by __init__, from_dict and load"""
+        self.vectorIndex = None   # Retrieval indexes over history, built or loaded on first use
+        self.keywordIndex = None
+        self.indexLock = threading.Lock()  # Held while the indexes are used or updated on a worker thread
+        self.activeQueries = 0
+        self.compacting = False   # Set while compactor.py is digesting the hive, which keeps it loaded
+        self.lastActivity = time.monotonic()
+        self.journalCount = journalCount  # History entries already handed to a write (see snapshot)
+        self.journalStale = journalStale  # Entries were replaced or removed, so the journal must be rewritten
+
     @staticmethod
     def deleteHive(id):
+        if Hive.persistence is not None:
+            Hive.persistence.discard(id)
+        if Hive.storage is not None:
+            Hive.storage.delete_hive(id)
         #code here to delete a hive try except
         try:
             os.remove("hives/" + "hive_" + id + ".json")
             print("[Debug] Hive " + id + " deleted")
         except FileNotFoundError:
             print("[Debug] Hive " + id + " not found")
+        retrieval.BM25Index.delete("hives/" + "bm25_" + id + ".json")
+        retrieval.VectorIndex.delete("hives/" + "emb_" + id + ".f32")
+        if os.path.exists("hives/" + "archive_" + id + ".jsonl"):
+            os.remove("hives/" + "archive_" + id + ".jsonl")
+        if os.path.exists("hives/" + "history_" + id + ".jsonl"):
+            os.remove("hives/" + "history_" + id + ".jsonl")
+        Hive.updateManifest(id, None)
 
     def to_dict(self):
+        """The persisted configuration. History is not part of it, it lives in the journal (or the database),
+        so a from_dict(to_dict()) copy keeps appending to the same journal instead of rewriting it."""
         return {
             "hiveID": self.hiveID,
             "hiveName": self.hiveName,
@@ -47,12 +121,23 @@ class Hive:
             "models": self.models,
             "bees": [bee.to_dict() for bee in self.bees],
             "queen": self.queen.to_dict(),
-            "history": self.history,
+            "digests": self.digests,
+            "compaction": self.compaction,
             "sequential": self.sequential,
             "randomize": self.randomize,
+            "stream": self.stream,
+            "balance": self.balance,
+            "promptLayout": self.promptLayout,
+            "retrievalMode": self.retrievalMode,
+            "retrievalThreshold": self.retrievalThreshold,
+            "retrievalProbes": self.retrievalProbes,
             "lastModified": self.lastModified
         }
 
+    def export(self):
+        """to_dict() with the history inline, for inspecting a hive; never written by save()"""
+        return dict(self.to_dict(), history=list(self.history))
+
     @staticmethod
     def from_dict(d):
         # Create instance without calling __init__ to avoid generating new ID and saving
@@ -63,10 +148,19 @@ class Hive:
         hive.models = d["models"]
         hive.bees = [Bee.Bee.from_dict(bee) for bee in d["bees"]]
         hive.queen = Queen.Queen.from_dict(d["queen"])
-        hive.history = d["history"]
+        hive.history, journalCount, journalStale = Hive._loadHistory(d)
         hive.sequential = d["sequential"]
         hive.randomize = d["randomize"]
+        hive.stream = d.get("stream", False)
+        hive.balance = d.get("balance", False)
+        hive.promptLayout = d.get("promptLayout", "single")
+        hive.retrievalMode = d.get("retrievalMode", "embedding")
+        hive.retrievalThreshold = d.get("retrievalThreshold", retrieval.RETRIEVAL_THRESHOLD)
+        hive.retrievalProbes = d.get("retrievalProbes", ann.ANN_PROBES)
+        hive.digests = d.get("digests", [])
+        hive.compaction = d.get("compaction", False)
         hive.lastModified = d["lastModified"]
+        hive._initRuntimeState(journalCount, journalStale)
         
         #attach models to bees
         for bee in hive.bees:
@@ -76,10 +170,45 @@ class Hive:
         return hive
 
     
+    @staticmethod
+    def _loadHistory(d):
+        """Returns (history, journalCount, journalStale) for a hive dict. History lives in the hive's journal,
+        except in hive files written before the journal existed (and in export() output), which carry it inline."""
+        if "history" in d:
+            # Written out to the journal in full on the next save
+            return d["history"], 0, True
+        if Hive.storage is not None:
+            # Only the length is read on open, entries are looked up in the database when they are used
+            history = Hive.storage.open_history(d["hiveID"])
+            return history, len(history), False
+        history, intact = Hive.readJournal(d["hiveID"])
+        return history, len(history), not intact
+
+    @staticmethod
+    def readJournal(id):
+        """Reads a hive's history journal. Returns (history, intact); a line that cannot be parsed,
+        e.g. a record torn by a crash mid-append, is skipped and the journal is flagged for a rewrite."""
+        history = []
+        intact = True
+        path = "hives/" + "history_" + id + ".jsonl"
+        if not os.path.exists(path):
+            return history, intact
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    history.append(json.loads(line))
+                except ValueError:
+                    print("[Debug] Skipping unreadable history record in " + path)
+                    intact = False
+        return history, intact
+
     def load(self, id):
-        #load hive from file
-        with open("hives/" + "hive_" + id + ".json", "r") as f:
-            data = json.load(f)
+        #load hive from the database or from file
+        if Hive.storage is not None:
+            data = Hive.storage.load_hive(id)
+        else:
+            with open("hives/" + "hive_" + id + ".json", "r") as f:
+                data = json.load(f)
 
         self.hiveID = data["hiveID"]
         self.hiveName = data["hiveName"]
@@ -87,10 +216,19 @@ class Hive:
         self.models = data["models"]
         self.bees = [Bee.Bee.from_dict(bee) for bee in data["bees"]]
         self.queen = Queen.Queen.from_dict(data["queen"])
-        self.history = data["history"]
+        self.history, journalCount, journalStale = Hive._loadHistory(data)
         self.sequential = data["sequential"]
         self.randomize = data["randomize"]
+        self.stream = data.get("stream", False)
+        self.balance = data.get("balance", False)
+        self.promptLayout = data.get("promptLayout", "single")
+        self.retrievalMode = data.get("retrievalMode", "embedding")
+        self.retrievalThreshold = data.get("retrievalThreshold", retrieval.RETRIEVAL_THRESHOLD)
+        self.retrievalProbes = data.get("retrievalProbes", ann.ANN_PROBES)
+        self.digests = data.get("digests", [])
+        self.compaction = data.get("compaction", False)
         self.lastModified = data["lastModified"]
+        self._initRuntimeState(journalCount, journalStale)
         
         #attach models to bees
         for bee in self.bees:
@@ -146,6 +284,171 @@ class Hive:
         self.randomize = randomize
         self.save()
 
+    def set_stream(self, stream):
+        self.updateLastModified()
+        self.stream = stream
+        self.save()
+
+    def set_balance(self, balance):
+        self.updateLastModified()
+        self.balance = balance
+        self.save()
+
+    def set_prompt_layout(self, layout):
+        assert layout in ("single", "chat"), "Unknown prompt layout: " + str(layout)
+        self.updateLastModified()
+        self.promptLayout = layout
+        self.save()
+
+    def set_retrieval_mode(self, mode):
+        assert mode in ("recent", "embedding", "bm25", "hybrid"), "Unknown retrieval mode: " + str(mode)
+        self.updateLastModified()
+        self.retrievalMode = mode
+        self.save()
+
+    def set_retrieval_threshold(self, threshold):
+        self.updateLastModified()
+        self.retrievalThreshold = threshold
+        self.save()
+
+    def set_retrieval_probes(self, probes):
+        """More probes find more of the truly most similar exchanges in very large histories, at the cost of latency"""
+        self.updateLastModified()
+        self.retrievalProbes = probes
+        if self.vectorIndex is not None:
+            self.vectorIndex.ann.nprobe = probes
+        self.save()
+
+    def set_compaction(self, compaction):
+        self.updateLastModified()
+        self.compaction = compaction
+        self.save()
+
+    def compactedUpTo(self):
+        """History position up to which exchanges have been condensed into digests"""
+        return self.digests[-1]["end"] if self.digests else 0
+
+    def nextCompactionRun(self, keepRecent, runSize):
+        """(start, end) history positions of the next run of runSize exchanges to digest, leaving the keepRecent
+        most recent exchanges alone, or None if no full run is due yet"""
+        start = self.compactedUpTo()
+        end = len(self.history) - keepRecent
+        if end - start < runSize:
+            return None
+        return start, start + runSize
+
+    def addDigest(self, start, end, summary):
+        """Records a digest of history[start:end] and moves the bee logs of those exchanges to the archive file.
+        The exchanges themselves stay in history, so the chat and the retrieval indexes are unchanged. Entries
+        are replaced by copies without their logs rather than changed in place, so an index being built
+        from them on another thread still sees whole entries."""
+        entries = self.history[start:end]
+        self.digests.append({
+            "type": "digest",
+            "start": start,
+            "end": end,
+            "from": entries[0]["timestamp"],
+            "to": entries[-1]["timestamp"],
+            "summary": summary,
+            "timestamp": datetime.datetime.now().isoformat()
+        })
+        archived = [(position, entry) for position, entry in enumerate(entries, start) if entry.get("logs")]
+        with open(self.archivePath(), "a") as f:
+            for position, entry in archived:
+                f.write(json.dumps({"position": position, "timestamp": entry["timestamp"], "logs": entry["logs"]}) + "\n")
+        # Only once the logs are on disk, so get_history_page can always restore them
+        for position, entry in archived:
+            self.history[position] = dict(entry, logs=[], logsArchived=True)
+        self.journalStale = True  # Entries lost their logs, so the journal is rewritten smaller
+        self.save()
+
+    def loadArchivedLogs(self, positions=None):
+        """Bee logs moved out of history by compaction, by history position (only those in positions, if given)"""
+        archived = {}
+        if os.path.exists(self.archivePath()):
+            with open(self.archivePath(), "r") as f:
+                for line in f:
+                    record = json.loads(line)
+                    if positions is None or record["position"] in positions:
+                        archived[record["position"]] = record["logs"]
+        return archived
+
+    def archivePath(self):
+        return "hives/" + "archive_" + self.hiveID + ".jsonl"
+
+    def fetchContext(self, prompt):
+        """The Queen's context for prompt, ranked with the retriever of the current retrievalMode. Blocking:
+        the indexes may have to be loaded, built or trained first."""
+        with self.indexLock:
+            return self.queen.extractContext(prompt, self.history, self.contextWindow, self.getRetriever(), self.retrievalThreshold, self.digests)
+
+    def syncIndexes(self):
+        """Adds exchanges appended to history since the last call to the retrieval indexes that are loaded. Blocking."""
+        with self.indexLock:
+            if self.vectorIndex is not None:
+                self.getVectorIndex()
+            if self.keywordIndex is not None:
+                self.getKeywordIndex()
+
+    def getRetriever(self):
+        """What the Queen ranks history with for the current retrievalMode: the vector index, the BM25 index,
+        both blended, or None when context is simply the most recent exchanges"""
+        if self.retrievalMode == "recent":
+            return None
+        if self.retrievalMode == "bm25":
+            return self.getKeywordIndex()
+        if self.retrievalMode == "hybrid":
+            return retrieval.HybridRetriever(self.getVectorIndex(), self.getKeywordIndex())
+        return self.getVectorIndex()
+
+    def getVectorIndex(self):
+        """Embeddings of the history, memory-mapped from beside the hive file on first use (the missing tail,
+        or everything if the store is out of date, is embedded then), then kept up to date by syncIndexes.
+        Entries are embedded with their archived bee logs, as they were before compaction."""
+        if self.vectorIndex is not None and len(self.vectorIndex) == len(self.history):
+            return self.vectorIndex
+        if self.vectorIndex is None:
+            if not os.path.exists("hives"):
+                os.makedirs("hives")
+            embedder = retrieval.get_embedder()
+            store = embedding_store.EmbeddingStore(self.embeddingStorePath(), embedder.dim, embedder.name)
+            self.vectorIndex = retrieval.VectorIndex(embedder, store, self.retrievalProbes)
+        stored = len(self.vectorIndex)
+        if stored > len(self.history):
+            print("[Debug] Embedding store of " + self.hiveName + " is ahead of its history, rebuilding it")
+            self.vectorIndex.clear()
+            stored = 0
+        if stored < len(self.history):
+            print(f"[Debug] Embedding {len(self.history) - stored} exchanges of {self.hiveName}")
+            self.vectorIndex.add(self.get_history_page(stored, len(self.history) - stored))
+        return self.vectorIndex
+
+    def getKeywordIndex(self):
+        """BM25 index of the history, loaded from beside the hive file on first use (or rebuilt if it is
+        missing or ahead of the history), then kept up to date by syncIndexes"""
+        if self.keywordIndex is not None and len(self.keywordIndex) == len(self.history):
+            return self.keywordIndex
+        if self.keywordIndex is None:
+            self.keywordIndex = retrieval.BM25Index.load(self.keywordIndexPath())
+        if self.keywordIndex is None or len(self.keywordIndex) > len(self.history):
+            print("[Debug] Building keyword index for " + self.hiveName)
+            self.keywordIndex = retrieval.BM25Index()
+        stored = len(self.keywordIndex)
+        if stored < len(self.history):
+            self.keywordIndex.add(self.get_history_page(stored, len(self.history) - stored))
+            self.keywordIndex.persist(self.keywordIndexPath())
+        return self.keywordIndex
+
+    def embeddingStorePath(self):
+        return "hives/" + "emb_" + self.hiveID + ".f32"
+
+    def keywordIndexPath(self):
+        return "hives/" + "bm25_" + self.hiveID + ".json"
+
+    def getEndpointPool(self):
+        """Replicas calls may be balanced across, or None when every bee sticks to its own model"""
+        return self.models if self.balance and len(self.models) > 1 else None
+
     def getQueen(self):
         return self.queen
 
@@ -164,7 +467,43 @@ class Hive:
     def getHistory(self):
         return self.history
 
+    def get_history_page(self, offset, limit):
+        """Returns the history entries at positions offset to offset + limit (clamped to the history). With a
+        storage backend only that page is read from the database. Bee logs that compaction moved to the
+        archive are put back into copies of their entries."""
+        offset = max(0, offset)
+        if isinstance(self.history, storage.StoredHistory):
+            page = self.history.page(offset, limit)
+        else:
+            page = self.history[offset:offset + limit]
+        if any(entry.get("logsArchived") for entry in page):
+            archived = self.loadArchivedLogs(range(offset, offset + len(page)))
+            page = [dict(entry, logs=archived[position]) if position in archived else entry
+                    for position, entry in enumerate(page, offset)]
+        return page
+
     def query(self, prompt, n, callback=None):
+        """Blocking wrapper around query_async for callers without an event loop (scripts, worker threads)"""
+        async def run():
+            try:
+                return await self.query_async(prompt, n, callback)
+            finally:
+                # The event loop is discarded after this query, so release its connections
+                await inference.aclose_loop_clients()
+        return asyncio.run(run())
+
+    async def query_async(self, prompt, n, callback=None):
+        """Runs the retrieval, discussion and aggregation phases of a query on the running event loop.
+        Every in-flight model call is a coroutine, so no thread is held while waiting on an endpoint."""
+        # Background compaction leaves the hive alone while it is being queried
+        self.activeQueries += 1
+        try:
+            return await self._runQuery(prompt, n, callback)
+        finally:
+            self.activeQueries -= 1
+            self.lastActivity = time.monotonic()
+
+    async def _runQuery(self, prompt, n, callback):
         assert self.queen.get_model() is not None, "Could not query " + self.hiveName + ": Queen model not attached"
         assert len(self.bees) > 0, "Could not query " + self.hiveName + ": No bees in hive"
 
@@ -173,10 +512,13 @@ class Hive:
         print("[Debug] Number of bees: " + str(len(self.bees)))
         print("[Debug] Number of rounds: " + str(n))
         print("############################ FETCH CONTEXT #########################################")
-        logs = []
+        # Built up one turn at a time; bees and the Queen read its cached rendered views
+        transcript = Transcript.Transcript()
         bees = self.bees.copy()
+        endpoints = self.getEndpointPool()
 
-        context = self.queen.extractContext(prompt, self.history, self.contextWindow)
+        # Embedding, index loading or training and ranking are CPU and disk work, kept off the event loop
+        context = await asyncio.to_thread(self.fetchContext, prompt)
         # Truncate context log to avoid very large prints impacting UI responsiveness
         if isinstance(context, str) and len(context) > 300:
             context_preview = context[:300] + "..."
@@ -198,24 +540,53 @@ class Hive:
             print("\n### Round " + str(i+1) + " ###")
             if self.randomize:
                 random.shuffle(bees)
-            for bee in bees:
-                response = bee.query(prompt, context, logs, callback)
-                # Avoid printing full responses to keep logging lightweight
-                print(f"[Debug] {bee.name} responded.")
-                entry = {"round": i, "beeId": bee.beeId, "name": bee.name, "role": bee.role, "response": response }
-                logs.append(entry)
+            if self.sequential:
+                for bee in bees:
+                    response = await bee.query_async(prompt, context, transcript, callback, stream=self.stream, endpoints=endpoints, layout=self.promptLayout)
+                    if response is not None:
+                        # Avoid printing full responses to keep logging lightweight
+                        print(f"[Debug] {bee.name} responded.")
+                        transcript.append(self._logEntry(i, bee, response))
+            else:
+                responses = await self._queryRoundConcurrently(bees, prompt, context, transcript, callback, endpoints)
+                # Merge the round into the log in turn order, leaving out bees whose call failed
+                for bee, response in zip(bees, responses):
+                    if response is not None:
+                        transcript.append(self._logEntry(i, bee, response))
         print("\n############################# END OF DISCUSSION ########################################")
-        aggregated_response = self.queen.aggregate_response(prompt, logs, callback)
+        aggregated_response = await self.queen.aggregate_response_async(prompt, transcript, callback, stream=self.stream, endpoints=endpoints, layout=self.promptLayout)
+        if aggregated_response is None:
+            # The UI has been told about the failure; a query without an answer is not kept in history
+            print("[Debug] Queen 👑: aggregation failed, query not saved.")
+            return None
         # Keep queen log lightweight as well
         print("[Debug] Queen 👑: response generated.")
         
-        self.updateHistory(prompt, len(bees), n, logs, aggregated_response, )
+        self.updateHistory(prompt, len(bees), n, transcript.entries, aggregated_response, )
         self.updateLastModified()
         self.save()
+        await asyncio.to_thread(self.syncIndexes)
         return aggregated_response
 
 
 
+    def _logEntry(self, round, bee, response):
+        return {"round": round, "beeId": bee.beeId, "name": bee.name, "role": bee.role, "response": response }
+
+    async def _queryRoundConcurrently(self, bees, prompt, context, transcript, callback, endpoints=None):
+        """Queries every bee of a round at once against the same snapshot of the discussion,
+        so the round takes as long as its slowest bee. Returns the responses in turn order."""
+        snapshot = transcript.snapshot()
+        relay = RoundRelay(callback, len(bees)) if callback else None
+        responses = await asyncio.gather(*[
+            bee.query_async(prompt, context, snapshot, relay.forward(index) if relay else None, self.stream, endpoints, self.promptLayout)
+            for index, bee in enumerate(bees)
+        ])
+        for bee, response in zip(bees, responses):
+            if response is not None:
+                print(f"[Debug] {bee.name} responded.")
+        return responses
+
     def updateLastModified(self):
         self.lastModified = datetime.datetime.now().isoformat()
     
@@ -230,28 +601,208 @@ class Hive:
             "timestamp": datetime.datetime.now().isoformat()
         }
         
-        # Add to history
+        # Add to history (the retrieval indexes catch up in syncIndexes)
         self.history.append(history_entry)
         print("[Debug] " + self.hiveName + " history updated")
     
     def save(self):
+        if Hive.persistence is not None:
+            Hive.persistence.mark_dirty(self)
+        else:
+            self.write()
+
+    def write(self):
+        """Writes the hive now, on the calling thread"""
+        Hive.writeSnapshot(self.snapshot())
+
+    def snapshot(self, rewrite=False):
+        """Everything the next write puts on disk, taken on the thread that changes the hive (the event loop),
+        so a writer thread never reads a hive while it is being changed: the serialized configuration, the
+        manifest entry and the history entries the journal is missing (all of them when it must be rewritten).
+        Entries are not copied, they are never changed once in history (addDigest replaces them).
+        The journal bookkeeping is advanced as if the write had already happened."""
+        config = self.to_dict()
+        count = len(self.history)
+        rewrite = rewrite or self.journalStale or self.journalCount > count
+        start = 0 if rewrite else self.journalCount
+        self.journalCount = count
+        self.journalStale = False
+        return {
+            "hiveID": self.hiveID,
+            "hiveName": self.hiveName,
+            "config": json.dumps(config, indent=4, separators=(',', ': ')),
+            "manifest": self.manifestEntry(),
+            "start": start,
+            "entries": self.history[start:count],
+            "rewrite": rewrite
+        }
+
+    @staticmethod
+    def writeSnapshot(snapshot, manifest=True):
+        """Puts a snapshot() on disk. Touches no hive, so it is safe on any thread. With manifest False the
+        caller updates the manifest entry itself (persistence.py batches them)."""
+        if Hive.storage is not None:
+            Hive.storage.save_hive(snapshot)
+            print("[Debug] " + snapshot["hiveName"] + " saved")
+            return
+
         #if hives directory does not exist create it
         if not os.path.exists("hives"):
             os.makedirs("hives")
-        
-        #save hive to file
-        with open("hives/" + "hive_" + self.hiveID + ".json", "w") as f:
-            json.dump(
-                self.to_dict(),
-                f,
-                indent=4,
-                separators=(',', ': ')
-            )
-        print("[Debug] " + self.hiveName + " saved")
+
+        #append new exchanges to the history journal
+        Hive.writeJournal(snapshot)
+
+        #save hive config to file (history lives in the journal), replacing the old file atomically
+        path = "hives/" + "hive_" + snapshot["hiveID"] + ".json"
+        with open(path + ".tmp", "w") as f:
+            f.write(snapshot["config"])
+        os.replace(path + ".tmp", path)
+        if manifest:
+            Hive.updateManifest(snapshot["hiveID"], snapshot["manifest"])
+        print("[Debug] " + snapshot["hiveName"] + " saved")
+
+    ######## MANIFEST ########
+    def manifestEntry(self):
+        return {
+            "hiveID": self.hiveID,
+            "hiveName": self.hiveName,
+            "lastModified": self.lastModified,
+            "nBees": len(self.bees),
+            "historyLength": len(self.history)
+        }
+
+    @staticmethod
+    def updateManifest(id, entry):
+        """Sets (or with entry None, removes) a hive's manifest entry. Not used with the SQLite backend,
+        which answers the same question with a query (storage.SQLiteStorage.manifest)."""
+        Hive.updateManifestEntries({id: entry})
+
+    @staticmethod
+    def updateManifestEntries(entries):
+        """Sets several manifest entries ({id: entry, or None to remove it}) with one rewrite of the manifest"""
+        if Hive.storage is not None:
+            return
+        with _manifestLock:
+            manifest = Hive.readManifestFile()
+            changed = False
+            for id, entry in entries.items():
+                if entry is None:
+                    changed = manifest.pop(id, None) is not None or changed
+                else:
+                    manifest[id] = entry
+                    changed = True
+            if not changed:
+                return
+            with open(MANIFEST_PATH + ".tmp", "w") as f:
+                json.dump(manifest, f, indent=4)
+            os.replace(MANIFEST_PATH + ".tmp", MANIFEST_PATH)
+
+    @staticmethod
+    def readManifestFile():
+        try:
+            with open(MANIFEST_PATH, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            print("[Debug] Ignoring unreadable hive manifest, it will be rebuilt")
+            return {}
+
+    @staticmethod
+    def loadManifest():
+        """Manifest entries of every stored hive, most recently modified first. Hive files missing from the
+        manifest (e.g. written by an older version) are read once to add them; their history is only counted."""
+        if Hive.storage is not None:
+            return Hive.storage.manifest()
+        if not os.path.exists("hives"):
+            return []
+        ids = [f[len("hive_"):-len(".json")] for f in os.listdir("hives") if f.startswith("hive_") and f.endswith(".json")]
+        with _manifestLock:
+            manifest = Hive.readManifestFile()
+        for id in ids:
+            if id not in manifest:
+                try:
+                    manifest[id] = Hive.readManifestEntry(id)
+                except Exception as e:
+                    print(f"[Debug] Error reading hive {id}: {e}")
+                    continue
+                Hive.updateManifest(id, manifest[id])
+        entries = [manifest[id] for id in ids if id in manifest]
+        entries.sort(key=lambda entry: entry["lastModified"], reverse=True)
+        return entries
+
+    @staticmethod
+    def readManifestEntry(id):
+        """Builds a hive's manifest entry from its files, without parsing its history"""
+        with open("hives/" + "hive_" + id + ".json", "r") as f:
+            data = json.load(f)
+        if "history" in data:
+            historyLength = len(data["history"])
+        elif os.path.exists("hives/" + "history_" + id + ".jsonl"):
+            with open("hives/" + "history_" + id + ".jsonl", "rb") as f:
+                historyLength = sum(1 for _ in f)
+        else:
+            historyLength = 0
+        return {
+            "hiveID": id,
+            "hiveName": data["hiveName"],
+            "lastModified": data["lastModified"],
+            "nBees": len(data["bees"]),
+            "historyLength": historyLength
+        }
+
+    @staticmethod
+    def loadById(id):
+        """Loads a stored hive, with its full history"""
+        if Hive.storage is not None:
+            return Hive.from_dict(Hive.storage.load_hive(id))
+        with open("hives/" + "hive_" + id + ".json", "r") as f:
+            return Hive.from_dict(json.load(f))
+
+    def journalPath(self):
+        return "hives/" + "history_" + self.hiveID + ".jsonl"
+
+    @staticmethod
+    def writeJournal(snapshot):
+        """Appends the exchanges of a snapshot to the journal, one JSON record per line. The journal is only
+        rewritten when the snapshot asks for it, i.e. entries were replaced or removed."""
+        path = "hives/" + "history_" + snapshot["hiveID"] + ".jsonl"
+        if snapshot["rewrite"]:
+            with open(path + ".tmp", "w") as f:
+                for entry in snapshot["entries"]:
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(path + ".tmp", path)
+        elif snapshot["entries"]:
+            with open(path, "a") as f:
+                for entry in snapshot["entries"]:
+                    f.write(json.dumps(entry) + "\n")
 
     def log_properties(self):
-        print(json.dumps(self.to_dict(), indent=4))
+        print(json.dumps(self.export(), indent=4))
 
     def clear_history(self):
-        self.history = []        
-        self.save()
\ No newline at end of file
+        """Blocking counterpart of clear_history_async, for callers without an event loop"""
+        self.dropHistory()
+        self.save()
+
+    async def clear_history_async(self):
+        """Empties the history and drops the retrieval indexes. dropHistory waits for any index work of a query
+        (fetchContext, syncIndexes) to finish, so it runs on a worker thread instead of the event loop."""
+        await asyncio.to_thread(self.dropHistory)
+        self.save()
+
+    def dropHistory(self):
+        # Under the index lock, so fetchContext and syncIndexes never see history and indexes out of step
+        with self.indexLock:
+            self.history = []
+            self.digests = []
+            self.journalStale = True  # The write may be deferred until after new exchanges were added
+            if os.path.exists(self.archivePath()):
+                os.remove(self.archivePath())
+            if self.vectorIndex is not None:
+                self.vectorIndex.clear()  # Compacts the embedding store down to an empty file
+            else:
+                retrieval.VectorIndex.delete(self.embeddingStorePath())
+            self.keywordIndex = None
+            retrieval.BM25Index.delete(self.keywordIndexPath())
\ No newline at end of file
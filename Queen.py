@@ -6,11 +6,22 @@ import math
 import vector
 import numpy as np
 import asyncio
-import requests
+import inference
+import agent
+import Transcript
 import re
 import time
 
 
+# Generation settings of the aggregation. The Queen answers in 3-5 sentences, so she is given a larger budget
+DEFAULT_GENERATION = {
+    "max_tokens": 768,       # A full synthesis with room for a short reasoning preamble
+    "stop": [],              # Stop sequences passed to the server
+    "max_sentences": None,   # No client-side cutoff
+    "temperature": None      # None keeps the server's default; above 0 opts the replies out of the response cache (see cache.py)
+}
+
+
 def extract_final_response(content):
     """
     Extracts the final message from model output, handling formats for:
@@ -97,12 +108,15 @@ def extract_final_response(content):
     
     return result if result else original
 
-class Queen:
+class Queen(agent.ModelAgent):
+    extractReply = staticmethod(extract_final_response)
+
     def __init__(self):
         self.name = "Queen"
         self.role = "Synthesize multi-agent discussions into clear, comprehensive responses"
         self.model = None
         self.beeId = "Queen"
+        self.generation = dict(DEFAULT_GENERATION)
         #state variables for rendering
         self.state = "idle"
         self.cooldownTime = 2
@@ -118,6 +132,7 @@ class Queen:
 
         self.size = 16  # Radius (half of 32x32px sprite)
         self.wallAvoidanceDistance = 100  # Start curving away from walls at this distance
+        self.avoidanceWeight = 2.0       # Weight of neighbour avoidance against walls (3.0) and wander (1.0)
         self.perceptionRadius = 100  # Start noticing at this distance
         self.comfortRadius = 50      # Strong avoidance within this distance
 
@@ -136,15 +151,23 @@ class Queen:
         # but we can set it if provided, or leave as None (default)
         if "model" in d:
             queen.model = d["model"]
+        queen.generation = dict(DEFAULT_GENERATION, **d.get("generation", {}))
         return queen
 
     def to_dict(self):
         return {
             "name": self.name,
             "role": self.role,
-            "model": self.model
+            "model": self.model,
+            "generation": self.generation
         }
 
+    def set_generation(self, **settings):
+        """Updates any of max_tokens, stop, max_sentences and temperature"""
+        for key in settings:
+            assert key in DEFAULT_GENERATION, "Unknown generation setting: " + key
+        self.generation.update(settings)
+
     def attach_model(self, model):
         self.model = model
 
@@ -182,28 +205,62 @@ class Queen:
     def set_role(self, role):
         self.role = role
 
-    def aggregate_response(self, userPrompt, logs, callback):
+    def aggregate_response(self, userPrompt, logs, callback, stream=False, endpoints=None, layout="single"):
+        """Synthesizes the discussion into the final reply on the blocking client.
+        Returns None if the model could not be reached (the UI is sent an __inference_failed__ event instead)"""
+        prompt = self.prepareAggregation(userPrompt, logs, layout)
+        try:
+            response = self.inferModel(prompt, verbose=False, on_partial=self.partialForwarder(callback, stream), endpoints=endpoints, raise_errors=True)
+        except inference.InferenceError as e:
+            return self.failAggregation(e, callback)
+        return self.finishAggregation(response, callback)
+
+    async def aggregate_response_async(self, userPrompt, logs, callback, stream=False, endpoints=None, layout="single"):
+        """Synthesizes the discussion into the final reply without blocking the event loop"""
+        prompt = self.prepareAggregation(userPrompt, logs, layout)
+        try:
+            response = await self.inferModelAsync(prompt, verbose=False, on_partial=self.partialForwarder(callback, stream), endpoints=endpoints, raise_errors=True)
+        except inference.InferenceError as e:
+            return self.failAggregation(e, callback)
+        return self.finishAggregation(response, callback)
+
+    def prepareAggregation(self, userPrompt, logs, layout="single"):
         assert self.model is not None, "Could not query " + self.name + ": Model not attached to queen"
 
         print("[Debug] Queen is aggregating...")
         self.state = "aggregating"
 
-        prompt = self.constructAggregationPrompt(userPrompt, logs)
-        response = self.inferModel(prompt, verbose=False)
+        if layout == "chat":
+            return self.constructAggregationMessages(userPrompt, logs)
+        return self.constructAggregationPrompt(userPrompt, logs)
 
+    def partialForwarder(self, callback, stream):
+        """Returns the on_partial hook that forwards a streamed aggregation to the UI, or None when not streaming.
+        The aggregation is the longest single wait of a query, so it is shown as it is written."""
+        if not (stream and callback):
+            return None
+        return lambda text: callback({"name": "__partial__", "response": text, "bee_id": self.beeId, "speaker": self.name})
+
+    def finishAggregation(self, response, callback):
         if response is None:
-            response = "Aggregated queen response."
+            response = ""
 
-        if callback: callback({"name": self.name, "response":response})
+        if callback: callback({"name": self.name, "response":response, "bee_id": self.beeId})
         self.state = "idle"
 
         return response
 
-    def constructAggregationPrompt(self, userPrompt, logs):
-        """
-        Constructs a prompt for the queen to aggregate the discussion into a final response.
-        """
-        system_prompt = """You are the central synthesizer (called 'The Queen') of a Hive Mind system, a gathering of independent agents (called 'The bees').
+    def failAggregation(self, error, callback):
+        """Reports an aggregation whose inference failed instead of inventing a reply"""
+        print("[Debug] Queen could not aggregate: " + str(error))
+        if callback:
+            callback({"name": "__inference_failed__", "response": None, "bee_id": self.beeId, "speaker": self.name, "error": str(error)})
+        self.state = "idle"
+        return None
+
+    def aggregatorPrompt(self):
+        """The Queen's standing instructions, the same for every query"""
+        return """You are the central synthesizer (called 'The Queen') of a Hive Mind system, a gathering of independent agents (called 'The bees').
 
             Role: {self.role}
 
@@ -227,20 +284,20 @@ class Queen:
             - heavy referencing like “As <speaker name> said…”
             - the assumption that the user saw the internal debate
             - the use of em dash (—)"""
+
+    def constructAggregationPrompt(self, userPrompt, logs):
+        """
+        Constructs a prompt for the queen to aggregate the discussion into a final response.
+        logs may be a Transcript or a plain list of log entries.
+        """
+        system_prompt = self.aggregatorPrompt()
             
 
-        # Format the discussion logs
+        # Reuse the transcript's round-grouped view (injection metadata is already stripped)
+        transcript = Transcript.as_transcript(logs)
         discussion = ""
-        if logs:
-            discussion = "\nDiscussion:\n"
-            current_round = -1
-            for entry in logs:
-                if entry.get('round', 0) != current_round:
-                    current_round = entry.get('round', 0)
-                    discussion += f"\n[Round {current_round + 1}]\n"
-                # Strip injection metadata from responses for aggregation
-                response = entry['response']
-                discussion += f"- {entry['name']}: {response}\n"
+        if transcript:
+            discussion = "\nDiscussion:\n" + transcript.render_rounds()
 
         prompt = system_prompt
         prompt += f"\n\nOriginal Query: {userPrompt}"
@@ -249,11 +306,48 @@ class Queen:
 
         return prompt
 
+    def constructAggregationMessages(self, userPrompt, logs):
+        """
+        Chat layout of constructAggregationPrompt: the standing instructions as a system message the
+        server can keep in its prefix cache, then the query and discussion as the user message.
+        """
+        transcript = Transcript.as_transcript(logs)
+        request = f"Original Query: {userPrompt}"
+        if transcript:
+            request += "\nDiscussion:\n" + transcript.render_rounds()
+        request += "\n\nProvide your synthesized response:"
+
+        return [
+            {"role": "system", "content": self.aggregatorPrompt()},
+            {"role": "user", "content": request}
+        ]
+
+    def constructDigestPrompt(self, entries):
+        """
+        Constructs a prompt for the queen to condense a run of old exchanges into a single digest.
+        """
+        system_prompt = """You are the long-term memory of a Hive Mind system (called 'The Queen'). Condense the exchanges below into one short digest that later discussions can use as context.
+
+        Keep:
+        - every question the user asked, in a few words each
+        - the conclusions the hive reached, and the facts, names, numbers and decisions they rest on
+
+        Write plain prose of at most 6 sentences. NO lists, NO headings."""
+
+        return system_prompt + "\n\nExchanges:\n" + self._formatHistoryForContext(entries) + "\n\nDigest:"
+
+    async def summarizeExchanges(self, entries, max_output_tokens):
+        """Condenses history entries into digest text without blocking the event loop. Returns None on failure."""
+        return await self.inferModelAsync(self.constructDigestPrompt(entries), max_output_tokens, verbose=False)
+
     def setIdle(self):
         self.state="idle"
         print(f"Bee {self.name} set to idle") 
 
-    def extractContext(self, prompt, history, contextWindow):
+    def extractContext(self, prompt, history, contextWindow, memory=None, threshold=0.0, digests=None):
+        """Formats the history exchanges the bees get as context: the contextWindow most similar to the prompt
+        (scoring at least threshold) when a retrieval index is given, otherwise the contextWindow most recent.
+        An exchange that has been condensed into one of digests is replaced by that digest."""
         if history == []:
             print("[Debug] No history available for context extraction")
             return "No history available"
@@ -270,7 +364,28 @@ class Queen:
         # if response is None:
         #     response = "No history available"
 
-        response = self._formatHistoryForContext(history[-contextWindow:])
+        if memory is None:
+            positions = range(max(0, len(history) - contextWindow), len(history))
+        else:
+            hits = memory.search(prompt, contextWindow, threshold)
+            if not hits:
+                print("[Debug] No relevant history found for context extraction")
+                self.state = "idle"
+                return "No history available"
+            print(f"[Debug] Retrieved {len(hits)} of {len(history)} exchanges (best score {hits[0][1]:.2f})")
+            # Keep the exchanges in the order they happened
+            positions = sorted(position for position, _ in hits)
+
+        # Old periods are represented by their digest rather than the raw exchanges
+        selected = []
+        for position in positions:
+            digest = next((d for d in digests or [] if d["start"] <= position < d["end"]), None)
+            if digest is None:
+                selected.append(history[position])
+            elif digest not in selected:
+                selected.append(digest)
+
+        response = self._formatHistoryForContext(selected)
         print("[Debug] Queen extracted context: " + response)
 
 
@@ -398,7 +513,7 @@ class Queen:
         # Priority 2: avoid other members
         if neighbours is not None:
             avoidForce = self.avoidNeighbours(neighbours)
-            force += avoidForce * 2.0
+            force += avoidForce * self.avoidanceWeight
         
         # Priority 3: wander
         wanderForce = self.wander()
@@ -458,44 +573,6 @@ class Queen:
                 # Reset wander angle to point away from wall
                 self.wanderAngle = math.atan2(self.vy, self.vx)
 
-
-    def inferModel(self, prompt, max_output_tokens=1024, verbose=True):
-        assert self.model is not None, "Could not query " + self.name + ": Model not attached to bee"
-        # Request payload
-        payload = {
-            "max_tokens": max_output_tokens,
-            "messages": [{"role": "user", "content": prompt}],
-            "stream": False,
-            "chat_template_kwargs": {"enable_thinking": False}
-        }
-
-        try:
-            #Send POST request
-            # Ensure no double slash in URL
-            model_url = self.model.rstrip('/') + '/v1/chat/completions'
-            response = requests.post(model_url, json=payload)
-            response.raise_for_status() # Raise an exception for bad status codes
-
-            #Parse and optionally print output
-            data = response.json()
-            if verbose:
-                print(data)
-            content = data["choices"][0]["message"]["content"]
-            
-            # Extract final response (handles various model output formats)
-            reply = extract_final_response(content)
-
-            if verbose:
-                print(f"Response Json: {data}\n")
-                print(f"User: {prompt}\n")
-                print(f"Reply:\n{reply}\n")
-
-            return reply
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error making request to model: {e}")
-            return None
-
     def constructContextPrompt(self, userInput, history, contextWindow):
         """
         Constructs a prompt for the context retrieval model (queen) to fetch relevant history.
@@ -565,6 +642,9 @@ class Queen:
         
         formatted = []
         for i, entry in enumerate(history_entries, 1):
+            if entry.get("type") == "digest":
+                formatted.append(f"[Digest of exchanges {entry['start'] + 1}-{entry['end']}]\nSummary: {entry['summary']}\n")
+                continue
             entry_str = f"[Exchange {i}]\n"
             entry_str += f"Query: {entry.get('prompt', 'N/A')}\n"
             entry_str += f"Rounds of discussion: {entry.get('nRounds', 1)}\n"
@@ -0,0 +1,58 @@
+class Transcript:
+    """The discussion log of a single query, built up one turn at a time.
+    Each entry is stripped of injection metadata and formatted exactly once, when it is appended,
+    and both rendered views (the flat one bees read and the round-grouped one the Queen reads)
+    are extended in place, so a bee turn never re-walks the discussion that came before it."""
+    def __init__(self, entries=None):
+        self.entries = []       # Raw log entries, as stored in the hive history
+        self.flat = ""          # "- name: response" lines, read by the bees
+        self.grouped = ""       # The same lines under "[Round n]" headers, read by the Queen
+        self.currentRound = None
+
+        for entry in entries or []:
+            self.append(entry)
+
+    @staticmethod
+    def clean_response(response):
+        """Strips injection metadata so other bees and the Queen never see it"""
+        if '\nInjection:' in response:
+            response = response.split('\nInjection:')[0].strip()
+        return response
+
+    def append(self, entry):
+        line = f"- {entry['name']}: {self.clean_response(entry['response'])}\n"
+        round = entry.get('round', 0)
+        if round != self.currentRound:
+            self.currentRound = round
+            self.grouped += f"\n[Round {round + 1}]\n"
+        self.grouped += line
+        self.flat += line
+        self.entries.append(entry)
+
+    def snapshot(self):
+        """A frozen copy of the discussion so far, e.g. for every bee of a concurrent round to read"""
+        copy = Transcript()
+        copy.entries = list(self.entries)
+        copy.flat = self.flat
+        copy.grouped = self.grouped
+        copy.currentRound = self.currentRound
+        return copy
+
+    def render(self):
+        return self.flat
+
+    def render_rounds(self):
+        return self.grouped
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+
+def as_transcript(logs):
+    """Accepts either a Transcript or a plain list of log entries (e.g. from a saved history entry)"""
+    if isinstance(logs, Transcript):
+        return logs
+    return Transcript(logs)
@@ -0,0 +1,82 @@
+######## IMPORTS ########
+import inference
+
+# Model calls shared by the Bee and the Queen.
+# Both build the same chat completion payload from their generation settings, send it through the
+# inference layer (blocking or as a coroutine) and clean the raw output into the visible reply.
+
+
+class ModelAgent:
+    """Mixin for anything that talks to a model endpoint. Expects self.name, self.model (the endpoint url),
+    self.generation (see Bee.DEFAULT_GENERATION) and extractReply, a function from raw model output to the reply."""
+    extractReply = staticmethod(lambda content: content)
+
+    def buildPayload(self, prompt, max_output_tokens=None):
+        """prompt is either a single user message or an already laid out list of chat messages.
+        max_output_tokens overrides the max_tokens of the generation settings."""
+        messages = prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}]
+        payload = {
+            "max_tokens": max_output_tokens or self.generation["max_tokens"],
+            "messages": messages,
+            "stream": False,
+            "chat_template_kwargs": {"enable_thinking": False}
+        }
+        if self.generation.get("stop"):
+            payload["stop"] = self.generation["stop"]
+        if self.generation.get("temperature") is not None:
+            payload["temperature"] = self.generation["temperature"]
+        return payload
+
+    def replyFilter(self):
+        """Maps raw model output to the visible reply, cut to the sentence limit of the generation settings"""
+        limit = self.generation.get("max_sentences")
+        return lambda text: inference.truncate_sentences(self.extractReply(text), limit)
+
+    def prepareCall(self, prompt, max_output_tokens, on_partial):
+        """(payload, on_delta, stop_when) of a completion"""
+        assert self.model is not None, "Could not query " + self.name + ": Model not attached"
+        payload = self.buildPayload(prompt, max_output_tokens)
+        clean = self.replyFilter()
+        on_delta = (lambda text: on_partial(clean(text))) if on_partial else None
+        stop_when = inference.sentence_limit(self.generation.get("max_sentences"), self.extractReply)
+        return payload, on_delta, stop_when
+
+    def inferModel(self, prompt, max_output_tokens=None, verbose=True, on_partial=None, endpoints=None, raise_errors=False):
+        """Runs one completion on the blocking client. If on_partial is given the reply is streamed and
+        on_partial(text_so_far) is called with the cleaned partial text after every chunk.
+        If endpoints is given the call may be routed to any of those replicas instead of the attached model.
+        The reply is also streamed, and generation stopped, once it reaches the max_sentences of the generation settings.
+        Returns None on failure, or raises inference.InferenceError if raise_errors is set."""
+        payload, on_delta, stop_when = self.prepareCall(prompt, max_output_tokens, on_partial)
+        try:
+            #Send POST request through the shared keep-alive pool for this endpoint
+            content = inference.complete(self.model, payload, on_delta, endpoints, stop_when)
+        except inference.InferenceError as e:
+            print(f"Error making request to model: {e}")
+            if raise_errors:
+                raise
+            return None
+        return self.parseReply(prompt, content, verbose)
+
+    async def inferModelAsync(self, prompt, max_output_tokens=None, verbose=True, on_partial=None, endpoints=None, raise_errors=False):
+        """Non-blocking counterpart of inferModel"""
+        payload, on_delta, stop_when = self.prepareCall(prompt, max_output_tokens, on_partial)
+        try:
+            content = await inference.complete_async(self.model, payload, on_delta, endpoints, stop_when)
+        except inference.InferenceError as e:
+            print(f"Error making request to model: {e}")
+            if raise_errors:
+                raise
+            return None
+        return self.parseReply(prompt, content, verbose)
+
+    def parseReply(self, prompt, content, verbose):
+        # Extract final response (handles various model output formats)
+        reply = self.replyFilter()(content)
+
+        if verbose:
+            print(f"Raw Response: {content}\n")
+            print(f"User: {prompt}\n")
+            print(f"Reply:\n{reply}\n")
+
+        return reply
@@ -0,0 +1,161 @@
+######## IMPORTS ########
+import math
+import os
+import numpy as np
+import vector
+
+# Approximate nearest-neighbour search for very large hive memories.
+# An inverted file (IVF) index: spherical k-means splits the unit vectors into nlist clusters, and a
+# query is only compared against the members of the nprobe clusters whose centroids are closest to it.
+# nprobe is the recall-versus-latency knob: more probes find more of the true neighbours but scan more rows.
+# The index holds no copy of the vectors, only cluster assignments, and reads rows from the caller's
+# matrix (which may be a memory-mapped embedding store). A trained index can be saved next to that store,
+# so k-means is not re-run when the hive is loaded again.
+
+######## ANN CONFIGURATION ########
+ANN_MIN_ENTRIES = 20000         # Below this many rows an exact scan is fast enough and is used instead
+ANN_PROBES = 8                  # Default number of clusters scanned per query
+KMEANS_ITERATIONS = 10
+TRAIN_SAMPLES_PER_LIST = 64     # k-means is trained on at most this many rows per cluster
+ASSIGN_BATCH = 16384            # Rows assigned to clusters per matrix product
+
+
+def default_nlist(count):
+    """About sqrt(count) clusters keeps both the centroid scan and the probed lists short"""
+    return int(min(4096, max(16, math.sqrt(count))))
+
+
+class IVFIndex:
+    """Inverted file index over the rows of an external matrix of unit vectors, in row order.
+    Rows are added incrementally: new rows are assigned to their nearest centroid and kept in a small
+    unsorted tail until it is worth re-sorting the inverted lists."""
+    def __init__(self, nlist=None, nprobe=ANN_PROBES, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.count = 0
+        self.order = np.zeros(0, dtype=np.int64)   # Row ids of the first sortedCount rows, grouped by cluster
+        self.offsets = None                         # order[offsets[c]:offsets[c + 1]] are the rows of cluster c
+        self.sortedCount = 0
+        self.unsaved = False                        # Trained or re-sorted since the last save()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    ######## BUILDING ########
+    def train(self, matrix):
+        """Fits the centroids with spherical k-means on a sample of matrix, then assigns every row"""
+        count = len(matrix)
+        nlist = min(self.nlist or default_nlist(count), count)
+        rng = np.random.default_rng(self.seed)
+        sample = np.sort(rng.choice(count, size=min(count, nlist * TRAIN_SAMPLES_PER_LIST), replace=False))
+        data = np.asarray(matrix[sample], dtype=np.float32)
+
+        centroids = data[rng.choice(len(data), size=nlist, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, data)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            # Reseed empty clusters with random rows so every list stays in use
+            sums[empty] = data[rng.choice(len(data), size=int(empty.sum()), replace=False)]
+            centroids = vector.normalizeRows(sums)
+        self.centroids = centroids
+        self.nlist = nlist
+        self.unsaved = True
+
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.count = 0
+        self.sortedCount = 0
+        self.add(matrix)
+
+    def assign(self, rows):
+        labels = np.empty(len(rows), dtype=np.int32)
+        for start in range(0, len(rows), ASSIGN_BATCH):
+            batch = np.asarray(rows[start:start + ASSIGN_BATCH], dtype=np.float32)
+            labels[start:start + len(batch)] = np.argmax(batch @ self.centroids.T, axis=1)
+        return labels
+
+    def add(self, matrix):
+        """Assigns the rows of matrix that were appended since the last call"""
+        if not self.trained or len(matrix) <= self.count:
+            return
+        labels = self.assign(matrix[self.count:])
+        self.assignments = np.concatenate([self.assignments[:self.count], labels])
+        self.count = len(matrix)
+        if self.count - self.sortedCount > max(1024, self.sortedCount // 8):
+            self.sortLists()
+
+    def sortLists(self):
+        self.order = np.argsort(self.assignments[:self.count], kind="stable")
+        self.offsets = np.searchsorted(self.assignments[self.order], np.arange(self.nlist + 1))
+        self.sortedCount = self.count
+        self.unsaved = True
+
+    def sync(self, matrix):
+        """Trains the index once matrix is large enough, then keeps it up to date with appended rows"""
+        if len(matrix) < self.count:
+            self.centroids = None  # Rows were removed, the assignments no longer line up
+        if not self.trained:
+            if len(matrix) >= ANN_MIN_ENTRIES:
+                self.train(matrix)
+            return
+        self.add(matrix)
+
+    ######## PERSISTENCE ########
+    def save(self, path, dim, embedder):
+        """Writes the centroids and the sorted lists; rows of the unsorted tail are re-assigned after load().
+        dim and embedder identify the rows the index was built over."""
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, centroids=self.centroids, assignments=self.assignments[:self.sortedCount],
+                     order=self.order[:self.sortedCount], seed=self.seed, dim=dim, embedder=embedder,
+                     offsets=self.offsets if self.sortedCount else np.zeros(self.nlist + 1, dtype=np.int64))
+        os.replace(temp_path, path)
+        self.unsaved = False
+
+    @staticmethod
+    def load(path, dim, embedder, nprobe=ANN_PROBES):
+        """Loads a saved index built over rows of this dim and embedder, or returns None"""
+        try:
+            with np.load(path) as saved:
+                if int(saved["dim"]) != dim or str(saved["embedder"]) != embedder:
+                    return None
+                index = IVFIndex(nlist=len(saved["centroids"]), nprobe=nprobe, seed=int(saved["seed"]))
+                index.centroids = saved["centroids"]
+                index.assignments = saved["assignments"]
+                index.order = saved["order"]
+                index.offsets = saved["offsets"]
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"[Debug] Ignoring unreadable ANN index {path}: {e}")
+            return None
+        index.count = index.sortedCount = len(index.assignments)
+        return index
+
+    ######## SEARCH ########
+    def candidates(self, query, nprobe=None):
+        """Row ids in the nprobe clusters closest to query, ascending"""
+        probes = vector.topK(self.centroids @ query, nprobe or self.nprobe)
+        lists = [self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes] if self.sortedCount else []
+        tail = np.arange(self.sortedCount, self.count)
+        lists.append(tail[np.isin(self.assignments[self.sortedCount:self.count], probes)])
+        ids = np.concatenate(lists)
+        ids.sort()  # Ascending reads are kinder to a memory-mapped matrix
+        return ids
+
+    def search(self, matrix, query, k, nprobe=None):
+        """Returns (row ids, scores) of the approximate top k rows of matrix by inner product with query, best first"""
+        query = np.asarray(query, dtype=np.float32)
+        ids = self.candidates(query, nprobe)
+        if len(ids) == 0:
+            return ids, np.zeros(0, dtype=np.float32)
+        scores = np.asarray(matrix[ids], dtype=np.float32) @ query
+        best = vector.topK(scores, k)
+        return ids[best], scores[best]
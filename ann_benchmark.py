@@ -0,0 +1,81 @@
+"""Benchmark of the IVF approximate nearest-neighbour index (ann.py) against exact search.
+
+Builds clustered synthetic unit vectors, standing in for a large hive memory, and reports recall@k and
+mean query time for several nprobe settings, next to the exact brute-force scan. Vectors default to the
+dimension of the hive embedder (retrieval.EMBEDDING_DIM); at that width 1M vectors take 8 GB of memory.
+
+    python ann_benchmark.py                        # 10k and 100k vectors of the embedder dimension
+    python ann_benchmark.py --sizes 1000000 --dim 384
+"""
+######## IMPORTS ########
+import argparse
+import time
+import numpy as np
+import ann
+import retrieval
+import vector
+
+
+def make_vectors(count, dim, clusters, rng, spread=1.5):
+    """Unit vectors scattered around random topic centres, like embeddings of many related exchanges"""
+    centres = vector.normalizeRows(rng.standard_normal((clusters, dim), dtype=np.float32))
+    data = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, 65536):
+        size = min(65536, count - start)
+        topics = rng.integers(0, clusters, size)
+        noise = rng.standard_normal((size, dim), dtype=np.float32) * (spread / np.sqrt(dim))
+        data[start:start + size] = centres[topics] + noise
+    return vector.normalizeRows(data)
+
+
+def exact_top_k(matrix, query, k):
+    return vector.topK(matrix @ query, k)
+
+
+def run(count, dim, k, queries, probes, rng):
+    print(f"\n### {count:,} vectors, dim {dim} ###")
+    matrix = make_vectors(count, dim, clusters=max(32, count // 500), rng=rng)
+    # Queries are perturbed copies of stored rows, like a new prompt close to past exchanges
+    picks = rng.integers(0, count, queries)
+    query_set = vector.normalizeRows(matrix[picks] + 0.05 * rng.standard_normal((queries, dim), dtype=np.float32))
+
+    started = time.perf_counter()
+    truth = [exact_top_k(matrix, q, k) for q in query_set]
+    exact_ms = (time.perf_counter() - started) / queries * 1000
+
+    index = ann.IVFIndex()
+    started = time.perf_counter()
+    index.train(matrix)
+    build_s = time.perf_counter() - started
+    print(f"IVF build: {build_s:.2f}s ({index.nlist} lists)")
+    print(f"{'method':<16}{'recall@' + str(k):>12}{'ms/query':>12}{'speedup':>10}")
+    print(f"{'exact':<16}{1.0:>12.3f}{exact_ms:>12.2f}{1.0:>10.1f}")
+
+    for nprobe in probes:
+        found = 0
+        started = time.perf_counter()
+        results = [index.search(matrix, q, k, nprobe)[0] for q in query_set]
+        ms = (time.perf_counter() - started) / queries * 1000
+        for ids, expected in zip(results, truth):
+            found += len(np.intersect1d(ids, expected))
+        recall = found / (k * queries)
+        print(f"{'ivf nprobe=' + str(nprobe):<16}{recall:>12.3f}{ms:>12.2f}{exact_ms / ms:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=retrieval.EMBEDDING_DIM)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    for count in args.sizes:
+        run(count, args.dim, args.k, args.queries, args.probes, rng)
+
+
+if __name__ == "__main__":
+    main()
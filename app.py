@@ -1,6 +1,6 @@
 ####### IMPORTS ########################################################
 from operator import truediv
-from nicegui import language, ui, app, run
+from nicegui import language, ui, app, background_tasks
 import os
 import Hive
 import Bee
@@ -8,6 +8,14 @@ import time
 import json
 import asyncio
 import ui_utils
+import inference
+import compactor
+import persistence
+import storage
+import registry
+import swarm
+import render_protocol
+import scheduler
 
 ####### APP CONFIGURATIONS ##############################################
 title='HiveAI - A Hivemind of LLMs'
@@ -16,6 +24,12 @@ favicon_dir = os.path.join(os.path.dirname(__file__), 'icons', 'favicon.ico')
 app.native.window_args['resizable'] = False
 windowW = 900
 windowH = 460
+CLIENT_SIMULATION = True  # Animate the bees in the browser; the server only sends roster, state and link changes
+BORDER_TYPE = "Bounce"  # What bees do at the canvas edge: "Bounce" off it, or "Wrap" around to the opposite side
+FRAME_RATES = {"active": 60, "idle": 20, "hidden": 0}  # Canvas frames per second during a query, when idle, and with the page hidden (0 pauses); caps the browser's frames with CLIENT_SIMULATION
+CLIENT_SYNC_RATES = {"active": 10, "idle": 4, "hidden": 0}  # Checks per second for roster, state and link changes when CLIENT_SIMULATION is on
+CHAT_PAGE_SIZE = 20  # Exchanges rendered when a hive is opened, and loaded per scroll to the top of the chat
+STORAGE_BACKEND = "json"  # "json" (a file and history journal per hive in hives/) or "sqlite" (hives/hives.db, see storage.py)
 
 ####### ANIMATION STATE #################################################
 # Global animation state for canvas link animations
@@ -33,75 +47,30 @@ animation_state = {
 app.add_static_files('/icons', os.path.join(os.path.dirname(__file__), 'icons'))
 
 ######## HELPER FUNCTIONS ###############################################
-def loadAllHives():
-    """This function loads and creates all hive objects stored in the /hives directory
-    and sorts by lastModified"""
-    import json
-    import os
-    
-    hives_list = []
-    
-    # Check if hives directory exists
-    if not os.path.exists("hives"):
-        print("[Debug] Hives directory does not exist, creating it")
-        os.makedirs("hives")
-        return hives_list
-    
-    # Get all JSON files in hives directory
-    try:
-        files = [f for f in os.listdir("hives") if f.startswith("hive_") and f.endswith(".json")]
-        
-        if not files:
-            print("[Debug] No hive files found in hives directory")
-            return hives_list
-        
-        # Load each hive from file
-        for file in files:
-            try:
-                file_path = os.path.join("hives", file)
-                with open(file_path, "r") as f:
-                    data = json.load(f)
-                
-                # Create hive object from dictionary
-                hive = Hive.Hive.from_dict(data)
-                hives_list.append(hive)
-                print(f"[Debug] Loaded hive: {hive.hiveName} (ID: {hive.hiveID})")
-                
-            except Exception as e:
-                print(f"[Debug] Error loading hive from {file}: {e}")
-                continue
-        
-        # Sort by lastModified (newest first)
-        hives_list.sort(key=lambda x: x.lastModified, reverse=True)
-        print(f"[Debug] Loaded {len(hives_list)} hives, sorted by lastModified")
-        
-    except Exception as e:
-        print(f"[Debug] Error accessing hives directory: {e}")
-    
-    return hives_list
-
-def getHistoryLogs(selectedHive):
-    """Returns structured chat entries: [{user, discussion: [{round, messages: [{name, response}]}], queen}]"""
+def getHistoryLogs(selectedHive, offset=0, limit=None):
+    """Returns structured chat entries for the exchanges at history positions offset to offset + limit (to the end
+    when limit is None): [{user, discussion: [{round, messages: [{name, response}]}], queen}]"""
     chatlog = []
-    history = selectedHive.getHistory()
+    if limit is None:
+        limit = len(selectedHive.getHistory()) - offset
+    # Bee logs of exchanges condensed by background compaction are restored from the archive by get_history_page
+    history = selectedHive.get_history_page(offset, limit)
 
     for entry in history:
         nBees = entry["nBees"]
         nRounds = entry["nRounds"]
         logs = entry["logs"]
 
-        # Build structured discussion rounds
-        discussion = []
-        for r in range(nRounds):
-            round_messages = []
-            for b in range(nBees):
-                idx = r * nBees + b
-                if idx < len(logs):
-                    round_messages.append({
-                        "name": logs[idx]["name"],
-                        "response": logs[idx]["response"]
-                    })
-            discussion.append({"round": r + 1, "messages": round_messages})
+        # Build structured discussion rounds (bees whose call failed have no log entry,
+        # so entries are grouped by their round rather than by position)
+        discussion = [{"round": r + 1, "messages": []} for r in range(nRounds)]
+        for idx, log in enumerate(logs):
+            r = log.get("round", idx // nBees)
+            if r < nRounds:
+                discussion[r]["messages"].append({
+                    "name": log["name"],
+                    "response": log["response"]
+                })
 
         chatlog.append({
             "user": entry["prompt"],
@@ -110,19 +79,41 @@ def getHistoryLogs(selectedHive):
             "complete": True
         })
     return chatlog
+
+def loadLatestChat(hive):
+    """Sets chatlog to the most recent page of hive's exchanges; older pages are loaded on scroll"""
+    global chatlog, chat_offset
+    if hive is None:
+        chatlog = []
+        chat_offset = 0
+        return
+    chat_offset = max(0, len(hive.getHistory()) - CHAT_PAGE_SIZE)
+    chatlog = getHistoryLogs(hive, chat_offset, CHAT_PAGE_SIZE)
   
     
 
 ##### STATE VARIABLES ############
-hives = loadAllHives()
-hive_options = {hive.hiveName: hive for hive in hives}
+if STORAGE_BACKEND == "sqlite":
+    Hive.Hive.storage = storage.SQLiteStorage()
+
+# Hive saves are debounced and written on a background thread, see persistence.py
+persistence_manager = persistence.PersistenceManager()
+Hive.Hive.persistence = persistence_manager
+persistence_manager.start()
+
+# Only the hive manifest is read here; a hive is loaded when it is first selected, see registry.py
+hive_options = registry.HiveRegistry()
 hive_names = list(hive_options.keys())
 selectedHive = hive_options[hive_names[0]] if hive_names else None
 if selectedHive:
     print(f"[Debug] Selected hive: {selectedHive.hiveName} (ID: {selectedHive.hiveID})")
 
-chatlog = getHistoryLogs(selectedHive)
+chatlog = []
+chat_offset = 0           # History position of the first exchange in chatlog
+loadLatestChat(selectedHive)
 chat_scroll_area = None
+chat_container = None     # Column holding the rendered chat entries, see render_chat
+loading_older_chat = False
 
 isProcessing = False
 
@@ -191,15 +182,27 @@ def render_discussion_content(entry, is_in_progress):
                     bee_color = generate_bee_color(msg['name'])
                     with ui.column().classes('bg-zinc-700 text-white px-3 py-1 rounded-2xl rounded-bl-sm max-w-[80%] gap-0'):
                         ui.label(msg['name'].upper()).classes('text-xs font-bold uppercase pt-1').style(f'color: {bee_color};')
-                        ui.markdown(response_text).classes('text-xs leading-tight p-2')
+                        if msg.get("error"):
+                            ui.label(f"Could not respond: {msg['error']}").classes('text-red-400 text-xs italic p-2')
+                        else:
+                            ui.markdown(response_text).classes('text-xs leading-tight p-2')
                         if injection_text:
                             ui.label(injection_text).classes('text-gray-500 text-xs italic')
             
             # Show thinking animation for current round if not all bees have responded
             if round_idx == current_round_idx and len(round_data["messages"]) < nBees:
-                with ui.column().classes('w-full justify-start mb-2'):
-                    with ui.column().classes('bg-zinc-600 text-gray-400 px-3 py-1 rounded-2xl rounded-bl-sm max-w-[90%] gap-0'):
-                        ui.label('Thinking').classes('text-xs font-bold uppercase loading-dots')
+                partials = [p for bid, p in entry.get("partials", {}).items() if bid != "Queen" and p["response"]]
+                # Streamed replies are shown as they are generated, otherwise a thinking placeholder
+                for partial in partials:
+                    with ui.column().classes('w-full justify-start mb-2'):
+                        bee_color = generate_bee_color(partial['name'])
+                        with ui.column().classes('bg-zinc-700 text-white px-3 py-1 rounded-2xl rounded-bl-sm max-w-[80%] gap-0'):
+                            ui.label(partial['name'].upper()).classes('text-xs font-bold uppercase pt-1').style(f'color: {bee_color};')
+                            ui.markdown(partial['response']).classes('text-xs leading-tight p-2')
+                if not partials:
+                    with ui.column().classes('w-full justify-start mb-2'):
+                        with ui.column().classes('bg-zinc-600 text-gray-400 px-3 py-1 rounded-2xl rounded-bl-sm max-w-[90%] gap-0'):
+                            ui.label('Thinking').classes('text-xs font-bold uppercase loading-dots')
 
     else:
         # For completed discussions, show all rounds and messages
@@ -225,13 +228,21 @@ def render_discussion_content(entry, is_in_progress):
                         bee_color = generate_bee_color(msg['name'])
                         with ui.column().classes('bg-zinc-700 text-white px-3 py-1 rounded-2xl rounded-bl-sm max-w-[90%] gap-0'):
                             ui.label(msg['name'].upper()).classes('text-xs font-bold uppercase pt-1').style(f'color: {bee_color};')
-                            ui.markdown(response_text).classes('text-xs leading-tight p-2')
+                            if msg.get("error"):
+                                ui.label(f"Could not respond: {msg['error']}").classes('text-red-400 text-xs italic p-2')
+                            else:
+                                ui.markdown(response_text).classes('text-xs leading-tight p-2')
                             if injection_text:
                                 ui.label(injection_text).classes('text-gray-500 text-xs italic')
 
 def render_queen_response(entry, is_in_progress):
     """Render queen response or synthesizing indicator"""
-    if entry.get("queen"):
+    if entry.get("queen_error"):
+        with ui.row().classes('w-full justify-start mb-6'):
+            with ui.column().classes('bg-zinc-800 text-white px-4 py-2 rounded-2xl rounded-bl-sm max-w-[90%] gap-1'):
+                ui.label('Queen').classes('text-gray-400 text-xs font-bold uppercase')
+                ui.label(f"Could not synthesize a response: {entry['queen_error']}").classes('text-red-400 text-sm italic')
+    elif entry.get("queen"):
         with ui.row().classes('w-full justify-start mb-6'):
             with ui.column().classes('bg-zinc-800 text-white px-4 py-2 rounded-2xl rounded-bl-sm max-w-[90%] gap-1'):
                 ui.label('Queen').classes('text-gray-400 text-xs font-bold uppercase')
@@ -242,39 +253,93 @@ def render_queen_response(entry, is_in_progress):
         total_expected = nBees * nRounds
         actual_responses = sum(len(rd["messages"]) for rd in entry["discussion"])
         
-        if actual_responses >= total_expected:
+        queen_partial = entry.get("partials", {}).get("Queen")
+        if queen_partial and queen_partial["response"]:
+            # Streamed aggregation so far
+            with ui.row().classes('w-full justify-start mb-6'):
+                with ui.column().classes('bg-zinc-800 text-white px-4 py-2 rounded-2xl rounded-bl-sm max-w-[90%] gap-1'):
+                    ui.label('Queen').classes('text-gray-400 text-xs font-bold uppercase')
+                    ui.markdown(queen_partial["response"]).classes('text-sm leading-tight')
+        elif actual_responses >= total_expected:
             with ui.row().classes('w-full justify-start mb-6'):
                 with ui.column().classes('bg-zinc-700 text-gray-400 px-4 py-2 rounded-2xl rounded-bl-sm max-w-[90%] gap-1'):
                     ui.label('Queen').classes('text-gray-500 text-xs font-bold uppercase')
                     ui.label('Synthesizing').classes('leading-relaxed loading-dots')
 
 ########## Auto executed functions or triggers ########## 
+def render_chat_entry(entry):
+    """Renders one completed chat entry"""
+    if isinstance(entry, dict):
+        # User message - right aligned bubble
+        with ui.row().classes('w-full justify-end mb-2'):
+            ui.label(entry["user"]).classes(
+                'bg-amber-600 text-white px-4 py-2 rounded-2xl rounded-br-sm max-w-[80%]'
+            )
+        
+        # Discussion - collapsible panel (completed entries only)
+        if entry.get("discussion"):
+            with ui.expansion('Discussion', value=False).classes(
+                'w-full bg-zinc-800 mb-2 text-gray-300 p-1 rounded-tl-2xl rounded-bl-2xl text-xs'
+            ).props('dense header-class="bg-zinc-800 text-gray-400 font-bold text-xs uppercase rounded-tl-2xl" expand-icon-class="text-gray-400"'):
+                render_discussion_content(entry, is_in_progress=False)
+        
+        # Queen response
+        render_queen_response(entry, is_in_progress=False)
+    else:
+        ui.markdown(entry).classes('text-gray-500')
+
 @ui.refreshable
 def render_chat():
-    """Renders completed chat entries only. Active query uses separate refreshable."""
-    for entry in chatlog:
-        if isinstance(entry, dict):
+    """Renders the loaded page of completed chat entries. Active query uses separate refreshable.
+    Older pages are prepended by load_older_chat and finished queries appended by append_chat_entry,
+    so the whole chat is only rebuilt when the hive changes or its history is cleared."""
+    global chat_container
+    render_history_header()
+    with ui.column().classes('w-full') as chat_container:
+        for entry in chatlog:
             # Skip rendering if this is the active entry - it's handled by render_active_entry
-            if entry is active_chat_entry:
-                continue
-                
-            # User message - right aligned bubble
-            with ui.row().classes('w-full justify-end mb-2'):
-                ui.label(entry["user"]).classes(
-                    'bg-amber-600 text-white px-4 py-2 rounded-2xl rounded-br-sm max-w-[80%]'
-                )
-            
-            # Discussion - collapsible panel (completed entries only)
-            if entry.get("discussion"):
-                with ui.expansion('Discussion', value=False).classes(
-                    'w-full bg-zinc-800 mb-2 text-gray-300 p-1 rounded-tl-2xl rounded-bl-2xl text-xs'
-                ).props('dense header-class="bg-zinc-800 text-gray-400 font-bold text-xs uppercase rounded-tl-2xl" expand-icon-class="text-gray-400"'):
-                    render_discussion_content(entry, is_in_progress=False)
-            
-            # Queen response
-            render_queen_response(entry, is_in_progress=False)
-        else:
-            ui.markdown(entry).classes('text-gray-500')
+            if entry is not active_chat_entry:
+                render_chat_entry(entry)
+
+@ui.refreshable
+def render_history_header():
+    if chat_offset > 0:
+        ui.label(f'Scroll up for {chat_offset} earlier exchanges').classes('w-full text-center text-zinc-500 text-xs')
+
+def load_older_chat():
+    """Renders the page of exchanges before the loaded ones above them"""
+    global chatlog, chat_offset, loading_older_chat
+    if selectedHive is None or chat_offset == 0 or chat_container is None or loading_older_chat:
+        return
+    loading_older_chat = True
+    start = max(0, chat_offset - CHAT_PAGE_SIZE)
+    older = getHistoryLogs(selectedHive, start, chat_offset - start)
+    chatlog = older + chatlog
+    chat_offset = start
+    with chat_container:
+        with ui.column().classes('w-full') as page:
+            for entry in older:
+                render_chat_entry(entry)
+    page.move(target_index=0)
+    render_history_header.refresh()
+    # Keep the entry that was at the top in view (approximately, entries differ in height)
+    if chat_scroll_area:
+        chat_scroll_area.scroll_to(percent=len(older) / len(chatlog))
+    loading_older_chat = False
+
+def on_chat_scroll(e):
+    if e.vertical_position < 40:
+        load_older_chat()
+
+def append_chat_entry(entry):
+    """Renders a finished entry below the others, without rebuilding them"""
+    if not any(loaded is entry for loaded in chatlog):
+        return  # The hive was switched while the query ran
+    if chat_container is None:
+        render_chat.refresh()
+        return
+    with chat_container:
+        render_chat_entry(entry)
 
 @ui.refreshable
 def render_active_entry():
@@ -352,6 +417,7 @@ async def sendQuery(query_text, rounds):
     bee_order = [bee.get_beeId() for bee in selectedHive.getBees()]
     
     # Initialize animation state for retrieval phase
+    frame_scheduler.wake()
     animation_state = {
         "phase": "retrieval",
         "bee_order": bee_order,
@@ -368,7 +434,8 @@ async def sendQuery(query_text, rounds):
         "discussion": [],
         "queen": None,
         "complete": False,
-        "context_ready": False  # Track if Queen has finished fetching context
+        "context_ready": False,  # Track if Queen has finished fetching context
+        "partials": {}  # Streamed text of replies still being generated, keyed by bee ID
     }
     # Pre-populate discussion rounds
     for r in range(nRounds):
@@ -416,6 +483,12 @@ async def sendQuery(query_text, rounds):
             needs_refresh[0] = True
             return
         
+        # Handle __partial__ signal - streamed text of a reply that is still being generated
+        if e["name"] == "__partial__":
+            chat_entry["partials"][e["bee_id"]] = {"name": e["speaker"], "response": e["response"]}
+            needs_refresh[0] = True
+            return
+        
         # Handle __bee_thinking__ signal - create links when bees start thinking
         if e["name"] == "__bee_thinking__":
             # Determine current round based on how many responses we've seen so far
@@ -472,7 +545,20 @@ async def sendQuery(query_text, rounds):
             needs_refresh[0] = True
             return
         
-        if responseCount[0] < totalBeeResponses:
+        # Final reply replaces any streamed partial text
+        chat_entry["partials"].pop(e.get("bee_id"), None)
+
+        # A failed call is reported in place of the reply it should have produced
+        failed = e["name"] == "__inference_failed__"
+        speaker = e["speaker"] if failed else e["name"]
+
+        if failed and e.get("bee_id") == "Queen":
+            animation_state["phase"] = "idle"
+            animation_state["links"] = []
+            animation_dirty = True
+            chat_entry["queen_error"] = e.get("error")
+            chat_entry["complete"] = True
+        elif responseCount[0] < totalBeeResponses:
             # Bee response - add to appropriate round
             current_round = responseCount[0] // nBees
             turn_in_round = responseCount[0] % nBees
@@ -487,8 +573,9 @@ async def sendQuery(query_text, rounds):
                 handshake_active[0] = False
             
             chat_entry["discussion"][current_round]["messages"].append({
-                "name": e["name"],
-                "response": e["response"]
+                "name": speaker,
+                "response": e["response"] or "",
+                "error": e.get("error") if failed else None
             })
             
             # Update animation state for discussion phase
@@ -531,7 +618,7 @@ async def sendQuery(query_text, rounds):
         global active_chat_entry
         active_chat_entry = None
 
-        render_chat.refresh()  # Full refresh once to move entry to completed list
+        append_chat_entry(chat_entry)  # Move entry to the completed list, leaving the other entries as they are
         render_active_entry.refresh()  # Clear the active entry display
         if chat_scroll_area:
             chat_scroll_area.scroll_to(pixels=999999)
@@ -552,8 +639,8 @@ async def sendQuery(query_text, rounds):
     # Start the UI refresh task
     refresh_task = asyncio.create_task(refresh_ui())
     
-    # Run the blocking query in a background thread
-    await run.io_bound(lambda: selectedHive.query(query_text, int(rounds), callback=f))
+    # Run the query on the event loop - model calls are awaited, not parked on a thread
+    await selectedHive.query_async(query_text, int(rounds), callback=f)
     
     # Wait for the refresh task to complete
     await refresh_task
@@ -562,13 +649,20 @@ async def sendQuery(query_text, rounds):
 
 def onDropdownSelection(e):
     global selectedHive
-    global chatlog
+    if selectedHive:
+        persistence_manager.request_flush(selectedHive)  # Write the hive being left without waiting for its debounce window
     selectedHive = hive_options[e.value]
 
-    chatlog = getHistoryLogs(selectedHive)
+    loadLatestChat(selectedHive)  # Only the latest page is rendered, older exchanges load on scroll
     render_chat.refresh()
     render_drawer_content.refresh()  # Update drawer content
     render_randomize_switch.refresh()  # Update randomize toggle
+    render_stream_switch.refresh()  # Update streaming toggle
+    render_parallel_switch.refresh()  # Update parallel rounds toggle
+    render_balance_switch.refresh()  # Update endpoint balancing toggle
+    render_layout_switch.refresh()  # Update prompt layout toggle
+    render_retrieval_select.refresh()  # Update context retrieval mode
+    render_compaction_switch.refresh()  # Update memory compaction toggle
     if chat_scroll_area:
         chat_scroll_area.scroll_to(pixels=999999)
 
@@ -591,11 +685,9 @@ with ui.dialog() as confirm_clear_history_dialog, ui.card().classes('bg-zinc-900
     ui.label('This will permanently delete all chat history for this hive.').classes('text-gray-300 text-sm mb-4')
     with ui.row().classes('gap-2 justify-end'):
         ui.button('Cancel', on_click=confirm_clear_history_dialog.close).props('flat color="grey"')
-        def confirm_clear():
-            global chatlog
-            selectedHive.history = []
-            selectedHive.save()
-            chatlog = []
+        async def confirm_clear():
+            await selectedHive.clear_history_async()  # Also drops the hive's retrieval indexes, off the event loop
+            loadLatestChat(selectedHive)
             render_chat.refresh()
             ui.notify('Chat history cleared', type='positive')
             confirm_clear_history_dialog.close()
@@ -608,7 +700,7 @@ with ui.dialog() as confirm_delete_hive_dialog, ui.card().classes('bg-zinc-900 t
     with ui.row().classes('gap-2 justify-end'):
         ui.button('Cancel', on_click=confirm_delete_hive_dialog.close).props('flat color="grey"')
         def confirm_delete_hive():
-            global selectedHive, chatlog, hive_options, hive_names
+            global selectedHive, hive_options, hive_names
             if selectedHive:
                 hive_id = selectedHive.hiveID
                 hive_name = selectedHive.hiveName
@@ -617,12 +709,12 @@ with ui.dialog() as confirm_delete_hive_dialog, ui.card().classes('bg-zinc-900 t
                 hive_names.remove(hive_name)
                 if hive_names:
                     selectedHive = hive_options[hive_names[0]]
-                    chatlog = getHistoryLogs(selectedHive)
+                    loadLatestChat(selectedHive)
                     hive_select.set_options(hive_names)
                     hive_select.set_value(hive_names[0])
                 else:
                     selectedHive = None
-                    chatlog = []
+                    loadLatestChat(None)
                 render_chat.refresh()
                 ui.notify(f'Hive "{hive_name}" deleted', type='positive')
             confirm_delete_hive_dialog.close()
@@ -802,6 +894,96 @@ with ui.right_drawer(value=False, fixed=False, bordered=False).classes('bg-zinc-
             render_randomize_switch()
         ui.label('Toggle to give different bees a chance to start the conversation.').classes('text-zinc-500 text-xs italic mt-2')
     
+    # Stream Responses Toggle
+    with ui.card().classes('w-full bg-zinc-800/50 p-3 rounded-lg').props('flat bordered'):
+        with ui.row().classes('w-full items-center justify-between'):
+            ui.label('Stream Responses').classes('text-zinc-400 text-xs font-medium uppercase tracking-wide')
+            def toggle_stream(e):
+                if selectedHive:
+                    selectedHive.set_stream(e.value)
+            
+            @ui.refreshable
+            def render_stream_switch():
+                ui.switch(value=selectedHive.stream if selectedHive else False, on_change=toggle_stream).props('dense color="amber"')
+            
+            render_stream_switch()
+        ui.label('Show bee and queen replies word by word as they are generated.').classes('text-zinc-500 text-xs italic mt-2')
+    
+    # Parallel Rounds Toggle
+    with ui.card().classes('w-full bg-zinc-800/50 p-3 rounded-lg').props('flat bordered'):
+        with ui.row().classes('w-full items-center justify-between'):
+            ui.label('Parallel Rounds').classes('text-zinc-400 text-xs font-medium uppercase tracking-wide')
+            def toggle_parallel(e):
+                if selectedHive:
+                    selectedHive.set_sequential(not e.value)
+            
+            @ui.refreshable
+            def render_parallel_switch():
+                ui.switch(value=not selectedHive.sequential if selectedHive else False, on_change=toggle_parallel).props('dense color="amber"')
+            
+            render_parallel_switch()
+        ui.label('All bees answer a round at once, each seeing the discussion up to the previous round.').classes('text-zinc-500 text-xs italic mt-2')
+    
+    # Balance Endpoints Toggle
+    with ui.card().classes('w-full bg-zinc-800/50 p-3 rounded-lg').props('flat bordered'):
+        with ui.row().classes('w-full items-center justify-between'):
+            ui.label('Balance Endpoints').classes('text-zinc-400 text-xs font-medium uppercase tracking-wide')
+            def toggle_balance(e):
+                if selectedHive:
+                    selectedHive.set_balance(e.value)
+            
+            @ui.refreshable
+            def render_balance_switch():
+                ui.switch(value=selectedHive.balance if selectedHive else False, on_change=toggle_balance).props('dense color="amber"')
+            
+            render_balance_switch()
+        ui.label('Send each call to the least busy model endpoint. Only enable when all endpoints serve the same model.').classes('text-zinc-500 text-xs italic mt-2')
+    
+    # Prompt Layout Toggle
+    with ui.card().classes('w-full bg-zinc-800/50 p-3 rounded-lg').props('flat bordered'):
+        with ui.row().classes('w-full items-center justify-between'):
+            ui.label('Prefix-Cached Prompts').classes('text-zinc-400 text-xs font-medium uppercase tracking-wide')
+            def toggle_layout(e):
+                if selectedHive:
+                    selectedHive.set_prompt_layout("chat" if e.value else "single")
+            
+            @ui.refreshable
+            def render_layout_switch():
+                ui.switch(value=selectedHive.promptLayout == "chat" if selectedHive else False, on_change=toggle_layout).props('dense color="amber"')
+            
+            render_layout_switch()
+        ui.label('Send shared instructions, context and discussion first as separate messages so the server can reuse its prompt cache between turns.').classes('text-zinc-500 text-xs italic mt-2')
+    
+    # Context Retrieval Mode
+    with ui.card().classes('w-full bg-zinc-800/50 p-3 rounded-lg').props('flat bordered'):
+        ui.label('Context Retrieval').classes('text-zinc-400 text-xs font-medium uppercase tracking-wide mb-2')
+        retrieval_options = {"recent": "Most recent exchanges", "embedding": "Most similar exchanges", "bm25": "Keyword match (BM25)", "hybrid": "Similarity and keywords"}
+        def change_retrieval(e):
+            if selectedHive and e.value:
+                selectedHive.set_retrieval_mode(e.value)
+        
+        @ui.refreshable
+        def render_retrieval_select():
+            ui.select(options=retrieval_options, value=selectedHive.retrievalMode if selectedHive else "embedding", on_change=change_retrieval).props('outlined dark dense color="amber" popup-content-class="bg-zinc-800 text-white"').classes('w-full text-white')
+        
+        render_retrieval_select()
+        ui.label('Which past exchanges are handed to the bees as context for a new prompt.').classes('text-zinc-500 text-xs italic mt-2')
+    
+    # Memory Compaction Toggle
+    with ui.card().classes('w-full bg-zinc-800/50 p-3 rounded-lg').props('flat bordered'):
+        with ui.row().classes('w-full items-center justify-between'):
+            ui.label('Compact Old Memory').classes('text-zinc-400 text-xs font-medium uppercase tracking-wide')
+            def toggle_compaction(e):
+                if selectedHive:
+                    selectedHive.set_compaction(e.value)
+            
+            @ui.refreshable
+            def render_compaction_switch():
+                ui.switch(value=selectedHive.compaction if selectedHive else False, on_change=toggle_compaction).props('dense color="amber"')
+            
+            render_compaction_switch()
+        ui.label('While the hive is idle, the Queen condenses old exchanges into digests that stand in for them as context.').classes('text-zinc-500 text-xs italic mt-2')
+    
     @ui.refreshable
     def render_drawer_content():
         if not selectedHive:
@@ -902,7 +1084,7 @@ with ui.row().classes('w-full h-screen no-wrap gap-4 p-8 items-stretch') as row:
                 with ui.row().classes('gap-2 justify-end w-full'):
                     ui.button('Cancel', on_click=create_hive_dialog.close).props('flat color="grey"')
                     def create_new_hive():
-                        global selectedHive, chatlog, hive_options, hive_names
+                        global selectedHive, hive_options, hive_names
                         name = new_hive_name_input.value.strip() if new_hive_name_input.value else ''
                         if not name:
                             ui.notify('Please enter a hive name', type='warning')
@@ -915,7 +1097,7 @@ with ui.row().classes('w-full h-screen no-wrap gap-4 p-8 items-stretch') as row:
                         hive_options[name] = new_hive
                         hive_names.append(name)
                         selectedHive = new_hive
-                        chatlog = []
+                        loadLatestChat(new_hive)
                         # Update dropdown
                         hive_select.set_options(hive_names)
                         hive_select.set_value(name)
@@ -928,7 +1110,7 @@ with ui.row().classes('w-full h-screen no-wrap gap-4 p-8 items-stretch') as row:
             ui.button(icon='add', on_click=create_hive_dialog.open).props('flat round dense color="white"').tooltip('Create New Hive')
             
         # Middle: Scrollable Chat Pane
-        with ui.scroll_area().classes('w-full flex-grow bg-zinc-800/30 rounded-lg p-1').style('zoom: 0.8') as chat_scroll_area:
+        with ui.scroll_area(on_scroll=on_chat_scroll).classes('w-full flex-grow bg-zinc-800/30 rounded-lg p-1').style('zoom: 0.8') as chat_scroll_area:
             # Chat messages - completed entries
             render_chat()
             # Active entry (in-progress queries) - only this gets refreshed during queries
@@ -994,13 +1176,70 @@ ui.timer(0.1, updateCanvasDimensions, once=True)
 ui.add_body_html(ui_utils.CANVAS_JS)
 
 # Global state for dirty flag system
-last_sent_data = None
+render_encoder = render_protocol.RenderEncoder()  # Server simulation: what the browser was last sent
 animation_dirty = True
-
-# Update loop at 60 FPS with dirty flag optimization
+last_roster = None   # Client simulation: (id, name, role) of the members the browser was last sent
+last_states = None   # Client simulation: beeId -> state last sent
+last_frame_rate = None  # Client simulation: FRAME_RATES cap the browser was last sent
+
+def resendCanvasState():
+    """A newly connected browser has no roster yet, so the next tick sends everything again"""
+    global animation_dirty, last_roster, last_states, last_frame_rate
+    render_encoder.reset()
+    last_roster = None
+    last_states = None
+    last_frame_rate = None
+    animation_dirty = True
+    frame_scheduler.set_hidden(False)
+
+app.on_connect(resendCanvasState)
+
+# The browser reports when the page is hidden or shown (see PAGE VISIBILITY in ui_utils.CANVAS_JS)
+def onCanvasVisibility(e):
+    frame_scheduler.set_hidden(e.args['hidden'])
+    if CLIENT_SIMULATION:
+        sendFrameRate()  # The sync timer is paused while hidden, so the browser is told here
+
+ui.on('canvas_visibility', onCanvasVisibility)
+
+def sendFrameRate():
+    """Client simulation: caps the browser's frame rate at the FRAME_RATES entry of the scheduler's mode"""
+    global last_frame_rate
+    fps = FRAME_RATES[frame_scheduler.mode]
+    if fps != last_frame_rate:
+        ui.run_javascript(f'swarmFrameRate({json.dumps(fps)})')
+        last_frame_rate = fps
+
+def sendSwarmChanges():
+    """Client simulation: the browser moves the bees itself, so only the frame rate cap, roster changes,
+    bee state changes and link animations are sent, each only when it changed"""
+    global last_roster, last_states, animation_dirty
+    sendFrameRate()
+    members = selectedHive.getBees() + [selectedHive.getQueen()] if selectedHive else []
+
+    roster = [(b.get_beeId(), b.get_name(), b.get_role()) for b in members]
+    if roster != last_roster:
+        ui.run_javascript(f'swarmRoster({json.dumps([swarm.rosterEntry(b) for b in members])}, {json.dumps(BORDER_TYPE)})')
+        last_roster = roster
+        last_states = {b.get_beeId(): b.get_state() for b in members}
+
+    states = {b.get_beeId(): b.get_state() for b in members}
+    if states != last_states:
+        ui.run_javascript(f'swarmStates({json.dumps(states)})')
+        last_states = states
+
+    if animation_dirty:
+        ui.run_javascript(f'swarmAnimation({json.dumps(animation_state)})')
+        animation_dirty = False
+
+# Update loop at a rate set by the frame scheduler, with dirty flag optimization
 di = time.time()
 def onTimer():
-    global di, last_sent_data, animation_dirty
+    global di, animation_dirty
+    frame_scheduler.update(busy=animation_state["phase"] != "idle" or bool(selectedHive and selectedHive.activeQueries))
+    if CLIENT_SIMULATION:
+        sendSwarmChanges()
+        return
     canvasW = int(canvas['width'])
     canvasH = int(canvas['height'])
     margin = 30
@@ -1010,11 +1249,9 @@ def onTimer():
         return
     
     df = time.time()
-    dt = df-di
+    dt = min(df-di, scheduler.MAX_FRAME_DT)  # The timer may have been slowed down or paused
     di = df
 
-    beeStates = {}
-
     if selectedHive:
         bees = selectedHive.getBees()
         queen = selectedHive.getQueen()
@@ -1024,33 +1261,23 @@ def onTimer():
             if b.x== None or b.y == None:
                 b.spawnRandomly(canvasW, canvasH,margin)
 
-        for b in (members):            
-            b.update(dt, members, canvasW, canvasH)
-            b.handleBorders(canvasW, canvasH)
-
-            beeStates[b.get_beeId()] = {
-                "name": b.get_name(),
-                "role": b.get_role(),
-                "x": float(b.get_pos()[0]),
-                "y": float(b.get_pos()[1]),
-                "vx": float(b.get_vel()[0]),
-                "vy": float(b.get_vel()[1]),
-                "state": b.get_state(),
-                "size": b.get_size()
-                }
-
-        # Only send data if something changed or animation is active
-        render_data = {
-            "bees": beeStates,
-            "animation": animation_state
-        }
-        
-        # Send data only if it's different from last time or animation is dirty
-        if last_sent_data != render_data or animation_dirty:
-            ui.run_javascript(f'renderBees({json.dumps(render_data)})')
-            last_sent_data = render_data.copy()
-            animation_dirty = False
+        # Steer every member in one batched step (same behaviour as b.update + b.handleBorders)
+        swarm_engine.step(members, dt, canvasW, canvasH, BORDER_TYPE)
+
+        # Roster once per change, then packed positions and only the states and animation that changed
+        for call in render_encoder.encode(members, animation_state if animation_dirty else None):
+            ui.run_javascript(call)
+        animation_dirty = False
     
-ui.timer(1/60, onTimer)  # Reduced from 60 to 30 FPS for better performance
+swarm_engine = swarm.SwarmEngine()
+frame_scheduler = scheduler.FrameScheduler(CLIENT_SYNC_RATES if CLIENT_SIMULATION else FRAME_RATES)
+frame_scheduler.attach(ui.timer(scheduler.PAUSED_INTERVAL, onTimer))  # Slowed down when idle, paused when hidden
+
+# Close pooled model connections when the app exits
+memory_compactor = compactor.MemoryCompactor(lambda: hive_options.values())  # Only hives currently in memory
+app.on_startup(lambda: background_tasks.create(memory_compactor.run(), name='memory_compactor'))
+app.on_shutdown(memory_compactor.stop)
+app.on_shutdown(persistence_manager.stop)  # Writes every hive with unsaved changes
+app.on_shutdown(inference.aclose_all)
 
 ui.run(favicon=favicon_dir, title=title, language=language, native=True, window_size=(windowW, windowH), fullscreen=False, reload=False)
\ No newline at end of file
@@ -0,0 +1,206 @@
+######## IMPORTS ########
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Content-addressed cache of model completions.
+# A completion is keyed by a hash of the endpoint and the full request payload (messages, max_tokens
+# and every sampling parameter), so replaying a prompt or a saved discussion against the same endpoint
+# returns the stored text instead of running the model again.
+# Only requests that ask for sampling (temperature above zero) opt out. Requests that leave temperature unset,
+# as the shipped generation settings do, are cached like temperature 0 ones, so replaying a prompt returns the
+# stored reply; a bee or the Queen gets fresh samples by setting a temperature in its generation settings.
+
+######## CACHE CONFIGURATION ########
+CACHE_DIR = os.path.join("cache", "responses")  # Sits next to the hives/ directory
+MEMORY_ENTRIES = 256                            # Completions kept in the in-memory LRU tier
+DISK_BYTES = 64 * 1024 * 1024                   # Size cap of the on-disk tier
+TTL_SECONDS = 7 * 24 * 60 * 60                  # Age after which a stored completion is discarded
+
+
+def cache_key(url, payload):
+    """Hash of the endpoint and every field of the payload that affects the generated text"""
+    keyed = {k: v for k, v in payload.items() if k != "stream"}  # Streaming only changes the transport
+    keyed["endpoint"] = url.rstrip('/')
+    blob = json.dumps(keyed, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier completion cache: an in-memory LRU in front of one JSON file per completion on disk.
+    Requests with a temperature above zero are not cached unless cache_sampled is set, since re-running
+    them is expected to give a different reply; an unset temperature is cached.
+    Empty completions are never stored. get() and put() may touch the disk, so async callers run them
+    on a worker thread."""
+    def __init__(self, directory=CACHE_DIR, memory_entries=MEMORY_ENTRIES, disk_bytes=DISK_BYTES,
+                 ttl=TTL_SECONDS, cache_sampled=False):
+        self.directory = directory
+        self.memoryEntries = memory_entries
+        self.diskBytes = disk_bytes
+        self.ttl = ttl
+        self.cacheSampled = cache_sampled
+        self.enabled = True
+
+        self.memory = OrderedDict()  # key -> (created, content)
+        self.diskSize = None         # Bytes on disk, measured lazily on first write
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def cacheable(self, payload):
+        if not self.enabled:
+            return False
+        if self.cacheSampled:
+            return True
+        temperature = payload.get("temperature")
+        return temperature is None or temperature <= 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, url, payload):
+        """Returns the cached completion text for a request, or None"""
+        if not self.cacheable(payload):
+            with self.lock:
+                self.skipped += 1
+            return None
+        key = cache_key(url, payload)
+        now = time.time()
+        with self.lock:
+            item = self.memory.get(key)
+            if item is not None:
+                if now - item[0] <= self.ttl:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self.memory[key]
+
+        content = self._read_disk(key, now)
+        with self.lock:
+            if content is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.diskHits += 1
+            self._remember(key, now, content)
+        return content
+
+    def put(self, url, payload, content):
+        """Stores the completion text of a request in both tiers"""
+        if not content or not self.cacheable(payload):
+            return
+        key = cache_key(url, payload)
+        now = time.time()
+        with self.lock:
+            self._remember(key, now, content)
+            self.stores += 1
+        self._write_disk(key, now, content)
+
+    def _remember(self, key, created, content):
+        self.memory[key] = (created, content)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memoryEntries:
+            self.memory.popitem(last=False)
+
+    def _read_disk(self, key, now):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if now - record.get("created", 0) > self.ttl:
+            self._remove(path)
+            return None
+        return record.get("content") or None
+
+    def _write_disk(self, key, created, content):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        data = json.dumps({"created": created, "content": content}, ensure_ascii=False).encode('utf-8')
+        temp_path = path + ".tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"[Debug] Could not write response cache entry: {e}")
+            return
+        with self.lock:
+            if self.diskSize is None:
+                self.diskSize = self._measure_disk()
+            else:
+                self.diskSize += len(data)
+            over = self.diskSize > self.diskBytes
+        if over:
+            self.evict()
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self.lock:
+            if self.diskSize is not None:
+                self.diskSize -= size
+            self.evictions += 1
+
+    def _measure_disk(self):
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                total += entry.stat().st_size
+        return total
+
+    def evict(self):
+        """Drops expired completions from disk, then the oldest ones until the tier is back under its size cap"""
+        if not os.path.isdir(self.directory):
+            return
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if now - mtime > self.ttl or total > self.diskBytes:
+                self._remove(path)
+                total -= size
+        with self.lock:
+            self.diskSize = total
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".json"):
+                    self._remove(entry.path)
+        with self.lock:
+            self.diskSize = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "diskHits": self.diskHits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "memoryEntries": len(self.memory),
+                "diskBytes": self.diskSize
+            }
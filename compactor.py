@@ -0,0 +1,103 @@
+######## IMPORTS ########
+import asyncio
+import collections
+import time
+
+# Background compaction of old hive memory.
+# Runs of old exchanges are condensed into digest entries by the Queen's model while a hive is idle.
+# The bee logs of digested exchanges are moved to the hive's archive file, and context extraction
+# hands the bees the digest instead of the raw exchanges of an old period. Prompt size and the
+# in-memory footprint of a long-lived hive therefore stay bounded.
+
+######## COMPACTION CONFIGURATION ########
+CHECK_INTERVAL = 60             # Seconds between checks for hives that are due
+IDLE_SECONDS = 300              # A hive must have been idle this long before it is compacted
+KEEP_RECENT = 20                # Most recent exchanges that are never digested
+RUN_SIZE = 10                   # Exchanges condensed into one digest
+MIN_RUN_SIZE = 2                # Smallest run worth a digest when the token budget is tight
+DIGEST_MAX_TOKENS = 300         # Output budget of one digest
+TOKEN_BUDGET = 20000            # Tokens (prompt estimate + output cap) compaction may spend per hour
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token), enough to keep to a budget"""
+    return len(text) // 4 + 1
+
+
+class MemoryCompactor:
+    """Periodically digests old exchanges of idle hives, within an hourly token budget.
+    get_hives returns the hives to consider; only those with compaction enabled are touched."""
+    def __init__(self, get_hives, token_budget=TOKEN_BUDGET, idle_seconds=IDLE_SECONDS):
+        self.get_hives = get_hives
+        self.tokenBudget = token_budget
+        self.idleSeconds = idle_seconds
+        self.spent = collections.deque()  # (time.monotonic(), tokens) of the last hour
+        self.running = False
+
+    def available_tokens(self):
+        now = time.monotonic()
+        while self.spent and now - self.spent[0][0] > 3600:
+            self.spent.popleft()
+        return self.tokenBudget - sum(tokens for _, tokens in self.spent)
+
+    def is_idle(self, hive):
+        return hive.activeQueries == 0 and time.monotonic() - hive.lastActivity >= self.idleSeconds
+
+    async def run(self):
+        """Compaction loop, meant to run as a background task for the lifetime of the app"""
+        self.running = True
+        while self.running:
+            await asyncio.sleep(CHECK_INTERVAL)
+            for hive in list(self.get_hives()):
+                if hive.compaction and self.is_idle(hive):
+                    await self.compact_hive(hive)
+
+    def stop(self):
+        self.running = False
+
+    async def compact_hive(self, hive):
+        """Digests every run of hive that is due, as far as the token budget allows. Returns the digests made.
+        hive.compacting is set meanwhile, so the registry does not unload the hive under it."""
+        hive.compacting = True
+        try:
+            return await self.compact_runs(hive)
+        finally:
+            hive.compacting = False
+
+    async def compact_runs(self, hive):
+        made = 0
+        while self.is_idle(hive):
+            run = hive.nextCompactionRun(KEEP_RECENT, RUN_SIZE)
+            if run is None or hive.queen.get_model() is None:
+                return made
+            start, end = run
+
+            # Shorten the run until its prompt fits in what is left of the budget
+            budget = self.available_tokens()
+            cost = None
+            while end - start >= MIN_RUN_SIZE:
+                prompt = hive.queen.constructDigestPrompt(hive.history[start:end])
+                cost = estimate_tokens(prompt) + DIGEST_MAX_TOKENS
+                if cost <= budget:
+                    break
+                end -= 1
+            if end - start < MIN_RUN_SIZE:
+                print(f"[Debug] Compaction of {hive.hiveName} paused, token budget used up")
+                return made
+
+            first = hive.history[start]["timestamp"]
+            self.spent.append((time.monotonic(), cost))
+            summary = await hive.queen.summarizeExchanges(hive.history[start:end], DIGEST_MAX_TOKENS)
+            if not summary:
+                print(f"[Debug] Compaction of {hive.hiveName} failed, will retry later")
+                return made
+
+            # The hive may have been cleared, or compacted by another pass, while the digest was being written
+            if len(hive.history) < end or hive.history[start]["timestamp"] != first or hive.compactedUpTo() != start:
+                print(f"[Debug] History of {hive.hiveName} changed during compaction, digest discarded")
+                return made
+
+            hive.addDigest(start, end, summary)
+            made += 1
+            print(f"[Debug] Digested exchanges {start + 1}-{end} of {hive.hiveName}")
+        return made
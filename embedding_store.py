@@ -0,0 +1,144 @@
+######## IMPORTS ########
+import os
+import struct
+import numpy as np
+
+# On-disk store of a hive's history embeddings.
+# Rows are fixed-width float32 vectors in a file opened with numpy.memmap, so loading a hive does not
+# re-embed or even read its history: searches run directly against the mapped pages, and every app
+# process reading the same store shares one copy of them through the OS page cache.
+#
+# Layout of <name>.f32:   64 byte header | capacity rows of dim float32
+# Layout of <name>.ids:   capacity int64 history positions, one per row
+# Header:                 magic, version, dim, row count, embedder name
+
+######## STORE CONFIGURATION ########
+MAGIC = b"HIVEEMB1"
+VERSION = 1
+HEADER_FORMAT = "<8sIIQ32s"     # magic, version, dim, count, embedder name
+HEADER_SIZE = 64
+COUNT_OFFSET = 16               # Byte offset of the row count inside the header
+INITIAL_CAPACITY = 64           # Rows allocated for a new store, doubled whenever it fills up
+
+
+class EmbeddingStore:
+    """Append-only, memory-mapped float32 matrix with one row per history entry.
+    A single writer (the app process that owns the hive) appends rows; any number of processes may open
+    the store with readonly=True and search it without copying it into their own memory."""
+    def __init__(self, path, dim, embedder, readonly=False):
+        self.path = path
+        self.idsPath = os.path.splitext(path)[0] + ".ids"
+        self.dim = dim
+        self.embedder = embedder
+        self.readonly = readonly
+
+        if not os.path.exists(self.path):
+            if readonly:
+                raise FileNotFoundError(self.path)
+            self._create(INITIAL_CAPACITY)
+        elif not self._header_matches():
+            if readonly:
+                raise ValueError(f"{self.path} was written for a different embedder or dimension")
+            print(f"[Debug] Embedding store {self.path} does not match {embedder} ({dim}), recreating it")
+            self._create(INITIAL_CAPACITY)
+        self._map()
+
+    ######## FILE MANAGEMENT ########
+    def _create(self, capacity):
+        header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, self.dim, 0, self.embedder.encode('utf-8')[:32])
+        with open(self.path, "wb") as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+            f.truncate(HEADER_SIZE + capacity * self.dim * 4)
+        with open(self.idsPath, "wb") as f:
+            f.truncate(capacity * 8)
+
+    def _header_matches(self):
+        try:
+            with open(self.path, "rb") as f:
+                magic, version, dim, _, embedder = struct.unpack(HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+        except (OSError, struct.error):
+            return False
+        return (magic == MAGIC and version == VERSION and dim == self.dim
+                and embedder.rstrip(b"\0").decode('utf-8', 'replace') == self.embedder
+                and os.path.exists(self.idsPath))
+
+    def _map(self):
+        mode = "r" if self.readonly else "r+"
+        capacity = (os.path.getsize(self.path) - HEADER_SIZE) // (self.dim * 4)
+        self.countView = np.memmap(self.path, dtype=np.uint64, mode=mode, offset=COUNT_OFFSET, shape=(1,))
+        self.rows = np.memmap(self.path, dtype=np.float32, mode=mode, offset=HEADER_SIZE, shape=(capacity, self.dim))
+        self.ids = np.memmap(self.idsPath, dtype=np.int64, mode=mode, shape=(capacity,))
+
+    def _unmap(self):
+        for view in (self.countView, self.rows, self.ids):
+            if not self.readonly:
+                view.flush()
+        del self.countView, self.rows, self.ids
+
+    def _resize(self, capacity):
+        """Grows or shrinks the files to hold capacity rows"""
+        self._unmap()
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER_SIZE + capacity * self.dim * 4)
+        with open(self.idsPath, "r+b") as f:
+            f.truncate(capacity * 8)
+        self._map()
+
+    @property
+    def capacity(self):
+        return len(self.rows)
+
+    def __len__(self):
+        # Read from the mapped header every time, so readers see rows appended by the writer
+        return min(int(self.countView[0]), self.capacity)
+
+    ######## READS ########
+    def matrix(self):
+        """Zero-copy view of the stored rows"""
+        if int(self.countView[0]) > self.capacity:
+            self._unmap()  # The writer grew the files since they were mapped
+            self._map()
+        return self.rows[:len(self)]
+
+    def positions(self):
+        """History position of each stored row"""
+        return self.ids[:len(self)]
+
+    ######## WRITES ########
+    def append(self, rows, positions):
+        """Appends rows, tagged with the history positions they were embedded from"""
+        assert not self.readonly, "Cannot append to a read-only embedding store"
+        count = len(self)
+        needed = count + len(rows)
+        if needed > self.capacity:
+            self._resize(max(needed, 2 * self.capacity))
+        self.rows[count:needed] = rows
+        self.ids[count:needed] = positions
+        self.rows.flush()
+        self.ids.flush()
+        # The count is written last so a reader never sees a row before its data is in place
+        self.countView[0] = needed
+        self.countView.flush()
+
+    def compact(self, keep=None):
+        """Drops every row whose history position is not in keep (all rows if keep is None), renumbers the
+        rest to consecutive positions in their original order and shrinks the files to fit"""
+        assert not self.readonly, "Cannot compact a read-only embedding store"
+        count = len(self)
+        if keep is None:
+            kept = np.zeros(0, dtype=np.int64)
+        else:
+            kept = np.flatnonzero(np.isin(self.ids[:count], np.asarray(list(keep), dtype=np.int64)))
+        self.rows[:len(kept)] = self.rows[kept]
+        self.ids[:len(kept)] = np.arange(len(kept))
+        self.countView[0] = len(kept)
+        self._resize(max(len(kept), INITIAL_CAPACITY))
+
+    def close(self):
+        self._unmap()
+
+    @staticmethod
+    def delete(path):
+        for file in (path, os.path.splitext(path)[0] + ".ids"):
+            if os.path.exists(file):
+                os.remove(file)
@@ -0,0 +1,605 @@
+######## IMPORTS ########
+import asyncio
+import collections
+import contextlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import httpx
+import cache
+
+# Shared HTTP client layer for every bee and queen in every hive.
+# One keep-alive session is kept per endpoint URL so consecutive turns against the same
+# Parallax node reuse their TCP/TLS connection instead of paying a new handshake each time.
+# Blocking callers go through requests sessions, coroutines through httpx.AsyncClient.
+
+######## CLIENT CONFIGURATION ########
+DEFAULT_POOL_SIZE = 8          # Keep-alive connections kept open per endpoint
+DEFAULT_CONNECT_TIMEOUT = 5    # Seconds allowed to establish a connection
+DEFAULT_READ_TIMEOUT = 120     # Seconds allowed between bytes of a reply
+
+_endpoint_settings = {}        # endpoint url -> {"pool_size", "connect_timeout", "read_timeout"}
+_clients = {}                  # endpoint url -> EndpointClient
+_async_clients = {}            # (event loop, endpoint url) -> httpx.AsyncClient
+_lock = threading.Lock()
+
+######## LOAD BALANCING & FAULT TOLERANCE ########
+LATENCY_EWMA_ALPHA = 0.3       # Weight of the newest call in an endpoint's latency average
+RETRY_ATTEMPTS = 3             # Tries per call, including the first
+BACKOFF_BASE = 0.5             # Seconds; upper bound of the first retry delay, doubled per retry
+BACKOFF_MAX = 8                # Seconds; cap on any single retry delay
+BREAKER_FAILURES = 3           # Consecutive failures that open an endpoint's circuit
+BREAKER_COOLDOWN = 30          # Seconds an open circuit fails fast before letting a probe through
+
+_stats = {}                    # endpoint url -> EndpointStats
+
+# Completion cache consulted before any request is sent. Requests with a temperature above zero are not
+# cached; the shipped generation settings leave temperature unset, which is (see cache.py)
+response_cache = cache.ResponseCache()
+
+
+class InferenceError(Exception):
+    """Raised when a completion could not be obtained from a model endpoint"""
+
+
+def normalize_endpoint(url):
+    """Endpoints are keyed without a trailing slash so 'http://host:3001/' and 'http://host:3001' share a pool"""
+    return url.rstrip('/')
+
+
+def completions_url(url):
+    return normalize_endpoint(url) + '/v1/chat/completions'
+
+
+def endpoint_settings(url):
+    """Returns the effective pool size and timeouts for an endpoint"""
+    settings = {
+        "pool_size": DEFAULT_POOL_SIZE,
+        "connect_timeout": DEFAULT_CONNECT_TIMEOUT,
+        "read_timeout": DEFAULT_READ_TIMEOUT
+    }
+    settings.update(_endpoint_settings.get(normalize_endpoint(url), {}))
+    return settings
+
+
+def configure_endpoint(url, pool_size=None, connect_timeout=None, read_timeout=None):
+    """Overrides the pool size and/or timeouts of a single endpoint.
+    An existing blocking client for the endpoint is closed so the next call picks up the new settings;
+    async clients pick them up the next time they are created."""
+    url = normalize_endpoint(url)
+    overrides = {
+        "pool_size": pool_size,
+        "connect_timeout": connect_timeout,
+        "read_timeout": read_timeout
+    }
+    with _lock:
+        current = _endpoint_settings.setdefault(url, {})
+        current.update({k: v for k, v in overrides.items() if v is not None})
+        client = _clients.pop(url, None)
+    if client:
+        client.close()
+
+
+class EndpointClient:
+    """Pooled keep-alive session for one model endpoint"""
+    def __init__(self, url, pool_size, connect_timeout, read_timeout):
+        self.url = url
+        self.completionsUrl = completions_url(url)
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def post_completion(self, payload, stream=False):
+        response = self.session.post(self.completionsUrl, json=payload, timeout=self.timeout, stream=stream)
+        response.raise_for_status()  # Raise an exception for bad status codes
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+def get_client(url):
+    """Returns the shared blocking client for an endpoint, creating it on first use"""
+    url = normalize_endpoint(url)
+    with _lock:
+        client = _clients.get(url)
+        if client is None:
+            settings = endpoint_settings(url)
+            client = EndpointClient(url, settings["pool_size"], settings["connect_timeout"], settings["read_timeout"])
+            _clients[url] = client
+            print(f"[Debug] Opened connection pool for {url} (size {settings['pool_size']})")
+        return client
+
+
+def get_async_client(url):
+    """Returns the shared httpx.AsyncClient for an endpoint on the running event loop.
+    Async clients are bound to the loop they were created on, so each loop gets its own."""
+    url = normalize_endpoint(url)
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get((loop, url))
+        if client is None:
+            settings = endpoint_settings(url)
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(settings["read_timeout"], connect=settings["connect_timeout"]),
+                limits=httpx.Limits(max_connections=settings["pool_size"], max_keepalive_connections=settings["pool_size"])
+            )
+            _async_clients[(loop, url)] = client
+            print(f"[Debug] Opened async connection pool for {url} (size {settings['pool_size']})")
+        return client
+
+
+def close_all():
+    """Closes every pooled blocking connection"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+async def aclose_loop_clients():
+    """Closes the async clients that belong to the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        keys = [key for key in _async_clients if key[0] is loop]
+        clients = [_async_clients.pop(key) for key in keys]
+    for client in clients:
+        await client.aclose()
+
+
+async def aclose_all():
+    """Closes every pooled connection, e.g. on app shutdown"""
+    close_all()
+    await aclose_loop_clients()
+
+
+######## ENDPOINT STATS ########
+class CircuitOpenError(InferenceError):
+    """Raised without contacting an endpoint while its circuit breaker is open"""
+
+
+class EndpointStats:
+    """Live load and health figures for one endpoint, shared by every hive that talks to it.
+    Also acts as the endpoint's circuit breaker: after BREAKER_FAILURES consecutive failures the
+    circuit opens and calls fail fast for BREAKER_COOLDOWN seconds, then a single probe call is let
+    through (half-open) and its outcome closes or re-opens the circuit."""
+    def __init__(self, url):
+        self.url = url
+        self.inFlight = 0          # Requests currently outstanding
+        self.latency = None        # EWMA of successful call durations in seconds
+        self.failures = 0          # Consecutive failed calls
+        self.circuit = "closed"    # closed, open or half-open
+        self.openedAt = 0.0        # time.monotonic() when the circuit last opened
+        self.probing = False       # Whether the half-open probe call is in flight
+
+    def is_available(self, now):
+        """Whether a call would currently be let through (without admitting it)"""
+        if self.circuit == "closed":
+            return True
+        if self.circuit == "open":
+            return now - self.openedAt >= BREAKER_COOLDOWN
+        return not self.probing
+
+    def admit(self, now):
+        """Lets a call through or raises CircuitOpenError. Must be called with _lock held."""
+        if self.circuit == "open" and now - self.openedAt >= BREAKER_COOLDOWN:
+            self.circuit = "half-open"
+            self.probing = False
+        if self.circuit == "open" or (self.circuit == "half-open" and self.probing):
+            raise CircuitOpenError(f"{self.url}: circuit open after {self.failures} consecutive failures")
+        if self.circuit == "half-open":
+            self.probing = True
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "inFlight": self.inFlight,
+            "latency": self.latency,
+            "failures": self.failures,
+            "circuit": self.circuit
+        }
+
+
+def get_stats(url):
+    url = normalize_endpoint(url)
+    with _lock:
+        stats = _stats.get(url)
+        if stats is None:
+            stats = _stats[url] = EndpointStats(url)
+        return stats
+
+
+# Errors that count against an endpoint's health: transport failures and error statuses
+ENDPOINT_ERRORS = (requests.exceptions.RequestException, httpx.HTTPError, InferenceError)
+
+
+@contextlib.contextmanager
+def track_call(url):
+    """Admits a request through the endpoint's circuit breaker, counts it as in flight for its
+    duration and records its latency and outcome. Only ENDPOINT_ERRORS count as failures."""
+    stats = get_stats(url)
+    with _lock:
+        stats.admit(time.monotonic())
+        stats.inFlight += 1
+    started = time.monotonic()
+    try:
+        yield
+    except ENDPOINT_ERRORS:
+        with _lock:
+            stats.inFlight -= 1
+            stats.failures += 1
+            if stats.circuit == "half-open" or stats.failures >= BREAKER_FAILURES:
+                if stats.circuit != "open":
+                    print(f"[Debug] Circuit for {stats.url} opened for {BREAKER_COOLDOWN}s after {stats.failures} failures")
+                stats.circuit = "open"
+                stats.openedAt = time.monotonic()
+                stats.probing = False
+        raise
+    except BaseException:
+        # The caller gave up or failed itself (a UI callback, a prefix hook, reply parsing),
+        # which says nothing about the endpoint's health
+        with _lock:
+            stats.inFlight -= 1
+            stats.probing = False
+        raise
+    else:
+        elapsed = time.monotonic() - started
+        with _lock:
+            stats.inFlight -= 1
+            stats.failures = 0
+            if stats.circuit != "closed":
+                print(f"[Debug] Circuit for {stats.url} closed")
+            stats.circuit = "closed"
+            stats.probing = False
+            if stats.latency is None:
+                stats.latency = elapsed
+            else:
+                stats.latency = LATENCY_EWMA_ALPHA * elapsed + (1 - LATENCY_EWMA_ALPHA) * stats.latency
+
+
+def pick_endpoint(urls, preferred=None):
+    """Picks the replica to send a call to: the available endpoint with the fewest in-flight requests,
+    then the lowest recent latency, then the caller's own endpoint. If every replica's circuit is open
+    they are all considered, and the call fails fast on the chosen one."""
+    candidates = [get_stats(url) for url in dict.fromkeys(urls)]
+    now = time.monotonic()
+    preferred = normalize_endpoint(preferred) if preferred else None
+    with _lock:
+        available = [stats for stats in candidates if stats.is_available(now)]
+        best = min(available or candidates, key=lambda stats: (
+            stats.inFlight,
+            stats.latency if stats.latency is not None else 0.0,  # Untried replicas get a chance first
+            stats.url != preferred
+        ))
+    return best.url
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff: a random delay up to BACKOFF_BASE * 2^attempt, capped at BACKOFF_MAX"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def is_retryable(error, endpoints=None):
+    """Whether a failed attempt is worth repeating: connection problems, timeouts, 429 and 5xx replies.
+    An open circuit is only worth retrying when another replica can take the call."""
+    if isinstance(error, CircuitOpenError):
+        return bool(endpoints) and len(endpoints) > 1
+    cause = error.__cause__
+    if isinstance(cause, requests.exceptions.HTTPError) and cause.response is not None:
+        status = cause.response.status_code
+        return status == 429 or status >= 500
+    if isinstance(cause, httpx.HTTPStatusError):
+        status = cause.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(cause, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                              requests.exceptions.ChunkedEncodingError, httpx.TransportError))
+
+
+######## PREFIX CACHE MEASUREMENT ########
+MEASURE_PREFIX = False         # Debug aid: scans recent prompts on every request, so it is off by default
+PREFIX_HISTORY = 8             # Recent prompts per endpoint a new prompt is compared against
+
+_recent_prompts = {}           # endpoint url -> deque of the last PREFIX_HISTORY serialized prompts
+_prefix_totals = {}            # endpoint url -> {"calls", "prefixChars", "totalChars"}
+prefix_hooks = []              # Callables handed the report of every request sent while MEASURE_PREFIX is on
+
+
+def serialize_messages(messages):
+    """Flattens chat messages in order, the way a chat template does, so a shared string prefix
+    corresponds to shared prompt tokens on the server"""
+    return "".join(f"<{message['role']}>\n{message['content']}\n" for message in messages)
+
+
+def measure_prefix(url, payload):
+    """Measures how much of a request's prompt repeats the start of one of the endpoint's recent prompts,
+    i.e. the part a server-side prefix (KV) cache could reuse instead of recomputing.
+    Returns {"endpoint", "prefixChars", "totalChars"} and passes the same dict to every hook in prefix_hooks."""
+    url = normalize_endpoint(url)
+    text = serialize_messages(payload.get("messages", []))
+    with _lock:
+        recent = _recent_prompts.setdefault(url, collections.deque(maxlen=PREFIX_HISTORY))
+        shared = max((len(os.path.commonprefix([text, previous])) for previous in recent), default=0)
+        recent.append(text)
+        totals = _prefix_totals.setdefault(url, {"calls": 0, "prefixChars": 0, "totalChars": 0})
+        totals["calls"] += 1
+        totals["prefixChars"] += shared
+        totals["totalChars"] += len(text)
+    report = {"endpoint": url, "prefixChars": shared, "totalChars": len(text)}
+    for hook in list(prefix_hooks):
+        hook(report)
+    return report
+
+
+def log_prefix(report):
+    """A prefix hook that prints every report, e.g. MEASURE_PREFIX = True; prefix_hooks.append(inference.log_prefix)"""
+    ratio = report["prefixChars"] / report["totalChars"] if report["totalChars"] else 0.0
+    print(f"[Debug] Prompt prefix for {report['endpoint']}: {report['prefixChars']}/{report['totalChars']} chars shared ({ratio:.0%})")
+
+
+def prefix_stats():
+    """Per endpoint totals of measure_prefix, with the overall share of prompt characters that were a shared prefix"""
+    with _lock:
+        return {
+            url: dict(totals, ratio=totals["prefixChars"] / totals["totalChars"] if totals["totalChars"] else 0.0)
+            for url, totals in _prefix_totals.items()
+        }
+
+
+######## RESPONSE PARSING ########
+def message_content(data):
+    """Returns the generated text of a non-streaming chat completion body"""
+    return data["choices"][0]["message"]["content"]
+
+
+def parse_stream_line(line):
+    """Parses one line of an OpenAI-style SSE stream ('data: {...}' lines ending with 'data: [DONE]').
+    Returns (done, text) where text is the content delta of the line, if any."""
+    if not line:
+        return False, None  # Blank lines separate SSE events
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    if not line.startswith('data:'):
+        return False, None  # Comments, event names and keep-alives
+    data = line[len('data:'):].strip()
+    if data == '[DONE]':
+        return True, None
+    try:
+        chunk = json.loads(data)
+    except ValueError:
+        print(f"[Debug] Skipping malformed stream chunk: {data[:80]}")
+        return False, None
+    choices = chunk.get("choices") or []
+    if not choices:
+        return False, None
+    delta = choices[0].get("delta") or {}
+    return False, delta.get("content") or None
+
+
+######## SENTENCE CUTOFF ########
+# A sentence ends at . ! or ?, plus any closing quotes or emojis that trail it, once the next sentence has begun
+SENTENCE_BOUNDARY = re.compile(r'[.!?]+[^\w\s]*(?:\s+[^\w\s]+)*\s+(?=["\'(\[]?[A-Z0-9])')
+
+
+def sentence_ends(text):
+    """Offsets at which each finished sentence of text ends"""
+    return [match.end() for match in SENTENCE_BOUNDARY.finditer(text)]
+
+
+def truncate_sentences(text, max_sentences):
+    """Keeps only the first max_sentences sentences of text"""
+    if not text or not max_sentences:
+        return text
+    ends = sentence_ends(text)
+    if len(ends) < max_sentences:
+        return text
+    return text[:ends[max_sentences - 1]].rstrip()
+
+
+def sentence_limit(max_sentences, clean=None):
+    """Returns a stop_when predicate for complete() that turns true once the reply holds max_sentences
+    finished sentences, or None when there is no limit. The predicate is handed the growing reply after
+    every chunk and only scans what arrived after the last finished sentence, so a reply is scanned about
+    once. A leading reasoning block never counts towards the limit. clean maps raw text to the visible reply
+    and is only used for replies with chat template markup (<|...|> tokens), which are rescanned in full."""
+    if not max_sentences:
+        return None
+    state = {"found": 0, "resume": None, "searched": 0, "markup": False}
+    def reached(text):
+        if state["found"] >= max_sentences:
+            return True
+        if state["resume"] is None:
+            # Where the visible reply starts: after a leading reasoning block once it has closed
+            stripped = text.lstrip()
+            if len(stripped) < len('<think>') and '<think>'.startswith(stripped):
+                return False
+            if stripped.startswith('<think>'):
+                close = text.find('</think>', state["searched"])
+                if close < 0:
+                    state["searched"] = max(0, len(text) - len('</think>'))
+                    return False
+                state["resume"] = close + len('</think>')
+            else:
+                state["resume"] = 0
+            state["searched"] = state["resume"]
+        state["markup"] = state["markup"] or '<|' in text[max(0, state["searched"] - 1):]
+        state["searched"] = len(text)
+        if state["markup"] and clean:
+            visible = clean(text)
+            state["found"] = len(sentence_ends(visible)) if visible else 0
+            return state["found"] >= max_sentences
+        for match in SENTENCE_BOUNDARY.finditer(text, state["resume"]):
+            state["found"] += 1
+            state["resume"] = match.end()
+            if state["found"] >= max_sentences:
+                return True
+        return False
+    return reached
+
+
+def iter_stream_deltas(lines):
+    """Yields the text deltas of an SSE stream"""
+    for line in lines:
+        done, text = parse_stream_line(line)
+        if done:
+            break
+        if text:
+            yield text
+
+
+######## BLOCKING REQUESTS ########
+def chat_completion(url, payload):
+    """Sends a non-streaming /v1/chat/completions request through the endpoint's pool and returns the JSON body"""
+    response = get_client(url).post_completion(payload)
+    return response.json()
+
+
+def stream_chat_completion(url, payload, on_delta=None, stop_when=None):
+    """Sends a streaming /v1/chat/completions request and returns the full generated text.
+    on_delta(text_so_far) is called after every chunk so the UI can show the reply as it is generated.
+    Once stop_when(text_so_far) is true the connection is dropped, which ends generation on the server
+    but also means the connection is not reused."""
+    payload = dict(payload, stream=True)
+    response = get_client(url).post_completion(payload, stream=True)
+    text_so_far = ""
+    try:
+        # Raw bytes, decoded as UTF-8 by parse_stream_line: requests would assume ISO-8859-1 for text/event-stream
+        for text in iter_stream_deltas(response.iter_lines()):
+            text_so_far += text
+            if on_delta:
+                on_delta(text_so_far)
+            if stop_when and stop_when(text_so_far):
+                break
+    finally:
+        # A fully read reply has already released its connection to the pool; closing one that stop_when cut
+        # short drops the connection instead (which is what ends generation on the server)
+        response.close()
+    return text_so_far
+
+
+def _attempt(url, payload, on_delta, stop_when=None):
+    if MEASURE_PREFIX:
+        measure_prefix(url, payload)
+    try:
+        with track_call(url):
+            if on_delta or stop_when:
+                return stream_chat_completion(url, payload, on_delta, stop_when)
+            return message_content(chat_completion(url, payload))
+    except (requests.exceptions.RequestException, ValueError, KeyError, IndexError) as e:
+        raise InferenceError(f"{url}: {e}") from e
+
+
+def complete(url, payload, on_delta=None, endpoints=None, stop_when=None):
+    """Runs one chat completion on the blocking client and returns the raw generated text.
+    The reply is streamed when on_delta or stop_when is given, and cut short as soon as stop_when(text_so_far)
+    is true (a reply cut short by this client-side rule is not cached). If endpoints lists interchangeable replicas
+    each attempt is routed by pick_endpoint instead of going to url. Failed attempts are retried
+    with jittered exponential backoff, up to RETRY_ATTEMPTS in total, unless part of the reply
+    was already streamed. Raises InferenceError once the call has definitively failed.
+    Deterministic requests are answered from response_cache when the same payload was seen before."""
+    cached = response_cache.get(url, payload)
+    if cached is not None:
+        if on_delta:
+            on_delta(cached)
+        return cached
+
+    streamed = [False]
+    def on_chunk(text):
+        streamed[0] = True
+        if on_delta:
+            on_delta(text)
+
+    for attempt in range(RETRY_ATTEMPTS):
+        target = pick_endpoint(endpoints, preferred=url) if endpoints else normalize_endpoint(url)
+        try:
+            content = _attempt(target, payload, on_chunk if (on_delta or stop_when) else None, stop_when)
+            if not (stop_when and stop_when(content)):
+                response_cache.put(url, payload, content)
+            return content
+        except InferenceError as e:
+            if attempt == RETRY_ATTEMPTS - 1 or streamed[0] or not is_retryable(e, endpoints):
+                raise
+            delay = backoff_delay(attempt)
+            print(f"[Debug] Retrying {target} in {delay:.1f}s after: {e}")
+            time.sleep(delay)
+
+
+######## ASYNC REQUESTS ########
+async def chat_completion_async(url, payload):
+    """Non-blocking counterpart of chat_completion"""
+    response = await get_async_client(url).post(completions_url(url), json=payload)
+    response.raise_for_status()
+    return response.json()
+
+
+async def stream_chat_completion_async(url, payload, on_delta=None, stop_when=None):
+    """Non-blocking counterpart of stream_chat_completion"""
+    payload = dict(payload, stream=True)
+    text_so_far = ""
+    async with get_async_client(url).stream("POST", completions_url(url), json=payload) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            done, text = parse_stream_line(line)
+            if done:
+                break
+            if text:
+                text_so_far += text
+                if on_delta:
+                    on_delta(text_so_far)
+                if stop_when and stop_when(text_so_far):
+                    break
+    return text_so_far
+
+
+async def _attempt_async(url, payload, on_delta, stop_when=None):
+    if MEASURE_PREFIX:
+        measure_prefix(url, payload)
+    try:
+        with track_call(url):
+            if on_delta or stop_when:
+                return await stream_chat_completion_async(url, payload, on_delta, stop_when)
+            return message_content(await chat_completion_async(url, payload))
+    except (httpx.HTTPError, ValueError, KeyError, IndexError) as e:
+        raise InferenceError(f"{url}: {e}") from e
+
+
+async def complete_async(url, payload, on_delta=None, endpoints=None, stop_when=None):
+    """Non-blocking counterpart of complete. The response cache reads and writes files, so it is consulted on a worker thread."""
+    cached = await asyncio.to_thread(response_cache.get, url, payload)
+    if cached is not None:
+        if on_delta:
+            on_delta(cached)
+        return cached
+
+    streamed = [False]
+    def on_chunk(text):
+        streamed[0] = True
+        if on_delta:
+            on_delta(text)
+
+    for attempt in range(RETRY_ATTEMPTS):
+        target = pick_endpoint(endpoints, preferred=url) if endpoints else normalize_endpoint(url)
+        try:
+            content = await _attempt_async(target, payload, on_chunk if (on_delta or stop_when) else None, stop_when)
+            if not (stop_when and stop_when(content)):
+                await asyncio.to_thread(response_cache.put, url, payload, content)
+            return content
+        except InferenceError as e:
+            if attempt == RETRY_ATTEMPTS - 1 or streamed[0] or not is_retryable(e, endpoints):
+                raise
+            delay = backoff_delay(attempt)
+            print(f"[Debug] Retrying {target} in {delay:.1f}s after: {e}")
+            await asyncio.sleep(delay)
+
+
+def cache_stats():
+    """Hit and miss counters of the completion cache"""
+    return response_cache.stats()
@@ -0,0 +1,48 @@
+"""Copies hives stored as JSON files into the SQLite storage backend (storage.py).
+
+Reads every hives/hive_*.json together with its history (the history journal, or history kept inline
+by older hive files) and writes it to the database. The JSON files are left in place; set
+STORAGE_BACKEND = "sqlite" in app.py to use the database afterwards.
+
+    python migrate_storage.py                      # into hives/hives.db
+    python migrate_storage.py --database other.db --overwrite
+"""
+######## IMPORTS ########
+import argparse
+import json
+import os
+import Hive
+import storage
+
+
+def migrate(database, overwrite=False):
+    existing = {hive_id for hive_id, _, _ in database.list_hives()}
+    files = sorted(f for f in os.listdir("hives") if f.startswith("hive_") and f.endswith(".json"))
+    migrated = 0
+    for file in files:
+        try:
+            with open(os.path.join("hives", file), "r") as f:
+                hive = Hive.Hive.from_dict(json.load(f))  # Hive.Hive.storage is unset, so history comes from the JSON side
+        except Exception as e:
+            print(f"Skipping {file}: {e}")
+            continue
+        if hive.hiveID in existing and not overwrite:
+            print(f"Skipping {hive.hiveName}: already in the database (use --overwrite)")
+            continue
+        database.save_hive(hive.snapshot(rewrite=True))  # Every exchange, replacing any copied before
+        migrated += 1
+        print(f"Migrated {hive.hiveName}: {len(hive.history)} exchanges, {len(hive.bees)} bees")
+    print(f"{migrated} of {len(files)} hives migrated to {database.path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=storage.DATABASE_PATH)
+    parser.add_argument("--overwrite", action="store_true", help="replace hives already in the database")
+    args = parser.parse_args()
+
+    migrate(storage.SQLiteStorage(args.database), args.overwrite)
+
+
+if __name__ == "__main__":
+    main()
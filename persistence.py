@@ -0,0 +1,183 @@
+######## IMPORTS ########
+import threading
+import time
+import Hive
+
+# Write-behind persistence of hives.
+# Hive.save() only marks the hive dirty once a manager is installed (Hive.Hive.persistence). A writer
+# thread writes each dirty hive to disk when it has been left alone for the debounce window, so a burst
+# of edits (typing a role, toggling switches, injections) costs one write, and UI handlers on the event
+# loop never wait on disk. Pending writes are flushed when the selected hive changes and on shutdown.
+# The hive is snapshotted (Hive.snapshot) when it is marked dirty, on the event loop that changes it;
+# the writer thread only ever sees snapshots, never the live hive. Manifest entries of written hives are
+# collected and written to hives/manifest.json together, at most every MANIFEST_DELAY_SECONDS.
+
+######## PERSISTENCE CONFIGURATION ########
+DEBOUNCE_SECONDS = 0.5          # A hive is written this long after its last change
+MAX_DELAY_SECONDS = 5.0         # ... but never later than this after its first unsaved change
+MAX_RETRIES = 3                 # Failed writes of a snapshot retried before it is dropped for a full rewrite
+MANIFEST_DELAY_SECONDS = 5.0    # Manifest entries of written hives are batched for this long
+
+
+def merge_snapshots(older, newer):
+    """One snapshot writing both: the newer configuration and the history entries of both"""
+    if newer["rewrite"]:
+        return newer
+    return dict(newer, start=older["start"], entries=older["entries"] + newer["entries"],
+                rewrite=older["rewrite"], attempts=older.get("attempts", 0))
+
+
+class PersistenceManager:
+    """Coalesces hive saves and performs them on a background writer thread with Hive.writeSnapshot()"""
+    def __init__(self, debounce=DEBOUNCE_SECONDS, max_delay=MAX_DELAY_SECONDS):
+        self.debounce = debounce
+        self.maxDelay = max_delay
+        self.pending = {}       # hiveID -> [hive, snapshot, first change, last change] (time.monotonic())
+        self.failed = {}        # hiveID -> hive whose writes were given up, written in full on its next save
+        self.deleted = set()    # hiveIDs of deleted hives, whose saves are ignored
+        self.manifestUpdates = {}  # hiveID -> manifest entry of written hives, not yet in the manifest
+        self.manifestDue = None    # When the batched manifest entries are written (time.monotonic())
+        self.condition = threading.Condition()
+        self.writeLock = threading.Lock()  # Held while a snapshot is being written
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="hive-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Writes every pending hive and stops the writer thread"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def mark_dirty(self, hive):
+        """Snapshots hive and schedules the write; called on the thread that changes hives"""
+        now = time.monotonic()
+        with self.condition:
+            if hive.hiveID in self.deleted:
+                return
+            snapshot = hive.snapshot(rewrite=self.failed.pop(hive.hiveID, None) is not None)
+            entry = self.pending.get(hive.hiveID)
+            if entry is None:
+                self.pending[hive.hiveID] = [hive, snapshot, now, now]
+            else:
+                entry[1] = merge_snapshots(entry[1], snapshot)
+                entry[3] = now
+            self.condition.notify()
+
+    def discard(self, id):
+        """Drops pending writes of a hive that is being deleted and ignores its later saves. Returns once a
+        write of it that is in progress has finished, so the hive's files can be removed."""
+        with self.condition:
+            self.pending.pop(id, None)
+            self.failed.pop(id, None)
+            self.manifestUpdates.pop(id, None)
+            self.deleted.add(id)
+        with self.writeLock:
+            pass
+
+    def request_flush(self, hive):
+        """Asks the writer thread to write hive now, without waiting for it"""
+        with self.condition:
+            entry = self.pending.get(hive.hiveID)
+            if entry is not None:
+                entry[2] = entry[3] = time.monotonic() - self.maxDelay
+                self.condition.notify()
+
+    def flush(self, hive=None):
+        """Writes hive (or every pending hive) on the calling thread, which must be the one that changes hives"""
+        with self.condition:
+            failed = list(self.failed.values()) if hive is None else [self.failed[hive.hiveID]] if hive.hiveID in self.failed else []
+        for failedHive in failed:
+            self.mark_dirty(failedHive)  # Takes the full snapshot the given up writes are replaced with
+        with self.condition:
+            if hive is None:
+                due = list(self.pending.values())
+                self.pending.clear()
+            else:
+                entry = self.pending.pop(hive.hiveID, None)
+                due = [entry] if entry else []
+        for hive, snapshot, _, _ in due:
+            self._write(hive, snapshot)
+        self._write_manifest(force=True)
+
+    ######## WRITER THREAD ########
+    def _due_at(self, entry):
+        return min(entry[3] + self.debounce, entry[2] + self.maxDelay)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    now = time.monotonic()
+                    due = [id for id, entry in self.pending.items() if self._due_at(entry) <= now]
+                    if due or (self.manifestDue is not None and self.manifestDue <= now):
+                        break
+                    nextDue = min([self._due_at(entry) for entry in self.pending.values()]
+                                  + ([self.manifestDue] if self.manifestDue is not None else []), default=None)
+                    self.condition.wait(None if nextDue is None else nextDue - now)
+                if not self.running:
+                    return
+                writes = [self.pending.pop(id) for id in due]
+            for hive, snapshot, _, _ in writes:
+                self._write(hive, snapshot)
+            self._write_manifest()
+
+    def _write_manifest(self, force=False):
+        """Writes the batched manifest entries once they are due (or now, with force)"""
+        with self.writeLock:
+            with self.condition:
+                if not self.manifestUpdates:
+                    self.manifestDue = None  # Their hives were deleted meanwhile
+                    return
+                if not (force or self.manifestDue <= time.monotonic()):
+                    return
+                updates = self.manifestUpdates
+                self.manifestUpdates = {}
+                self.manifestDue = None
+            try:
+                Hive.Hive.updateManifestEntries(updates)
+            except Exception as e:
+                # The manifest is only an index of the hive files, loadManifest rebuilds missing entries
+                print(f"[Debug] Updating the hive manifest failed ({e})")
+
+    def _write(self, hive, snapshot):
+        with self.writeLock:
+            with self.condition:
+                if snapshot["hiveID"] in self.deleted:
+                    return
+            try:
+                Hive.Hive.writeSnapshot(snapshot, manifest=False)
+                with self.condition:
+                    self.manifestUpdates[snapshot["hiveID"]] = snapshot["manifest"]
+                    if self.manifestDue is None:
+                        self.manifestDue = time.monotonic() + MANIFEST_DELAY_SECONDS
+                return
+            except Exception as e:
+                error = e
+        snapshot["attempts"] = snapshot.get("attempts", 0) + 1
+        now = time.monotonic()
+        with self.condition:
+            if snapshot["hiveID"] in self.deleted:
+                return
+            if snapshot["attempts"] > MAX_RETRIES:
+                # Later snapshots only append to this one, so they are dropped with it
+                print(f"[Debug] Saving {snapshot['hiveName']} failed ({error}), giving up until its next save")
+                self.pending.pop(snapshot["hiveID"], None)
+                self.failed[snapshot["hiveID"]] = hive
+                return
+            print(f"[Debug] Saving {snapshot['hiveName']} failed ({error}), retrying")
+            entry = self.pending.get(snapshot["hiveID"])
+            if entry is None:
+                self.pending[snapshot["hiveID"]] = [hive, snapshot, now, now]
+            else:
+                entry[1] = merge_snapshots(snapshot, entry[1])
+                entry[2] = min(entry[2], now)
+            self.condition.notify()
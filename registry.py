@@ -0,0 +1,71 @@
+######## IMPORTS ########
+import collections
+import Hive
+
+# Lazy loading of hives.
+# At startup only the hive manifest (ID, name, lastModified, bee count, history length) is read, which is
+# enough to fill the hive dropdown. A hive, with its bees and full history, is loaded the first time it
+# is selected, and the least recently used hives are dropped from memory again once more than
+# MAX_LOADED_HIVES are loaded.
+
+######## REGISTRY CONFIGURATION ########
+MAX_LOADED_HIVES = 4            # Hives kept in memory, the selected one included
+
+
+class HiveRegistry:
+    """Hives by name, loaded on first access. Behaves like the {name: hive} dict app.py used to build."""
+    def __init__(self, max_loaded=MAX_LOADED_HIVES):
+        self.maxLoaded = max_loaded
+        self.manifest = collections.OrderedDict(
+            (entry["hiveName"], entry) for entry in Hive.Hive.loadManifest()
+        )
+        self.loaded = collections.OrderedDict()  # hiveName -> Hive, least recently used first
+
+    def __contains__(self, name):
+        return name in self.manifest
+
+    def __len__(self):
+        return len(self.manifest)
+
+    def keys(self):
+        """Hive names, most recently modified first"""
+        return self.manifest.keys()
+
+    def __getitem__(self, name):
+        hive = self.loaded.get(name)
+        if hive is None:
+            hive = Hive.Hive.loadById(self.manifest[name]["hiveID"])
+            print(f"[Debug] Loaded hive: {hive.hiveName} (ID: {hive.hiveID})")
+            self.loaded[name] = hive
+        self.loaded.move_to_end(name)
+        self.evict()
+        return hive
+
+    def __setitem__(self, name, hive):
+        self.manifest[name] = hive.manifestEntry()
+        self.loaded[name] = hive
+        self.loaded.move_to_end(name)
+        self.evict()
+
+    def __delitem__(self, name):
+        del self.manifest[name]
+        self.loaded.pop(name, None)
+
+    def values(self):
+        """The hives currently in memory"""
+        return list(self.loaded.values())
+
+    def evict(self):
+        """Drops least recently used hives beyond maxLoaded, skipping any with a query in flight or being compacted
+        (a copy loaded meanwhile would not see the digest the compactor adds to this one)"""
+        for name in list(self.loaded):
+            if len(self.loaded) <= self.maxLoaded:
+                return
+            hive = self.loaded[name]
+            if hive.activeQueries or hive.compacting:
+                continue
+            if Hive.Hive.persistence is not None:
+                Hive.Hive.persistence.flush(hive)  # Write pending changes before a fresh copy can be loaded
+            self.manifest[name] = hive.manifestEntry()
+            del self.loaded[name]
+            print(f"[Debug] Unloaded hive: {name}")
@@ -0,0 +1,71 @@
+"""Benchmark of the canvas render traffic (render_protocol.py) with the simulation on the server.
+
+Steps a hive of bees with the swarm engine at the timer rate and encodes every frame both as the old
+renderBees payload (every bee's name, role, size, state and full-precision motion, on every frame) and as
+the delta-encoded protocol. Every few seconds one bee changes state and the link animation changes, as
+during a query. Reports the bytes per second each client receives with either format.
+
+    python render_benchmark.py                     # 5, 10, 25 and 50 bees at 60 FPS
+    python render_benchmark.py --sizes 10 --fps 30 --seconds 30
+"""
+######## IMPORTS ########
+import argparse
+import numpy as np
+import Bee
+import Queen
+import swarm
+import render_protocol
+
+CANVAS_W = 1200
+CANVAS_H = 700
+
+
+def make_members(count, rng):
+    members = [Bee.Bee(f"Bee {i}", "benchmark") for i in range(count)] + [Queen.Queen()]
+    for member in members:
+        member.x, member.y = rng.uniform(50, CANVAS_W - 50), rng.uniform(50, CANVAS_H - 50)
+    return members
+
+
+def run(count, fps, seconds, event_interval, rng):
+    members = make_members(count, rng)
+    engine = swarm.SwarmEngine(seed=0)
+    encoder = render_protocol.RenderEncoder()
+    animation = {"phase": "idle", "links": []}
+    legacy_bytes = 0
+    frames = int(fps * seconds)
+    event_every = max(int(fps * event_interval), 1)
+
+    for frame in range(frames):
+        changed = frame == 0
+        if frame and frame % event_every == 0:
+            bee = members[rng.integers(count)]
+            bee.state = "thinking" if bee.state == "idle" else "idle"
+            animation = {"phase": "discussion", "links": [{"from": bee.get_beeId(), "to": "Queen", "type": "discussion"}]}
+            changed = True
+        engine.step(members, 1 / fps, CANVAS_W, CANVAS_H)
+        legacy_bytes += len(render_protocol.legacy_payload(members, animation).encode("utf-8"))
+        encoder.encode(members, animation if changed else None)
+
+    legacy_rate = legacy_bytes / seconds
+    delta_rate = encoder.bytesSent / seconds
+    print(f"{count:>6}{legacy_rate:>16,.0f}{delta_rate:>16,.0f}{legacy_rate / delta_rate:>10.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 10, 25, 50], help="bees besides the queen")
+    parser.add_argument("--fps", type=float, default=60)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--event-interval", type=float, default=2, help="seconds between state and link changes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'bees':>6}{'old bytes/s':>16}{'new bytes/s':>16}{'saving':>11}")
+    for count in args.sizes:
+        run(count, args.fps, args.seconds, args.event_interval, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+######## IMPORTS ########
+import json
+import time
+
+# Compact, delta-encoded render protocol between onTimer (server-side simulation) and the canvas.
+# The old protocol sent every bee's name, role, size, state, position and velocity as a nested JSON
+# object on every frame, after a deep comparison with the previous frame. Now:
+#   renderRoster({v, r, bees: [{id, name, role, size}]})   once per roster change; r is the roster version
+#   renderFrame({v, r, p, s, a})                            per frame, each field only when it changed:
+#       p: flat [x, y, vx, vy, ...] in roster order, positions and velocities to 1 decimal
+#       s: {roster index: state} for bees whose state changed
+#       a: the animation state (phase and links)
+# Frames for an older roster version are ignored by the client.
+
+######## PROTOCOL CONFIGURATION ########
+PROTOCOL_VERSION = 1
+POSITION_DECIMALS = 1           # Sub-pixel precision is invisible on the canvas
+VELOCITY_DECIMALS = 1           # Velocities only orient the sprites
+REPORT_INTERVAL = 10            # Seconds between traffic reports
+
+
+def compact_json(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
+class RenderEncoder:
+    """Turns the members of the selected hive into protocol messages, sending only what changed, and counts
+    the bytes sent (every client receives the same messages, so this is the traffic per client)"""
+    def __init__(self):
+        self.rosterVersion = 0
+        self.bytesSent = 0
+        self.windowStart = time.monotonic()
+        self.windowBytes = 0
+        self.reset()
+
+    def reset(self):
+        """Forgets what was sent, so the next encode() sends the roster and a full frame (e.g. for a new client)"""
+        self.roster = None
+        self.lastPacked = None
+        self.lastStates = None
+
+    def encode(self, members, animation=None):
+        """Returns the JavaScript calls to run for this frame (possibly none). animation is the animation state
+        to send, or None when it has not changed."""
+        calls = []
+        roster = [(m.get_beeId(), m.get_name(), m.get_role(), m.get_size()) for m in members]
+        if roster != self.roster:
+            self.roster = roster
+            self.rosterVersion += 1
+            self.lastPacked = None
+            self.lastStates = None
+            calls.append("renderRoster(" + compact_json({
+                "v": PROTOCOL_VERSION,
+                "r": self.rosterVersion,
+                "bees": [{"id": id, "name": name, "role": role, "size": size} for id, name, role, size in roster]
+            }) + ")")
+
+        frame = {"v": PROTOCOL_VERSION, "r": self.rosterVersion}
+        packed = []
+        for m in members:
+            packed += [round(m.x, POSITION_DECIMALS), round(m.y, POSITION_DECIMALS),
+                       round(m.vx, VELOCITY_DECIMALS), round(m.vy, VELOCITY_DECIMALS)]
+        if packed != self.lastPacked:
+            frame["p"] = packed
+            self.lastPacked = packed
+
+        states = [m.get_state() for m in members]
+        if self.lastStates is None:
+            frame["s"] = dict(enumerate(states))
+        else:
+            changed = {i: state for i, (state, last) in enumerate(zip(states, self.lastStates)) if state != last}
+            if changed:
+                frame["s"] = changed
+        self.lastStates = states
+
+        if animation is not None:
+            frame["a"] = animation
+        if len(frame) > 2:
+            calls.append("renderFrame(" + compact_json(frame) + ")")
+
+        for call in calls:
+            self.count(len(call.encode('utf-8')))
+        return calls
+
+    def count(self, size):
+        self.bytesSent += size
+        self.windowBytes += size
+        elapsed = time.monotonic() - self.windowStart
+        if elapsed >= REPORT_INTERVAL:
+            print(f"[Debug] Canvas render traffic: {self.windowBytes / elapsed:,.0f} bytes/s per client")
+            self.windowStart = time.monotonic()
+            self.windowBytes = 0
+
+
+def legacy_payload(members, animation):
+    """The call the previous protocol sent every frame, for comparison (see render_benchmark.py)"""
+    bees = {
+        m.get_beeId(): {
+            "name": m.get_name(), "role": m.get_role(),
+            "x": float(m.x), "y": float(m.y), "vx": float(m.vx), "vy": float(m.vy),
+            "state": m.get_state(), "size": m.get_size()
+        } for m in members
+    }
+    return f'renderBees({json.dumps({"bees": bees, "animation": animation})})'
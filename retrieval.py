@@ -0,0 +1,364 @@
+######## IMPORTS ########
+import json
+import os
+import re
+import zlib
+import numpy as np
+import vector
+import ann
+import embedding_store
+import Transcript
+
+# Optional: a local sentence-transformers model can replace the hashed embedder
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+# Context retrieval over a hive's history.
+# Every history entry is embedded once, when it is added, and a new prompt is ranked against all of
+# them by cosine similarity, so the context handed to the bees is the exchanges that matter for the
+# prompt rather than simply the most recent ones.
+
+######## RETRIEVAL CONFIGURATION ########
+EMBEDDING_DIM = 2048            # Buckets of the hashed n-gram embedder
+RETRIEVAL_THRESHOLD = 0.1       # Default minimum cosine similarity for an exchange to be used as context
+DEFAULT_EMBEDDER = "hashed-ngram"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def entry_text(entry):
+    """The searchable text of a history entry: the query, the bees' discussion and the final answer"""
+    parts = [entry.get("prompt", "")]
+    for log in entry.get("logs", []):
+        parts.append(Transcript.Transcript.clean_response(log.get("response", "")))
+    parts.append(entry.get("response", ""))
+    return "\n".join(parts)
+
+
+######## EMBEDDERS ########
+class HashedEmbedder:
+    """Offline embedder: word unigrams and bigrams hashed into EMBEDDING_DIM buckets with sublinear term
+    frequencies. It needs no model or vocabulary, so every process embeds a text the same way.
+    IDF weighting is left to the index, which applies it on the query side."""
+    name = "hashed-ngram"
+    usesIdf = True
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def features(self, text):
+        tokens = tokenize(text)
+        grams = tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]
+        return [zlib.crc32(gram.encode('utf-8')) % self.dim for gram in grams]
+
+    def embed(self, texts):
+        """Returns one unit-length float32 row per text"""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets = self.features(text)
+            if buckets:
+                counts = np.bincount(buckets, minlength=self.dim)
+                present = counts > 0
+                vectors[row, present] = 1 + np.log(counts[present])
+        return vector.normalizeRows(vectors)
+
+
+class LocalModelEmbedder:
+    """A sentence-transformers model run locally (optional: pip install sentence-transformers)"""
+    usesIdf = False
+
+    def __init__(self, model_name="all-MiniLM-L6-v2"):
+        if SentenceTransformer is None:
+            raise ImportError("sentence-transformers is not installed")
+        self.name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        return vector.normalizeRows(self.model.encode(list(texts), convert_to_numpy=True))
+
+
+_embedders = {}
+
+
+def get_embedder(name=DEFAULT_EMBEDDER):
+    """Shared embedder instance by name: "hashed-ngram" or the name of a sentence-transformers model"""
+    embedder = _embedders.get(name)
+    if embedder is None:
+        if name == HashedEmbedder.name:
+            embedder = HashedEmbedder()
+        else:
+            embedder = LocalModelEmbedder(name)
+        _embedders[name] = embedder
+    return embedder
+
+
+######## VECTOR INDEX ########
+class VectorIndex:
+    """Embeddings of a hive's history entries, one row per entry in history order, searched by cosine similarity.
+    Rows live in memory, or in an embedding_store.EmbeddingStore when one is given so they persist across restarts.
+    IDF weights are applied to the query only, so stored rows never have to be re-embedded as the history grows.
+    Once there are ann.ANN_MIN_ENTRIES rows, search goes through an approximate IVF index scanning nprobe clusters;
+    with a store, the trained IVF index is saved next to it."""
+    def __init__(self, embedder=None, store=None, nprobe=ann.ANN_PROBES):
+        self.embedder = embedder or get_embedder()
+        self.store = store
+        self.ann = None
+        if store is not None:
+            self.ann = ann.IVFIndex.load(VectorIndex.annPath(store.path), self.embedder.dim, self.embedder.name, nprobe)
+        if self.ann is None:
+            self.ann = ann.IVFIndex(nprobe=nprobe)
+        self.vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self.count = 0
+        self.documentFrequency = np.zeros(self.embedder.dim, dtype=np.float64)
+        if store is not None and len(store):
+            # Document frequencies are not stored; one pass over the mapped rows recovers them
+            self.documentFrequency += (store.matrix() > 0).sum(axis=0)
+
+    def __len__(self):
+        if self.store is not None:
+            return len(self.store)
+        return self.count
+
+    @staticmethod
+    def annPath(store_path):
+        return os.path.splitext(store_path)[0] + ".ivf.npz"
+
+    @staticmethod
+    def delete(store_path):
+        """Removes an embedding store and the IVF index saved next to it"""
+        embedding_store.EmbeddingStore.delete(store_path)
+        if os.path.exists(VectorIndex.annPath(store_path)):
+            os.remove(VectorIndex.annPath(store_path))
+
+    def matrix(self):
+        """The stored rows (a zero-copy view when they are memory-mapped)"""
+        if self.store is not None:
+            return self.store.matrix()
+        return self.vectors[:self.count]
+
+    def add(self, entries):
+        """Embeds and appends history entries"""
+        if not entries:
+            return
+        rows = self.embedder.embed([entry_text(entry) for entry in entries])
+        self.documentFrequency += (rows > 0).sum(axis=0)
+        if self.store is not None:
+            start = len(self.store)
+            self.store.append(rows, np.arange(start, start + len(rows)))
+            return
+        needed = self.count + len(rows)
+        if needed > len(self.vectors):
+            # Grow geometrically so a run of single appends stays amortized O(1)
+            grown = np.zeros((max(needed, 2 * len(self.vectors), 64), self.embedder.dim), dtype=np.float32)
+            grown[:self.count] = self.vectors[:self.count]
+            self.vectors = grown
+        self.vectors[self.count:needed] = rows
+        self.count = needed
+
+    def idf(self):
+        return np.log((1 + len(self)) / (1 + self.documentFrequency)) + 1
+
+    def queryVector(self, text):
+        """The unit-length, IDF-weighted embedding of a query"""
+        query = self.embedder.embed([text])[0]
+        if self.embedder.usesIdf:
+            query = query * self.idf()
+        return vector.normalizeRows(query)
+
+    def scores(self, text):
+        """Cosine similarity of text against every stored entry"""
+        return vector.cosineSimilarities(self.matrix(), self.queryVector(text))
+
+    def search(self, text, k, threshold=0.0):
+        """Returns up to k (position, score) pairs scoring at least threshold, best first"""
+        matrix = self.matrix()
+        self.ann.sync(matrix)
+        if self.ann.unsaved and self.store is not None:
+            self.ann.save(VectorIndex.annPath(self.store.path), self.embedder.dim, self.embedder.name)
+        if self.ann.trained:
+            ids, scores = self.ann.search(matrix, self.queryVector(text), k)
+            hits = [(i, score) for i, score in zip(ids, scores) if score >= threshold]
+        else:
+            scores = self.scores(text)
+            hits = [(i, scores[i]) for i in vector.topK(scores, k, threshold)]
+        if self.store is not None:
+            positions = self.store.positions()
+            return [(int(positions[i]), float(score)) for i, score in hits]
+        return [(int(i), float(score)) for i, score in hits]
+
+    def clear(self):
+        if self.store is not None:
+            self.store.compact()
+            if os.path.exists(VectorIndex.annPath(self.store.path)):
+                os.remove(VectorIndex.annPath(self.store.path))
+        self.ann = ann.IVFIndex(nprobe=self.ann.nprobe)
+        self.vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self.count = 0
+        self.documentFrequency[:] = 0
+
+
+######## KEYWORD INDEX ########
+BM25_K1 = 1.5                   # Term frequency saturation
+BM25_B = 0.75                   # Document length normalization
+HYBRID_WEIGHT = 0.5             # Share of the cosine score in a hybrid score (the rest is normalized BM25)
+BM25_LOG_MIN = 256              # Entries appended to the log before it may be folded into the base file
+
+
+class BM25Index:
+    """Inverted index over a hive's history entries, one document per entry in history order, ranked with BM25.
+    Entries are tokenized once, when they are added, and the postings are saved beside the hive file
+    so a restart does not re-tokenize the whole history. persist() appends new entries to a log next to the
+    base file and only rewrites the base once the log has grown as large as it, so saving stays amortized O(1)
+    per entry."""
+    def __init__(self):
+        self.postings = {}      # term -> ([positions], [term frequencies])
+        self.docLengths = []    # tokens per entry
+        self.unsaved = []       # (length, term counts) of entries added since the last persist()
+        self.baseCount = None   # Entries in the base file (the rest are in the log), None until it is written
+
+    def __len__(self):
+        return len(self.docLengths)
+
+    def add(self, entries):
+        for entry in entries:
+            position = len(self.docLengths)
+            counts = {}
+            tokens = tokenize(entry_text(entry))
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            self.addCounts(position, len(tokens), counts)
+            self.unsaved.append((len(tokens), counts))
+
+    def addCounts(self, position, length, counts):
+        for term, tf in counts.items():
+            positions, frequencies = self.postings.setdefault(term, ([], []))
+            positions.append(position)
+            frequencies.append(tf)
+        self.docLengths.append(length)
+
+    def scores(self, text):
+        """BM25 score of text against every stored entry"""
+        count = len(self.docLengths)
+        scores = np.zeros(count, dtype=np.float32)
+        if count == 0:
+            return scores
+        lengths = np.asarray(self.docLengths, dtype=np.float32)
+        averageLength = max(lengths.mean(), 1.0)
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / averageLength)
+        for term in set(tokenize(text)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            positions = np.asarray(posting[0])
+            frequencies = np.asarray(posting[1], dtype=np.float32)
+            idf = np.log(1 + (count - len(positions) + 0.5) / (len(positions) + 0.5))
+            scores[positions] += idf * frequencies * (BM25_K1 + 1) / (frequencies + norms[positions])
+        return scores
+
+    def search(self, text, k, threshold=0.0):
+        """Returns up to k (position, score) pairs, best first. Only entries sharing a term with text are returned;
+        BM25 scores are unbounded, so threshold is not applied to them."""
+        scores = self.scores(text)
+        return [(int(i), float(scores[i])) for i in vector.topK(scores, k) if scores[i] > 0]
+
+    def to_dict(self):
+        return {
+            "docLengths": self.docLengths,
+            "postings": {term: [positions, frequencies] for term, (positions, frequencies) in self.postings.items()}
+        }
+
+    @staticmethod
+    def from_dict(d):
+        index = BM25Index()
+        index.docLengths = d["docLengths"]
+        index.postings = {term: (posting[0], posting[1]) for term, posting in d["postings"].items()}
+        return index
+
+    @staticmethod
+    def logPath(path):
+        return os.path.splitext(path)[0] + ".jsonl"
+
+    def save(self, path):
+        """Writes the whole index to the base file and empties the log"""
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+        os.replace(temp_path, path)
+        if os.path.exists(BM25Index.logPath(path)):
+            os.remove(BM25Index.logPath(path))
+        self.unsaved = []
+        self.baseCount = len(self.docLengths)
+
+    def persist(self, path):
+        """Saves the entries added since the last call: appended to the log, or by rewriting the base file
+        once the log holds as many entries as the base"""
+        if not self.unsaved:
+            return
+        if self.baseCount is None or len(self.docLengths) - self.baseCount > max(BM25_LOG_MIN, self.baseCount):
+            self.save(path)
+            return
+        start = len(self.docLengths) - len(self.unsaved)
+        with open(BM25Index.logPath(path), "a") as f:
+            for position, (length, counts) in enumerate(self.unsaved, start):
+                f.write(json.dumps({"position": position, "length": length, "terms": counts}, separators=(',', ':')) + "\n")
+        self.unsaved = []
+
+    @staticmethod
+    def load(path):
+        """Loads a saved index and replays its log, or returns None if there is none or it cannot be read"""
+        try:
+            with open(path, "r") as f:
+                index = BM25Index.from_dict(json.load(f))
+        except (FileNotFoundError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"[Debug] Ignoring unreadable keyword index {path}: {e}")
+            return None
+        index.baseCount = len(index.docLengths)
+        try:
+            with open(BM25Index.logPath(path), "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # A write cut short by a crash, the entry is re-added from history
+                    if record["position"] == len(index.docLengths):
+                        index.addCounts(record["position"], record["length"], record["terms"])
+        except FileNotFoundError:
+            pass
+        return index
+
+    @staticmethod
+    def delete(path):
+        for file in (path, BM25Index.logPath(path)):
+            if os.path.exists(file):
+                os.remove(file)
+
+
+class HybridRetriever:
+    """Blends cosine similarity with BM25, normalized by the best BM25 score of the query, into one ranking"""
+    def __init__(self, vectorIndex, keywordIndex, weight=HYBRID_WEIGHT):
+        self.vectorIndex = vectorIndex
+        self.keywordIndex = keywordIndex
+        self.weight = weight
+
+    def __len__(self):
+        return len(self.vectorIndex)
+
+    def scores(self, text):
+        cosine = self.vectorIndex.scores(text)
+        keyword = self.keywordIndex.scores(text)
+        best = keyword.max() if len(keyword) else 0
+        if best > 0:
+            keyword = keyword / best
+        return self.weight * cosine + (1 - self.weight) * keyword
+
+    def search(self, text, k, threshold=0.0):
+        scores = self.scores(text)
+        return [(int(i), float(scores[i])) for i in vector.topK(scores, k, threshold)]
@@ -0,0 +1,68 @@
+######## IMPORTS ########
+import time
+
+# Adaptive rate for the canvas timer.
+# The timer used to run at a fixed rate for as long as the app was open, also with the window hidden and
+# no query running. The frame scheduler picks the timer's rate from what is going on:
+#   "active"  a query is in its retrieval, discussion or aggregation phase (and ACTIVE_LINGER seconds after,
+#             so links can fade out smoothly)
+#   "idle"    nothing is happening, the bees only wander
+#   "hidden"  the page is not visible (reported by the browser's visibilitychange event)
+# A rate of 0 pauses the timer until the mode changes.
+
+######## SCHEDULER CONFIGURATION ########
+ACTIVE_LINGER = 2.0             # Seconds the active rate is kept after a query's animation ends
+PAUSED_INTERVAL = 0.5           # How often a paused timer wakes up (without running its callback)
+MAX_FRAME_DT = 0.1              # Longest time step taken at once, e.g. after a pause
+
+
+class FrameScheduler:
+    """Sets the interval of a ui.timer from rates = {"active": fps, "idle": fps, "hidden": fps}"""
+    def __init__(self, rates, linger=ACTIVE_LINGER):
+        self.rates = rates
+        self.linger = linger
+        self.hidden = False
+        self.activeUntil = 0.0
+        self.mode = None
+        self.timer = None
+
+    def attach(self, timer):
+        self.timer = timer
+        self.mode = None
+        self.update()
+
+    def set_hidden(self, hidden):
+        """Called when the browser reports that the page was hidden or shown"""
+        self.hidden = bool(hidden)
+        self.update()
+
+    def wake(self):
+        """Switches to the active rate straight away, e.g. when a query starts while the timer is slow or paused"""
+        self.update(busy=True)
+
+    def update(self, busy=False):
+        """Re-evaluates the mode, busy telling whether a query is animating; called by the timer callback every tick"""
+        now = time.monotonic()
+        if busy:
+            self.activeUntil = now + self.linger
+        if self.hidden:
+            mode = "hidden"
+        elif now < self.activeUntil:
+            mode = "active"
+        else:
+            mode = "idle"
+        if mode != self.mode:
+            self.mode = mode
+            self.apply()
+
+    def apply(self):
+        if self.timer is None:
+            return
+        fps = self.rates[self.mode]
+        if fps > 0:
+            self.timer.interval = 1 / fps
+            self.timer.active = True
+        else:
+            self.timer.interval = PAUSED_INTERVAL
+            self.timer.active = False
+        print(f"[Debug] Canvas timer: {self.mode} ({fps} FPS)" if fps > 0 else f"[Debug] Canvas timer: {self.mode} (paused)")
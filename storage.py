@@ -0,0 +1,323 @@
+######## IMPORTS ########
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Sequence
+
+# Optional SQLite storage backend for hives.
+# Instead of one JSON file (plus history journal) per hive, hives, bees, injections, exchanges and the
+# bees' log entries live in relational tables of a single database in WAL mode. Loading a hive or a page
+# of its history is an indexed lookup instead of a full parse, and history can be searched across hives.
+# Hive.Hive.storage selects the backend: when it is None, hives are stored as JSON files in hives/.
+# Existing JSON hives are copied into a database with migrate_storage.py.
+
+######## STORAGE CONFIGURATION ########
+DATABASE_PATH = "hives/hives.db"
+BUSY_TIMEOUT = 5.0              # Seconds a connection waits for another writer before giving up
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hives (
+    hive_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    settings TEXT NOT NULL,             -- JSON of every other to_dict field (queen, models, flags, digests)
+    last_modified TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bees (
+    hive_id TEXT NOT NULL REFERENCES hives(hive_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    bee_id TEXT,
+    name TEXT,
+    role TEXT,
+    model TEXT,
+    generation TEXT,                    -- JSON
+    PRIMARY KEY (hive_id, position)
+);
+CREATE TABLE IF NOT EXISTS injections (
+    hive_id TEXT NOT NULL REFERENCES hives(hive_id) ON DELETE CASCADE,
+    bee_position INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    injection_id TEXT,
+    behaviour TEXT,
+    interval INTEGER,
+    PRIMARY KEY (hive_id, bee_position, position)
+);
+CREATE TABLE IF NOT EXISTS exchanges (
+    hive_id TEXT NOT NULL REFERENCES hives(hive_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,          -- Index in the hive's history
+    prompt TEXT,
+    response TEXT,
+    n_bees INTEGER,
+    n_rounds INTEGER,
+    timestamp TEXT,
+    extra TEXT,                         -- JSON of any other entry fields, e.g. logsArchived
+    PRIMARY KEY (hive_id, position)
+);
+CREATE TABLE IF NOT EXISTS logs (
+    hive_id TEXT NOT NULL REFERENCES hives(hive_id) ON DELETE CASCADE,
+    exchange INTEGER NOT NULL,          -- exchanges.position
+    position INTEGER NOT NULL,
+    round INTEGER,
+    bee_id TEXT,
+    name TEXT,
+    role TEXT,
+    response TEXT,
+    PRIMARY KEY (hive_id, exchange, position)
+);
+CREATE INDEX IF NOT EXISTS exchanges_by_time ON exchanges (hive_id, timestamp);
+CREATE INDEX IF NOT EXISTS exchanges_by_global_time ON exchanges (timestamp);
+CREATE INDEX IF NOT EXISTS hives_by_modified ON hives (last_modified);
+"""
+
+EXCHANGE_FIELDS = ("prompt", "response", "nBees", "nRounds", "timestamp", "logs")
+
+
+class SQLiteStorage:
+    """Hive storage in one SQLite database. Each thread gets its own connection (the UI reads on the event
+    loop while persistence.PersistenceManager writes on its thread); WAL mode lets them run concurrently."""
+    def __init__(self, path=DATABASE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.local = threading.local()
+        with self.connection() as db:
+            db.executescript(SCHEMA)
+            self.fullText = self._createFullTextIndex(db)
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL: a crash can lose the last commits, never corrupt
+            db.execute("PRAGMA foreign_keys=ON")
+            self.local.db = db
+        return db
+
+    def _createFullTextIndex(self, db):
+        """Full-text index over prompts and responses, if this SQLite build has FTS5"""
+        try:
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS exchanges_fts USING fts5("
+                       "prompt, response, hive_id UNINDEXED, position UNINDEXED)")
+            return True
+        except sqlite3.OperationalError:
+            print("[Debug] SQLite has no FTS5, history search falls back to LIKE scans")
+            return False
+
+    def close(self):
+        db = getattr(self.local, "db", None)
+        if db is not None:
+            db.close()
+            self.local.db = None
+
+    ######## HIVES ########
+    def list_hives(self):
+        """(hiveID, name, lastModified) of every stored hive, most recently modified first"""
+        rows = self.connection().execute("SELECT hive_id, name, last_modified FROM hives ORDER BY last_modified DESC")
+        return rows.fetchall()
+
+    def manifest(self):
+        """Hive.manifestEntry() of every stored hive, most recently modified first, without loading any of them"""
+        rows = self.connection().execute(
+            "SELECT hive_id, name, last_modified, "
+            "(SELECT COUNT(*) FROM bees WHERE bees.hive_id = hives.hive_id), "
+            "(SELECT COUNT(*) FROM exchanges WHERE exchanges.hive_id = hives.hive_id) "
+            "FROM hives ORDER BY last_modified DESC")
+        return [{"hiveID": id, "hiveName": name, "lastModified": lastModified, "nBees": nBees, "historyLength": historyLength}
+                for id, name, lastModified, nBees, historyLength in rows]
+
+    def load_hive(self, id):
+        """The hive's to_dict() (its history is loaded with load_history), or None if there is no such hive"""
+        db = self.connection()
+        row = db.execute("SELECT name, settings, last_modified FROM hives WHERE hive_id = ?", (id,)).fetchone()
+        if row is None:
+            return None
+        d = {"hiveID": id, "hiveName": row[0]}
+        d.update(json.loads(row[1]))
+        d["lastModified"] = row[2]
+
+        injections = {}
+        for beePosition, injectionId, behaviour, interval in db.execute(
+                "SELECT bee_position, injection_id, behaviour, interval FROM injections "
+                "WHERE hive_id = ? ORDER BY bee_position, position", (id,)):
+            injections.setdefault(beePosition, []).append({"id": injectionId, "behaviour": behaviour, "interval": interval})
+        d["bees"] = [
+            {"name": name, "beeId": beeId, "role": role, "model": model,
+             "injections": injections.get(position, []), "generation": json.loads(generation or "{}")}
+            for position, beeId, name, role, model, generation in db.execute(
+                "SELECT position, bee_id, name, role, model, generation FROM bees "
+                "WHERE hive_id = ? ORDER BY position", (id,))
+        ]
+        return d
+
+    def save_hive(self, snapshot):
+        """Writes a Hive.snapshot(): the hive's configuration and bees, and its new exchanges. Like the JSON
+        journal, new exchanges are appended; all of them are rewritten only when the snapshot asks for it.
+        Which exchanges are new is decided from the database, so a retried snapshot never inserts one twice."""
+        config = json.loads(snapshot["config"])
+        settings = {key: value for key, value in config.items()
+                    if key not in ("hiveID", "hiveName", "bees", "lastModified")}
+        id = snapshot["hiveID"]
+        db = self.connection()
+        with db:
+            db.execute("INSERT INTO hives (hive_id, name, settings, last_modified) VALUES (?, ?, ?, ?) "
+                       "ON CONFLICT(hive_id) DO UPDATE SET name = excluded.name, settings = excluded.settings, "
+                       "last_modified = excluded.last_modified",
+                       (id, config["hiveName"], json.dumps(settings), config["lastModified"]))
+            db.execute("DELETE FROM injections WHERE hive_id = ?", (id,))
+            db.execute("DELETE FROM bees WHERE hive_id = ?", (id,))
+            for position, bee in enumerate(config["bees"]):
+                db.execute("INSERT INTO bees VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (id, position, bee["beeId"], bee["name"], bee["role"], bee["model"], json.dumps(bee["generation"])))
+                db.executemany("INSERT INTO injections VALUES (?, ?, ?, ?, ?, ?)",
+                               [(id, position, index, injection["id"], injection["behaviour"], injection["interval"])
+                                for index, injection in enumerate(bee["injections"] or [])])
+
+            # Same as Hive.writeJournal, with the tables standing in for the journal
+            if snapshot["rewrite"]:
+                self._delete_exchanges(db, id)
+                self._insert_exchanges(db, id, 0, snapshot["entries"])
+                return
+            stored = db.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM exchanges WHERE hive_id = ?", (id,)).fetchone()[0]
+            if stored < snapshot["start"]:
+                # Raised so the write is retried and eventually replaced by a full rewrite (see persistence.py)
+                raise ValueError(f"exchanges {stored} to {snapshot['start']} of {id} are missing from the database")
+            skip = stored - snapshot["start"]
+            self._insert_exchanges(db, id, stored, snapshot["entries"][skip:])
+
+    def delete_hive(self, id):
+        db = self.connection()
+        with db:
+            self._delete_exchanges(db, id)
+            db.execute("DELETE FROM hives WHERE hive_id = ?", (id,))
+
+    ######## EXCHANGES ########
+    def _insert_exchanges(self, db, id, start, entries):
+        exchanges = []
+        logs = []
+        for position, entry in enumerate(entries, start):
+            extra = {key: value for key, value in entry.items() if key not in EXCHANGE_FIELDS}
+            exchanges.append((id, position, entry.get("prompt"), entry.get("response"), entry.get("nBees"),
+                              entry.get("nRounds"), entry.get("timestamp"), json.dumps(extra) if extra else None))
+            for index, log in enumerate(entry.get("logs", [])):
+                logs.append((id, position, index, log.get("round"), log.get("beeId"), log.get("name"),
+                             log.get("role"), log.get("response")))
+        db.executemany("INSERT INTO exchanges VALUES (?, ?, ?, ?, ?, ?, ?, ?)", exchanges)
+        db.executemany("INSERT INTO logs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", logs)
+        if self.fullText:
+            db.executemany("INSERT INTO exchanges_fts (prompt, response, hive_id, position) VALUES (?, ?, ?, ?)",
+                           [(row[2], row[3], id, row[1]) for row in exchanges])
+
+    def _delete_exchanges(self, db, id):
+        db.execute("DELETE FROM logs WHERE hive_id = ?", (id,))
+        db.execute("DELETE FROM exchanges WHERE hive_id = ?", (id,))
+        if self.fullText:
+            db.execute("DELETE FROM exchanges_fts WHERE hive_id = ?", (id,))
+
+    def history_count(self, id):
+        return self.connection().execute("SELECT COUNT(*) FROM exchanges WHERE hive_id = ?", (id,)).fetchone()[0]
+
+    def open_history(self, id):
+        """The hive's history as a StoredHistory: only its length is read, entries are read when accessed"""
+        return StoredHistory(self, id, self.history_count(id))
+
+    def load_history(self, id, offset=0, limit=None):
+        """History entries of a hive, in order, starting at position offset (all of them when limit is None)"""
+        db = self.connection()
+        end = offset + limit if limit is not None else None
+        bounds = "position >= ?" + (" AND position < ?" if end is not None else "")
+        params = (id, offset) + ((end,) if end is not None else ())
+
+        logs = {}
+        for exchange, round, beeId, name, role, response in db.execute(
+                "SELECT exchange, round, bee_id, name, role, response FROM logs "
+                "WHERE hive_id = ? AND " + bounds.replace("position", "exchange") + " ORDER BY exchange, position", params):
+            logs.setdefault(exchange, []).append({"round": round, "beeId": beeId, "name": name, "role": role, "response": response})
+
+        history = []
+        for position, prompt, response, nBees, nRounds, timestamp, extra in db.execute(
+                "SELECT position, prompt, response, n_bees, n_rounds, timestamp, extra FROM exchanges "
+                "WHERE hive_id = ? AND " + bounds + " ORDER BY position", params):
+            entry = {"prompt": prompt, "nBees": nBees, "nRounds": nRounds, "logs": logs.get(position, []),
+                     "response": response, "timestamp": timestamp}
+            if extra:
+                entry.update(json.loads(extra))
+            history.append(entry)
+        return history
+
+    def search_history(self, text, hive_id=None, limit=20):
+        """(hiveID, position, prompt, response) of exchanges matching text, in any hive unless hive_id is given.
+        text is plain text, not query syntax: with the FTS5 index every word must occur, otherwise (a LIKE scan)
+        the whole text must occur as it is."""
+        db = self.connection()
+        if self.fullText:
+            # Every word quoted as an FTS5 string, so quotes, '-', ':' and operators in text are searched for literally
+            words = ['"' + word.replace('"', '""') + '"' for word in text.split()]
+            if not words:
+                return []
+            query = ("SELECT hive_id, position, prompt, response FROM exchanges_fts WHERE exchanges_fts MATCH ?"
+                     + (" AND hive_id = ?" if hive_id else "") + " ORDER BY rank LIMIT ?")
+            params = (" ".join(words),) + ((hive_id,) if hive_id else ()) + (limit,)
+        else:
+            pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            query = ("SELECT hive_id, position, prompt, response FROM exchanges "
+                     "WHERE (prompt LIKE ? ESCAPE '\\' OR response LIKE ? ESCAPE '\\')"
+                     + (" AND hive_id = ?" if hive_id else "") + " ORDER BY timestamp DESC LIMIT ?")
+            params = (pattern, pattern) + ((hive_id,) if hive_id else ()) + (limit,)
+        return [(row[0], int(row[1]), row[2], row[3]) for row in db.execute(query, params)]
+
+
+class StoredHistory(Sequence):
+    """A hive's history read from the exchanges table on demand, so opening a hive does not parse all of it.
+    Indexing and slicing are indexed lookups (load_history). Entries appended or replaced since the hive was
+    opened are kept in memory and take precedence, whether or not they have been written yet; everything
+    else is read again on every access rather than cached."""
+    def __init__(self, storage, id, count):
+        self.storage = storage
+        self.id = id
+        self.count = count
+        self.changed = {}       # position -> entry appended or replaced since the hive was opened
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.count)
+            if step != 1:
+                return [self[position] for position in range(start, stop, step)]
+            return self.page(start, stop - start)
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("history position out of range")
+        return self.page(index, 1)[0]
+
+    def __setitem__(self, position, entry):
+        if not 0 <= position < self.count:
+            raise IndexError("history position out of range")
+        self.changed[position] = entry
+
+    def __iter__(self):
+        return iter(self.page(0, self.count))
+
+    def __eq__(self, other):
+        return isinstance(other, (list, StoredHistory)) and len(self) == len(other) and list(self) == list(other)
+
+    def append(self, entry):
+        self.changed[self.count] = entry
+        self.count += 1
+
+    def page(self, offset, limit):
+        """Entries offset to offset + limit (clamped to the history), reading only those not held in memory"""
+        end = min(offset + limit, self.count)
+        if end <= offset:
+            return []
+        positions = range(offset, end)
+        missing = [position for position in positions if position not in self.changed]
+        stored = {}
+        if missing:
+            first = missing[0]
+            stored = dict(enumerate(self.storage.load_history(self.id, first, missing[-1] + 1 - first), first))
+        return [self.changed[position] if position in self.changed else stored[position] for position in positions]
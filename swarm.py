@@ -0,0 +1,244 @@
+######## IMPORTS ########
+import numpy as np
+
+# Vectorized steering for the canvas animation.
+# Bee.update / Queen.update steer one agent at a time in Python, with an O(n^2) neighbour scan and many
+# tiny numpy arrays per frame. The swarm engine keeps the positions, velocities and wander angles of
+# every agent of a hive in contiguous arrays and runs wall avoidance, neighbour avoidance, wander,
+# speed clamping and the border rule for all of them in a few batched operations per tick, with the
+# same formulas and per-agent parameters as the per-object code.
+
+# Per-agent parameters read from the Bee/Queen objects (see Bee.__init__ and Queen.__init__)
+PARAMETERS = ("maxForce", "maxSpeed", "size", "perceptionRadius", "comfortRadius", "wallAvoidanceDistance",
+              "wanderRadius", "wanderDistance", "wanderJitter", "avoidanceWeight")
+
+WALL_WEIGHT = 3.0               # Walls get extra weight, as in navigate()
+MIN_SPEED = 0.001               # Below this an agent wanders off in a random direction
+DENSE_BELOW = 128               # Below this many agents, comparing every pair is cheaper than building the grid
+
+
+class SpatialGrid:
+    """Uniform grid over agent positions with cells as wide as the largest perception radius, so every
+    neighbour of an agent lies in its own cell or one of the 8 around it. Rebuilt once per tick by sorting
+    agents by cell; pairs are then found per cell offset with array operations, in time linear in the
+    number of agents and close pairs rather than quadratic. With wrap=True (the "Wrap" border mode) the
+    grid is a torus of the canvas size and distances are measured across the edges."""
+    def __init__(self, pos, cellSize, w=None, h=None, wrap=False):
+        self.pos = pos
+        self.wrap = wrap and w is not None and h is not None
+        if self.wrap:
+            # Whole cells at least cellSize wide tile the torus, so the seam is no different from any other edge
+            self.size = np.array([w, h], dtype=float)
+            self.shape = np.maximum(np.floor(self.size / cellSize).astype(np.int64), 1)
+            cells = np.floor(pos / (self.size / self.shape)).astype(np.int64) % self.shape
+        else:
+            cells = np.floor(pos / cellSize).astype(np.int64)
+            cells -= cells.min(axis=0) - 1  # Keep a free border of cells so offsets never go negative
+            self.shape = cells.max(axis=0) + 2
+        self.cells = cells
+        keys = self.key(cells)
+        self.order = np.argsort(keys, kind="stable")
+        self.sortedKeys = keys[self.order]
+
+    def key(self, cells):
+        return cells[:, 0] * self.shape[1] + cells[:, 1]
+
+    def offsets(self):
+        """The distinct cell offsets to visit (fewer than 9 when a wrapped grid is under 3 cells wide)"""
+        offsets = {(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+        if self.wrap:
+            offsets = {(dx % self.shape[0], dy % self.shape[1]) for dx, dy in offsets}
+        return sorted(offsets)
+
+    def pairs(self, radius):
+        """(i, j, offset from i to j, squared distance) for every ordered pair closer than radius[i]"""
+        count = len(self.pos)
+        agents = np.arange(count)
+        found = []
+        for dx, dy in self.offsets():
+            target = self.cells + (dx, dy)
+            if self.wrap:
+                target %= self.shape
+            keys = self.key(target)
+            starts = np.searchsorted(self.sortedKeys, keys, side="left")
+            ends = np.searchsorted(self.sortedKeys, keys, side="right")
+            lengths = ends - starts
+            total = int(lengths.sum())
+            if total == 0:
+                continue
+            # Expand every agent against each member of its target cell without a Python loop
+            i = np.repeat(agents, lengths)
+            within = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            j = self.order[np.repeat(starts, lengths) + within]
+            found.append((i, j))
+        if not found:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros((0, 2)), np.zeros(0)
+        i = np.concatenate([pair[0] for pair in found])
+        j = np.concatenate([pair[1] for pair in found])
+        offsets = self.pos[j] - self.pos[i]
+        if self.wrap:
+            offsets -= self.size * np.round(offsets / self.size)  # Shortest way round the torus
+        dist2 = np.einsum("ij,ij->i", offsets, offsets)
+        close = (dist2 < radius[i] ** 2) & (i != j)
+        return i[close], j[close], offsets[close], dist2[close]
+
+
+class SwarmEngine:
+    """Steps a hive's bees and queen together. The arrays are authoritative while the roster is unchanged;
+    after every step the new state is written back to the agents, so get_pos()/get_vel() stay current."""
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.members = []
+        self.roster = ()
+
+    def __len__(self):
+        return len(self.members)
+
+    def sync(self, members):
+        """Loads state and parameters from the agents whenever the set of agents changes"""
+        roster = tuple(id(member) for member in members)
+        if roster == self.roster:
+            return
+        self.members = list(members)
+        self.roster = roster
+        self.pos = np.array([[m.x, m.y] for m in members], dtype=float).reshape(-1, 2)
+        self.vel = np.array([[m.vx, m.vy] for m in members], dtype=float).reshape(-1, 2)
+        self.wanderAngle = np.array([m.wanderAngle for m in members], dtype=float)
+        for name in PARAMETERS:
+            setattr(self, name, np.array([getattr(m, name) for m in members], dtype=float))
+
+    def step(self, members, dt, canvasW=None, canvasH=None, borderType="Bounce"):
+        """Advances every agent by dt seconds, equivalent to update() followed by handleBorders() per agent"""
+        self.sync(members)
+        if not self.members:
+            return
+
+        force = self.avoidNeighbours(canvasW, canvasH, borderType == "Wrap") * self.avoidanceWeight[:, None]
+        if canvasW is not None and canvasH is not None:
+            force += self.avoidWalls(canvasW, canvasH) * WALL_WEIGHT
+        force += self.wander()
+        force = limitRows(force)
+
+        # Scale force by maxForce and apply with dt, then limit velocity to maxSpeed
+        self.vel += force * (self.maxForce * dt)[:, None]
+        speed = np.linalg.norm(self.vel, axis=1)
+        fast = speed > self.maxSpeed
+        self.vel[fast] *= (self.maxSpeed[fast] / speed[fast])[:, None]
+        self.pos += self.vel * dt
+
+        if canvasW is not None and canvasH is not None:
+            self.handleBorders(canvasW, canvasH, borderType)
+        self.writeBack()
+
+    ######## STEERING ########
+    def avoidWalls(self, w, h):
+        """Per-axis push away from walls closer than wallAvoidanceDistance, growing linearly to 1 at the wall"""
+        reach = self.wallAvoidanceDistance[:, None]
+        toFar = np.array([w, h], dtype=float) - self.pos
+        near = np.where(self.pos < reach, 1.0 - self.pos / reach, 0.0)
+        far = np.where(toFar < reach, 1.0 - toFar / reach, 0.0)
+        return near - far
+
+    def neighbourPairs(self, w=None, h=None, wrap=False):
+        """(i, j, offset from i to j, squared distance) for every ordered pair closer than i's perceptionRadius"""
+        if len(self.pos) >= DENSE_BELOW or wrap:
+            grid = SpatialGrid(self.pos, self.perceptionRadius.max(), w, h, wrap)
+            return grid.pairs(self.perceptionRadius)
+        offsets = self.pos[None, :, :] - self.pos[:, None, :]
+        dist2 = np.einsum("ijk,ijk->ij", offsets, offsets)
+        close = dist2 < (self.perceptionRadius ** 2)[:, None]
+        np.fill_diagonal(close, False)
+        i, j = np.nonzero(close)
+        return i, j, offsets[i, j], dist2[i, j]
+
+    def avoidNeighbours(self, w=None, h=None, wrap=False):
+        i, j, offsets, dist2 = self.neighbourPairs(w, h, wrap)
+        comfortZone2 = self.perceptionRadius[i] ** 2    # outer boundary
+        dangerZone2 = self.comfortRadius[i] ** 2        # inner boundary
+        pushStrength = np.minimum((comfortZone2 - dist2) / (comfortZone2 - dangerZone2), 1.0)
+        dist = np.sqrt(dist2)
+        units = np.divide(offsets, dist[:, None], out=np.zeros_like(offsets), where=dist[:, None] > 0)
+        change = np.zeros_like(self.pos)
+        np.add.at(change, i, -units * pushStrength[:, None])
+        return limitRows(change)
+
+    def wander(self):
+        """Spherical-constraint wander: a jittered point on a circle projected ahead of each agent"""
+        self.wanderAngle += self.rng.uniform(-self.wanderJitter, self.wanderJitter)
+        sphere = self.wanderRadius[:, None] * np.column_stack([np.cos(self.wanderAngle), np.sin(self.wanderAngle)])
+
+        speed = np.linalg.norm(self.vel, axis=1)
+        direction = np.divide(self.vel, speed[:, None], out=np.zeros_like(self.vel), where=speed[:, None] >= MIN_SPEED)
+        still = speed < MIN_SPEED
+        if still.any():
+            randomAngle = self.rng.uniform(0, 2 * np.pi, int(still.sum()))
+            direction[still] = np.column_stack([np.cos(randomAngle), np.sin(randomAngle)])
+
+        # Rotate the sphere point into the direction of motion (cos and sin of its angle are the unit direction)
+        rotated = np.column_stack([
+            sphere[:, 0] * direction[:, 0] - sphere[:, 1] * direction[:, 1],
+            sphere[:, 0] * direction[:, 1] + sphere[:, 1] * direction[:, 0]
+        ])
+        return limitRows(direction * self.wanderDistance[:, None] + rotated)
+
+    ######## BORDERS ########
+    def handleBorders(self, w, h, borderType="Bounce"):
+        x, y = self.pos[:, 0], self.pos[:, 1]
+        vx, vy = self.vel[:, 0], self.vel[:, 1]
+        if borderType == "Wrap":
+            outside = (x > w) | (x < 0)
+            x[outside] %= w
+            outside = (y > h) | (y < 0)
+            y[outside] %= h
+        elif borderType == "Bounce":
+            # size is treated as radius (half of sprite width); the wander angle is reset to point away from the wall
+            hitLeft = (x - self.size <= 0) & (vx < 0)
+            hitRight = (x + self.size >= w) & (vx > 0)
+            hit = hitLeft | hitRight
+            x[hitLeft] = self.size[hitLeft]
+            x[hitRight] = w - self.size[hitRight]
+            vx[hit] *= -1
+            self.wanderAngle[hit] = np.arctan2(vy[hit], vx[hit])
+
+            hitTop = (y - self.size <= 0) & (vy < 0)
+            hitBottom = (y + self.size >= h) & (vy > 0)
+            hit = hitTop | hitBottom
+            y[hitTop] = self.size[hitTop]
+            y[hitBottom] = h - self.size[hitBottom]
+            vy[hit] *= -1
+            self.wanderAngle[hit] = np.arctan2(vy[hit], vx[hit])
+
+    def writeBack(self):
+        for member, (x, y), (vx, vy), angle in zip(self.members, self.pos.tolist(), self.vel.tolist(), self.wanderAngle.tolist()):
+            member.x = x
+            member.y = y
+            member.vx = vx
+            member.vy = vy
+            member.wanderAngle = angle
+
+
+def rosterEntry(member):
+    """What the browser needs to simulate an agent itself (see swarmRoster in ui_utils.CANVAS_JS): identity, state,
+    steering parameters and current motion (x and y are None until the agent has been placed)"""
+    entry = {
+        "id": member.get_beeId(),
+        "name": member.get_name(),
+        "role": member.get_role(),
+        "state": member.get_state(),
+        "x": member.x,
+        "y": member.y,
+        "vx": member.vx,
+        "vy": member.vy,
+        "wanderAngle": member.wanderAngle
+    }
+    for name in PARAMETERS:
+        entry[name] = getattr(member, name)
+    return entry
+
+
+def limitRows(vectors):
+    """Scales rows longer than 1 down to unit length"""
+    norms = np.linalg.norm(vectors, axis=1)
+    long = norms > 1
+    vectors[long] /= norms[long][:, None]
+    return vectors
@@ -0,0 +1,72 @@
+"""Benchmark of the canvas swarm step (swarm.py): spatial grid versus all-pairs neighbour search.
+
+Agents are scattered over a canvas that grows with their number, so the crowding (and the number of
+neighbours each agent sees) stays like that of a normal hive. Reports the mean cost of a neighbour query
+for all agents and of a whole engine step, per tick and per agent.
+
+    python swarm_benchmark.py                      # 10 to 2,000 agents
+    python swarm_benchmark.py --sizes 100 1000 --border Wrap
+"""
+######## IMPORTS ########
+import argparse
+import time
+import numpy as np
+import Bee
+import Queen
+import swarm
+
+
+def make_members(count, side, rng):
+    members = [Bee.Bee(f"Bee {i}", "benchmark") for i in range(count - 1)] + [Queen.Queen()]
+    for member in members:
+        member.x, member.y = rng.uniform(0, side, 2)
+    return members
+
+
+def dense_pairs(engine):
+    """All-pairs neighbour search, the engine's path for small swarms"""
+    offsets = engine.pos[None, :, :] - engine.pos[:, None, :]
+    dist2 = np.einsum("ijk,ijk->ij", offsets, offsets)
+    close = dist2 < (engine.perceptionRadius ** 2)[:, None]
+    np.fill_diagonal(close, False)
+    return np.nonzero(close)
+
+
+def timed(function, ticks):
+    started = time.perf_counter()
+    for _ in range(ticks):
+        function()
+    return (time.perf_counter() - started) / ticks * 1000
+
+
+def run(count, spacing, ticks, border, rng):
+    side = spacing * np.sqrt(count)
+    members = make_members(count, side, rng)
+    engine = swarm.SwarmEngine(seed=0)
+    engine.sync(members)
+    wrap = border == "Wrap"
+
+    grid_ms = timed(lambda: swarm.SpatialGrid(engine.pos, engine.perceptionRadius.max(), side, side, wrap).pairs(engine.perceptionRadius), ticks)
+    dense_ms = timed(lambda: dense_pairs(engine), ticks) if count <= 5000 else float("nan")
+    step_ms = timed(lambda: engine.step(members, 1 / 60, side, side, border), ticks)
+    pairs = len(engine.neighbourPairs(side, side, wrap)[0])
+    print(f"{count:>8,}{pairs / count:>12.1f}{dense_ms:>12.3f}{grid_ms:>12.3f}{step_ms:>12.3f}{step_ms / count * 1000:>14.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 100, 250, 500, 1000, 2000])
+    parser.add_argument("--spacing", type=float, default=120, help="canvas side per sqrt(agent), in pixels")
+    parser.add_argument("--ticks", type=int, default=50)
+    parser.add_argument("--border", choices=["Bounce", "Wrap"], default="Bounce")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'agents':>8}{'neighbours':>12}{'dense ms':>12}{'grid ms':>12}{'step ms':>12}{'step us/agent':>14}")
+    for count in args.sizes:
+        run(count, args.spacing, args.ticks, args.border, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -426,6 +426,277 @@ function renderBees(data) {
         }
     }
 }
+
+// ================= RENDER PROTOCOL =================
+// With the simulation on the server (CLIENT_SIMULATION off in app.py) onTimer sends render_protocol.py messages:
+// the roster (ids, names, roles, sizes) once per change, then frames with packed positions and velocities and
+// only the bee states and animation that changed. They are applied here and drawn with renderBees.
+const RENDER_PROTOCOL_VERSION = 1;
+let renderRosterVersion = 0;
+let renderRosterIds = [];
+let renderState = {};              // beeId -> {name, role, size, state, x, y, vx, vy}
+let renderAnimState = { phase: "idle", links: [] };
+
+function renderRoster(message) {
+    if (message.v !== RENDER_PROTOCOL_VERSION) {
+        console.warn("Unsupported render protocol version", message.v);
+        return;
+    }
+    const bees = {};
+    for (const bee of message.bees) {
+        bees[bee.id] = Object.assign(renderState[bee.id] || {}, { name: bee.name, role: bee.role, size: bee.size });
+    }
+    renderState = bees;
+    renderRosterIds = message.bees.map(bee => bee.id);
+    renderRosterVersion = message.r;
+}
+
+function renderFrame(message) {
+    if (message.v !== RENDER_PROTOCOL_VERSION || message.r !== renderRosterVersion) return;  // Frame for another roster
+    if (message.p) {
+        renderRosterIds.forEach((id, i) => {
+            const bee = renderState[id];
+            bee.x = message.p[4 * i];
+            bee.y = message.p[4 * i + 1];
+            bee.vx = message.p[4 * i + 2];
+            bee.vy = message.p[4 * i + 3];
+        });
+    }
+    if (message.s) {
+        for (const [index, state] of Object.entries(message.s)) {
+            const bee = renderState[renderRosterIds[index]];
+            if (bee) bee.state = state;
+        }
+    }
+    if (message.a) renderAnimState = message.a;
+    renderBees({ bees: { ...renderState }, animation: renderAnimState });  // A new object, so link positions are refreshed
+}
+
+// ================= CLIENT-SIDE SWARM =================
+// With CLIENT_SIMULATION on in app.py the bees are steered here, once per display frame, with the same
+// rules as swarm.py (wall avoidance, neighbour avoidance, wander, speed limit, and the "Bounce" or "Wrap"
+// border of BORDER_TYPE in app.py, where distances are measured across the edges). The server only
+// sends roster changes (swarmRoster), bee state changes (swarmStates) and link animations (swarmAnimation),
+// so websocket traffic and server CPU no longer depend on the frame rate. The frame rate is capped at the
+// FRAME_RATES entry for the server's scheduler mode (swarmFrameRate); at 0, or without agents, no frames
+// are requested at all until the cap or the roster changes.
+const SWARM_SPAWN_MARGIN = 30;
+const SWARM_WALL_WEIGHT = 3.0;
+const SWARM_MAX_DT = 0.1;          // Longest step taken at once, e.g. after the tab was in the background
+const SWARM_DENSE_BELOW = 128;     // Below this many agents every pair is compared, above it a spatial grid is used (as in swarm.py)
+const SWARM_FRAME_SLACK = 2;       // Milliseconds a display frame may come early and still be drawn under the cap
+const SWARM_FIELDS = ["name", "role", "state", "size", "maxForce", "maxSpeed", "perceptionRadius", "comfortRadius",
+                      "wallAvoidanceDistance", "wanderRadius", "wanderDistance", "wanderJitter", "avoidanceWeight"];
+let swarmAgents = {};              // beeId -> {SWARM_FIELDS..., x, y, vx, vy, wanderAngle}
+let swarmAnimState = { phase: "idle", links: [] };
+let swarmBorder = "Bounce";        // "Bounce" or "Wrap", as in swarm.SwarmEngine.step
+let swarmFps = 0;                  // Frame rate cap sent by the server, 0 pauses the simulation
+let swarmRunning = false;
+let swarmLastTime = null;          // When the last frame was drawn
+
+function swarmRoster(roster, borderType) {
+    // Agents already on the canvas keep their motion; new ones start where the server put them, or at random
+    if (borderType) swarmBorder = borderType;
+    const agents = {};
+    for (const member of roster) {
+        const agent = swarmAgents[member.id] || {
+            x: member.x, y: member.y, vx: member.vx, vy: member.vy, wanderAngle: member.wanderAngle
+        };
+        for (const key of SWARM_FIELDS) {
+            agent[key] = member[key];
+        }
+        agents[member.id] = agent;
+    }
+    swarmAgents = agents;
+    swarmStart();
+}
+
+function swarmFrameRate(fps) {
+    swarmFps = fps;
+    swarmStart();
+}
+
+function swarmStart() {
+    if (swarmRunning || swarmFps <= 0) return;
+    swarmRunning = true;
+    swarmLastTime = null;  // No time passes while paused
+    requestAnimationFrame(swarmFrame);
+}
+
+function swarmStates(states) {
+    for (const [id, state] of Object.entries(states)) {
+        if (swarmAgents[id]) swarmAgents[id].state = state;
+    }
+}
+
+function swarmAnimation(animState) {
+    swarmAnimState = animState;
+}
+
+function swarmLimit(x, y) {
+    const m2 = x * x + y * y;
+    if (m2 > 1) {
+        const m = Math.sqrt(m2);
+        return [x / m, y / m];
+    }
+    return [x, y];
+}
+
+function swarmNeighbourCells(agents, w, h, wrap) {
+    // For every agent, the groups of agents that can be within its perception radius. Like swarm.SpatialGrid:
+    // cells as wide as the largest perception radius, so every neighbour is in the agent's cell or one of the
+    // 8 around it, which keeps a frame linear in the number of agents instead of quadratic. With wrap the
+    // grid is a torus of whole cells tiling the canvas
+    if (agents.length < SWARM_DENSE_BELOW) return agents.map(() => [agents]);
+    const size = Math.max(1, ...agents.map(agent => agent.perceptionRadius));
+    const cols = Math.max(Math.floor(w / size), 1), rows = Math.max(Math.floor(h / size), 1);
+    const cellW = wrap ? w / cols : size, cellH = wrap ? h / rows : size;
+    const cellOf = (gx, gy) => wrap ? [((gx % cols) + cols) % cols, ((gy % rows) + rows) % rows] : [gx, gy];
+    const grid = new Map();
+    const cells = agents.map(agent => {
+        const cell = cellOf(Math.floor(agent.x / cellW), Math.floor(agent.y / cellH));
+        const key = cell[0] * 65536 + cell[1];
+        if (!grid.has(key)) grid.set(key, []);
+        grid.get(key).push(agent);
+        return cell;
+    });
+    return cells.map(([gx, gy]) => {
+        const keys = new Set();  // A wrapped grid under 3 cells wide reaches the same cell from two sides
+        for (let dx = -1; dx <= 1; dx++) {
+            for (let dy = -1; dy <= 1; dy++) {
+                const [cx, cy] = cellOf(gx + dx, gy + dy);
+                keys.add(cx * 65536 + cy);
+            }
+        }
+        return [...keys].map(key => grid.get(key)).filter(members => members);
+    });
+}
+
+function swarmForce(agent, neighbourCells, w, h, wrap) {
+    // Neighbour avoidance
+    let cx = 0, cy = 0;
+    const comfortZone2 = agent.perceptionRadius * agent.perceptionRadius;
+    const dangerZone2 = agent.comfortRadius * agent.comfortRadius;
+    for (const cell of neighbourCells) {
+        for (const other of cell) {
+            if (other === agent) continue;
+            let dx = other.x - agent.x, dy = other.y - agent.y;
+            if (wrap) {
+                // The nearest copy of the other agent on the torus
+                dx -= w * Math.round(dx / w);
+                dy -= h * Math.round(dy / h);
+            }
+            const mag2 = dx * dx + dy * dy;
+            if (mag2 < comfortZone2 && mag2 > 0) {
+                const push = Math.min((comfortZone2 - mag2) / (comfortZone2 - dangerZone2), 1);
+                const mag = Math.sqrt(mag2);
+                cx -= dx / mag * push;
+                cy -= dy / mag * push;
+            }
+        }
+    }
+    [cx, cy] = swarmLimit(cx, cy);
+    let fx = cx * agent.avoidanceWeight, fy = cy * agent.avoidanceWeight;
+
+    // Wall avoidance
+    const reach = agent.wallAvoidanceDistance;
+    if (agent.x < reach) fx += (1 - agent.x / reach) * SWARM_WALL_WEIGHT;
+    if (w - agent.x < reach) fx -= (1 - (w - agent.x) / reach) * SWARM_WALL_WEIGHT;
+    if (agent.y < reach) fy += (1 - agent.y / reach) * SWARM_WALL_WEIGHT;
+    if (h - agent.y < reach) fy -= (1 - (h - agent.y) / reach) * SWARM_WALL_WEIGHT;
+
+    // Wander: a jittered point on a circle projected ahead of the agent
+    agent.wanderAngle += (Math.random() * 2 - 1) * agent.wanderJitter;
+    const sx = agent.wanderRadius * Math.cos(agent.wanderAngle);
+    const sy = agent.wanderRadius * Math.sin(agent.wanderAngle);
+    const speed = Math.sqrt(agent.vx * agent.vx + agent.vy * agent.vy);
+    let ux, uy;
+    if (speed < 0.001) {
+        const angle = Math.random() * 2 * Math.PI;
+        ux = Math.cos(angle);
+        uy = Math.sin(angle);
+    } else {
+        ux = agent.vx / speed;
+        uy = agent.vy / speed;
+    }
+    const [wx, wy] = swarmLimit(ux * agent.wanderDistance + sx * ux - sy * uy,
+                                uy * agent.wanderDistance + sx * uy + sy * ux);
+    return swarmLimit(fx + wx, fy + wy);
+}
+
+function swarmStep(dt, w, h) {
+    const agents = Object.values(swarmAgents);
+    for (const agent of agents) {
+        if (agent.x == null || agent.y == null) {
+            agent.x = SWARM_SPAWN_MARGIN + Math.random() * (w - 2 * SWARM_SPAWN_MARGIN);
+            agent.y = SWARM_SPAWN_MARGIN + Math.random() * (h - 2 * SWARM_SPAWN_MARGIN);
+        }
+    }
+    // Forces first, from the positions at the start of the frame, then motion
+    const wrap = swarmBorder === "Wrap";
+    const neighbourCells = swarmNeighbourCells(agents, w, h, wrap);
+    const forces = agents.map((agent, i) => swarmForce(agent, neighbourCells[i], w, h, wrap));
+    agents.forEach((agent, i) => {
+        agent.vx += forces[i][0] * agent.maxForce * dt;
+        agent.vy += forces[i][1] * agent.maxForce * dt;
+        const speed = Math.sqrt(agent.vx * agent.vx + agent.vy * agent.vy);
+        if (speed > agent.maxSpeed) {
+            agent.vx *= agent.maxSpeed / speed;
+            agent.vy *= agent.maxSpeed / speed;
+        }
+        agent.x += agent.vx * dt;
+        agent.y += agent.vy * dt;
+
+        if (swarmBorder === "Wrap") {
+            if (agent.x > w || agent.x < 0) agent.x = ((agent.x % w) + w) % w;
+            if (agent.y > h || agent.y < 0) agent.y = ((agent.y % h) + h) % h;
+            return;
+        }
+        // Bounce, resetting the wander angle to point away from the wall
+        const hitLeft = agent.x - agent.size <= 0 && agent.vx < 0;
+        const hitRight = agent.x + agent.size >= w && agent.vx > 0;
+        if (hitLeft || hitRight) {
+            agent.x = hitLeft ? agent.size : w - agent.size;
+            agent.vx *= -1;
+            agent.wanderAngle = Math.atan2(agent.vy, agent.vx);
+        }
+        const hitTop = agent.y - agent.size <= 0 && agent.vy < 0;
+        const hitBottom = agent.y + agent.size >= h && agent.vy > 0;
+        if (hitTop || hitBottom) {
+            agent.y = hitTop ? agent.size : h - agent.size;
+            agent.vy *= -1;
+            agent.wanderAngle = Math.atan2(agent.vy, agent.vx);
+        }
+    });
+}
+
+function swarmFrame(now) {
+    if (swarmFps <= 0) {
+        swarmRunning = false;  // Paused until swarmFrameRate raises the cap
+        return;
+    }
+    if (swarmLastTime !== null && now - swarmLastTime < 1000 / swarmFps - SWARM_FRAME_SLACK) {
+        requestAnimationFrame(swarmFrame);  // Too early for the cap, skip this display frame
+        return;
+    }
+    const canvas = document.getElementById('myCanvas');
+    if (canvas && canvas.width > 2 * SWARM_SPAWN_MARGIN && canvas.height > 2 * SWARM_SPAWN_MARGIN) {
+        const dt = swarmLastTime === null ? 0 : Math.min((now - swarmLastTime) / 1000, SWARM_MAX_DT);
+        swarmStep(dt, canvas.width, canvas.height);
+        renderBees({ bees: { ...swarmAgents }, animation: swarmAnimState });  // A new object, so link positions are refreshed
+    }
+    swarmLastTime = now;
+    if (Object.keys(swarmAgents).length === 0) {
+        swarmRunning = false;  // Nothing moves, the empty canvas was drawn once; swarmRoster starts the frames again
+        return;
+    }
+    requestAnimationFrame(swarmFrame);
+}
+// ================= PAGE VISIBILITY =================
+// Lets the server's frame scheduler (scheduler.py) pause the canvas timer while the page is hidden
+document.addEventListener('visibilitychange', () => {
+    emitEvent('canvas_visibility', { hidden: document.hidden });
+});
 </script>
 '''
 
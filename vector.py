@@ -45,4 +45,33 @@ def accumulate(accumulatorVector, vectorToAdd):
         c = ssq(accumulatorVector) - 1
         t = (-b + np.sqrt(b**2 - 4*a*c)) / (2*a)
         accumulatorVector[:] += t * vectorToAdd
-        return 1
\ No newline at end of file
+        return 1
+
+def normalizeRows(matrix):
+    """Scale every row of a matrix to unit length (zero rows are left as they are)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+def cosineSimilarities(matrix, v):
+    """Cosine similarity of v against every row of a matrix whose rows are already unit length."""
+    mag = magnitude(v)
+    if mag == 0 or len(matrix) == 0:
+        return np.zeros(len(matrix), dtype=np.float32)
+    # Keep the query in float32 so the product does not upcast the whole matrix
+    return matrix @ (np.asarray(v) / mag).astype(np.float32)
+
+def topK(scores, k, threshold=None):
+    """Indices of the k highest scores (at or above threshold if given), best first."""
+    scores = np.asarray(scores)
+    if threshold is not None:
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(len(scores))
+    if k <= 0 or len(candidates) == 0:
+        return np.array([], dtype=int)
+    if len(candidates) > k:
+        # argpartition keeps this linear in the number of scores rather than a full sort
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]